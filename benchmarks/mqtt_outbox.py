@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+utils_folder = os.path.join(current_dir, '..', 'boot', 'services', 'utils')
+sys.path.append(utils_folder)
+
+from mqtt_store import DiskOutbox
+
+parser = argparse.ArgumentParser(description="Throughput and post-outage replay speed of the disk-backed MQTT outbox")
+parser.add_argument("--messages", type=int, default=1000, help="Messages per phase")
+parser.add_argument("--rtt", type=float, default=0.05, help="Stand-in broker PUBACK delay in seconds")
+parser.add_argument("--replay-rate", type=float, nargs="+", default=[50, 500, 0], help="Replay rates to try (0 = unlimited)")
+parser.add_argument("--max-inflight", type=int, default=20, help="Unacknowledged messages at a time")
+args = parser.parse_args()
+
+
+class StandInBroker:
+    """paho-like client: publish() returns a mid at once and the PUBACK arrives `rtt` seconds later."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.online = threading.Event()
+        self.outbox = None
+        self.received = 0
+        self._mid = 0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        self.online.wait()
+        return self
+
+    def publish(self, topic, payload, qos=0):
+        with self._lock:
+            self._mid += 1
+            mid = self._mid
+            self.received += 1
+        timer = threading.Timer(self.rtt, self.outbox.acknowledge, args=(mid,))
+        timer.daemon = True
+        timer.start()
+        return 0, mid
+
+
+def payload(index):
+    return json.dumps({"timestamp": index, "count": {"car": index % 7, "person": index % 3}}).encode()
+
+
+def run(replay_rate):
+    broker = StandInBroker(args.rtt)
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = DiskOutbox(os.path.join(directory, "outbox.db"), broker.connect,
+                            replay_rate=replay_rate, max_inflight=args.max_inflight)
+        broker.outbox = outbox
+
+        # Broker down: everything is stored
+        started = time.perf_counter()
+        for index in range(args.messages):
+            outbox.put("traffic/bench", payload(index))
+        stored = time.perf_counter() - started
+
+        # Broker back: time until the backlog is acknowledged
+        started = time.perf_counter()
+        broker.online.set()
+        outbox.flush()
+        replayed = time.perf_counter() - started
+
+        # Broker up: live messages go straight through
+        started = time.perf_counter()
+        for index in range(args.messages):
+            outbox.put("traffic/bench", payload(index))
+        outbox.flush()
+        live = time.perf_counter() - started
+
+    rate = f"{replay_rate:g}/s" if replay_rate else "unlimited"
+    print(f"replay {rate:>9}: store {args.messages / stored:8.0f} msg/s, "
+          f"replay {args.messages / replayed:6.0f} msg/s, live {args.messages / live:6.0f} msg/s, "
+          f"sent {broker.received} for {2 * args.messages}")
+
+
+if __name__ == "__main__":
+    for replay_rate in args.replay_rate:
+        run(replay_rate)
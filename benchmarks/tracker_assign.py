@@ -0,0 +1,90 @@
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'tracker'))
+
+import tracker as tracker_module
+from tracker import Tracker
+
+parser = argparse.ArgumentParser(description="Per-update time and ID switches of the centroid tracker")
+parser.add_argument("--objects", type=int, nargs="+", default=[10, 100, 1000], help="Objects per frame")
+parser.add_argument("--frames", type=int, default=50, help="Frames per run")
+parser.add_argument("--width", type=int, default=1920, help="Scene width in px")
+parser.add_argument("--height", type=int, default=1080, help="Scene height in px")
+parser.add_argument("--speed", type=float, default=8.0, help="Max movement per frame in px")
+args = parser.parse_args()
+
+
+class LoopTracker:
+    """The previous tracker: first stored center under 35 px wins, in nested Python loops."""
+
+    def __init__(self):
+        self.center_points = {}
+        self.id_count = 0
+
+    def update(self, objects_rect):
+        objects_bbs_ids = []
+        for rect in objects_rect:
+            x, y, w, h = rect
+            cx = (x + x + w) // 2
+            cy = (y + y + h) // 2
+            same_object_detected = False
+            for id, pt in self.center_points.items():
+                if math.hypot(cx - pt[0], cy - pt[1]) < 35:
+                    self.center_points[id] = (cx, cy)
+                    objects_bbs_ids.append([x, y, w, h, id])
+                    same_object_detected = True
+                    break
+            if same_object_detected is False:
+                self.center_points[self.id_count] = (cx, cy)
+                objects_bbs_ids.append([x, y, w, h, self.id_count])
+                self.id_count += 1
+        self.center_points = {object_id: self.center_points[object_id] for *_, object_id in objects_bbs_ids}
+        return objects_bbs_ids
+
+
+def scene(objects, rng):
+    """Boxes of `objects` objects moving for args.frames frames, shuffled each frame."""
+    positions = rng.uniform((0, 0), (args.width - 40, args.height - 40), (objects, 2))
+    velocity = rng.uniform(-args.speed, args.speed, (objects, 2))
+    frames = []
+    for _ in range(args.frames):
+        positions = np.clip(positions + velocity, 0, (args.width - 40, args.height - 40))
+        order = rng.permutation(objects)
+        rects = np.hstack([positions[order], np.full((objects, 2), 40.0)]).astype(int).tolist()
+        frames.append((order, rects))
+    return frames
+
+
+def measure(name, tracker, frames):
+    previous = {}
+    switches = 0
+    started = time.perf_counter()
+    for order, rects in frames:
+        tracked = tracker.update(rects)
+        for truth, (*_, object_id) in zip(order.tolist(), tracked):
+            if truth in previous and previous[truth] != object_id:
+                switches += 1
+            previous[truth] = object_id
+    elapsed = time.perf_counter() - started
+    print(f"{name:>10}: {elapsed / len(frames) * 1000:9.2f} ms/update, {switches:6d} ID switches")
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    assignment = tracker_module.linear_sum_assignment
+    for objects in args.objects:
+        print(f"{objects} objects, {args.frames} frames")
+        frames = scene(objects, rng)
+        measure("loop", LoopTracker(), frames)
+        tracker_module.linear_sum_assignment = None
+        measure("greedy", Tracker(), frames)
+        tracker_module.linear_sum_assignment = assignment
+        if assignment is not None:
+            measure("optimal", Tracker(), frames)
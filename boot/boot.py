@@ -3,7 +3,21 @@ import os
 import sys
 import time
 import signal
+
+# Before importing utils: it imports its sibling modules (httpclient) by bare name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services', 'utils'))
 from services.utils import utils
+from framering import ring_name_for
+
+# Seconds to wait for a shared frame ring before starting its consumers
+RING_STARTUP_TIMEOUT = 30
+# Seconds to wait for the inference server to load its model
+INFERENCE_STARTUP_TIMEOUT = 120
+# Same default as inference_server.DEFAULT_SOCKET (not imported to keep OpenCV out of this process)
+INFERENCE_SOCKET = "/tmp/adboard-inference.sock"
+# Services that decode their stream continuously and so share a frameCapture ring; billboard
+# monitoring only needs a keyframe now and then and takes its own snapshots
+CONTINUOUS_SERVICES = {"trafficMonitoring", "monitoring"}
 
 # Dictionary to track running child processes
 processes = {}
@@ -29,6 +43,65 @@ def handle_signal(sig, frame):
     print(f"Received signal {sig}. Stopping all processes.")
     terminate_all()
 
+def capture_args(capture_config):
+    """Translate the optional "capture" config section into frameCapture arguments."""
+    capture_config = capture_config or {}
+    arguments = ["--backend", capture_config.get("backend", "opencv")]
+    for key, flag in (("fps", "--fps"), ("width", "--width"), ("height", "--height"), ("pixelFormat", "--pix-fmt")):
+        if capture_config.get(key):
+            arguments += [flag, str(capture_config[key])]
+    return arguments
+
+def start_frame_capture(python_path, base_dir, rtsp_url, capture_config=None):
+    """Start one decoder process that shares frames for `rtsp_url` with every service using it."""
+    ring_name = ring_name_for(rtsp_url)
+    service_dir = os.path.join(base_dir, 'services', 'frameCapture')
+    file_path = os.path.join(service_dir, "main.py")
+    log_file = os.path.join(service_dir, "frameCapture.log")
+
+    print(f"Starting shared frame capture {ring_name}")
+    with open(log_file, "a") as log:
+        process = subprocess.Popen(
+            [python_path, file_path, "--url", rtsp_url] + capture_args(capture_config),
+            stdout=log, stderr=log, close_fds=True
+        )
+        processes[f"frameCapture:{ring_name}"] = process
+
+    # Wait for the first frame so consumers attach to the ring instead of opening the stream
+    deadline = time.time() + RING_STARTUP_TIMEOUT
+    while time.time() < deadline and process.poll() is None:
+        if os.path.exists(f"/dev/shm/{ring_name}"):
+            return True
+        time.sleep(0.5)
+    print(f"Shared frame ring {ring_name} not ready, services will open the stream directly")
+    return False
+
+def start_inference_server(python_path, base_dir, server_config):
+    """Start the device's inference server, which loads each model once for every service."""
+    socket_path = server_config.get("socket", INFERENCE_SOCKET)
+    service_dir = os.path.join(base_dir, 'services', 'inferenceServer')
+    file_path = os.path.join(service_dir, "main.py")
+    log_file = os.path.join(service_dir, "inferenceServer.log")
+
+    print(f"Starting inference server on {socket_path}")
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # Left behind by a crashed server
+    with open(log_file, "a") as log:
+        process = subprocess.Popen(
+            [python_path, file_path, "--socket", socket_path],
+            stdout=log, stderr=log, close_fds=True
+        )
+        processes["inferenceServer"] = process
+
+    # Services fall back to a local model if the socket is not there yet, so wait for it
+    deadline = time.time() + INFERENCE_STARTUP_TIMEOUT
+    while time.time() < deadline and process.poll() is None:
+        if os.path.exists(socket_path):
+            return True
+        time.sleep(0.5)
+    print("Inference server not ready, services will load their own models")
+    return False
+
 def main():
     try:
         # Register signal handlers (so Ctrl+C or system kill stops all processes)
@@ -52,6 +125,20 @@ def main():
             print("Failed to load configuration or missing 'services'. Exiting...")
             return
 
+        # Decode each continuously watched RTSP stream once and share the frames between services
+        if config.get("sharedCapture", True):
+            stream_urls = {
+                details.get("rtspStreamUrl")
+                for service_name, details in config["services"].items()
+                if service_name in CONTINUOUS_SERVICES and details and details.get("rtspStreamUrl")
+            }
+            for rtsp_url in stream_urls:
+                start_frame_capture(python_path, base_dir, rtsp_url, config.get("capture"))
+
+        # One process owns the detection models when configured ("detector": {"backend": "remote"} in services)
+        if config.get("inferenceServer"):
+            start_inference_server(python_path, base_dir, config["inferenceServer"])
+
         # Start child processes
         for service_name, service_details in config["services"].items():
             if not service_details:
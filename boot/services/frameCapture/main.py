@@ -0,0 +1,90 @@
+import cv2
+import argparse
+import logging
+import os
+import sys
+import time
+import signal
+import datetime
+import pytz
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+adjacent_folder = os.path.join(current_dir, '..', 'utils')
+sys.path.append(adjacent_folder)
+
+from framering import FrameRingWriter, ring_name_for, DEFAULT_SLOTS
+from capture import FFmpegCapture
+from metrics import Metrics
+
+# Argument parser for command-line parameters
+parser = argparse.ArgumentParser(description="Decode an RTSP stream once and share frames with co-located services")
+parser.add_argument("--url", required=True, help="RTSP stream URL to decode")
+parser.add_argument("--slots", type=int, default=DEFAULT_SLOTS, help="Number of frames kept in the shared ring")
+parser.add_argument("--backend", choices=["opencv", "ffmpeg"], default="opencv", help="Decoder used for the stream")
+parser.add_argument("--fps", type=float, default=None, help="Frames per second to keep (ffmpeg backend)")
+parser.add_argument("--width", type=int, default=None, help="Output width (ffmpeg backend)")
+parser.add_argument("--height", type=int, default=None, help="Output height (ffmpeg backend)")
+parser.add_argument("--pix-fmt", default="bgr24", help="Pixel format on ffmpeg's pipe, frames are converted to BGR (ffmpeg backend)")
+args = parser.parse_args()
+
+# Configure logging with IST timezone
+ist_tz = pytz.timezone('Asia/Kolkata')
+logging.Formatter.converter = lambda *args: datetime.datetime.now(ist_tz).timetuple()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s IST - %(levelname)s - %(message)s')
+
+RETRY_DELAY = 10
+
+
+def open_stream():
+    """Open the stream with the decoder selected on the command line."""
+    if args.backend == "ffmpeg":
+        try:
+            size = (args.width, args.height) if args.width and args.height else None
+            return FFmpegCapture(args.url, fps=args.fps, size=size, pix_fmt=args.pix_fmt)
+        except Exception as e:
+            logging.error(f"Unable to start ffmpeg capture: {e}")
+    return cv2.VideoCapture(args.url)
+
+
+def main():
+    # Exit through the finally block on SIGTERM so the ring gets unlinked
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+
+    ring_name = ring_name_for(args.url)
+    writer = None
+    Metrics.start_reporter(300)
+
+    try:
+        while True:
+            cap = open_stream()
+            if not cap.isOpened():
+                logging.warning(f"Failed to open video stream, retrying in {RETRY_DELAY} seconds")
+                time.sleep(RETRY_DELAY)
+                continue
+
+            logging.info(f"Connected to video stream, publishing frames to {ring_name}")
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+
+                if writer is None:
+                    writer = FrameRingWriter(ring_name, frame.shape, args.slots)
+                    Metrics.record_startup("frame-capture")
+                elif writer.shape != frame.shape:
+                    # The camera changed resolution
+                    writer.close()
+                    writer = FrameRingWriter(ring_name, frame.shape, args.slots)
+
+                writer.write(frame)
+
+            logging.warning("Lost connection to video stream")
+            cap.release()
+            time.sleep(1)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import logging
+import os
+import sys
+import signal
+import datetime
+import pytz
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+adjacent_folder = os.path.join(current_dir, '..', 'utils')
+sys.path.append(adjacent_folder)
+
+import utils
+from inference_server import InferenceServer, DEFAULT_SOCKET, DEFAULT_BATCH_WINDOW, DEFAULT_MAX_BATCH
+from metrics import Metrics
+
+# Argument parser for command-line parameters
+parser = argparse.ArgumentParser(description="Serve YOLO inference to every service on this device")
+parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket to listen on")
+args = parser.parse_args()
+
+# Configure logging with IST timezone
+ist_tz = pytz.timezone('Asia/Kolkata')
+logging.Formatter.converter = lambda *args: datetime.datetime.now(ist_tz).timetuple()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s IST - %(levelname)s - %(message)s')
+
+
+def main():
+    # Exit through the finally block on SIGTERM so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+
+    config = utils.load_config_for_device() or {}
+    server_config = config.get("inferenceServer", {})
+
+    # The device's detector settings are the defaults for every client; the
+    # server itself must load models locally
+    defaults = {**config.get("detector", {}), **server_config.get("detector", {})}
+    if defaults.get("backend") == "remote":
+        defaults["backend"] = defaults.get("fallbackBackend", "torch")
+    for key in ("socket", "slots", "fallbackBackend"):
+        defaults.pop(key, None)
+
+    server = InferenceServer(
+        args.socket,
+        defaults,
+        batch_window=server_config.get("batchWindowMs", DEFAULT_BATCH_WINDOW * 1000) / 1000,
+        max_batch=server_config.get("maxBatch", DEFAULT_MAX_BATCH),
+    )
+    # Load the default model up front so the first client does not wait for it
+    server.runner_for({})
+    Metrics.start_reporter(300)
+    Metrics.record_startup("inference-server")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
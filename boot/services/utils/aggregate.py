@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKET_SECONDS = 60
+FLUSH_GRACE = 1.0  # Seconds a bucket stays open after it ends, for items still in the pipeline
+
+
+class _Summary:
+    """Running count/total/max of a list of values (e.g. dwell seconds) merged into a bucket."""
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, values):
+        for value in values:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def as_dict(self):
+        return {"count": self.count, "mean": round(self.total / self.count, 1), "max": round(self.max, 1)}
+
+
+def _merge(target, counts):
+    """Add nested {key: number | list | dict} counts into `target` in place."""
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            _merge(target.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            target.setdefault(key, _Summary()).add(value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+def _finish(bucket):
+    return {
+        key: _finish(value) if isinstance(value, dict) else value.as_dict() if isinstance(value, _Summary) else value
+        for key, value in bucket.items()
+    }
+
+
+class CountAggregator:
+    """Rolls count messages up into fixed time buckets and emits one message per bucket.
+
+    add() merges the nested counts of one event ({"count": {"car": 1}},
+    line/zone counts, ...) into the bucket its timestamp falls in: numbers
+    are summed and lists (dwell times) are reduced to count/mean/max. Once a
+    bucket has ended, flush() returns it as a single message with the
+    bucket's start as its timestamp plus the constant `fields`; buckets with
+    no events produce nothing. start() runs flush() in a thread and hands
+    each message to `sink`.
+    """
+
+    def __init__(self, bucket_seconds=DEFAULT_BUCKET_SECONDS, fields=None, sink=None, name="aggregate"):
+        self.bucket_seconds = bucket_seconds
+        self.fields = fields or {}
+        self.sink = sink
+        self.name = name
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def add(self, timestamp, counts):
+        start = int(timestamp // self.bucket_seconds * self.bucket_seconds)
+        with self._lock:
+            _merge(self._buckets.setdefault(start, {}), counts)
+        Metrics.incr(f"{self.name}.events")
+
+    def flush(self, now=None, force=False):
+        """Messages for the buckets that have ended (all buckets with `force`), oldest first."""
+        now = time.time() if now is None else now
+        with self._lock:
+            due = sorted(
+                start for start in self._buckets
+                if force or start + self.bucket_seconds + FLUSH_GRACE <= now
+            )
+            buckets = [(start, self._buckets.pop(start)) for start in due]
+        messages = [
+            {**self.fields, "timestamp": start * 1000, "bucketSeconds": self.bucket_seconds, **_finish(bucket)}
+            for start, bucket in buckets
+        ]
+        if messages:
+            Metrics.incr(f"{self.name}.flushed", len(messages))
+        return messages
+
+    def run(self):
+        while True:
+            now = time.time()
+            next_end = (now // self.bucket_seconds + 1) * self.bucket_seconds + FLUSH_GRACE
+            time.sleep(max(0.0, next_end - now))
+            for message in self.flush():
+                try:
+                    self.sink(message)
+                except Exception as e:
+                    logger.error(f"Could not hand over aggregated counts: {e}")
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True, name=self.name)
+        thread.start()
+        return thread
+
+
+def make_aggregator(config, fields=None, sink=None, name="aggregate"):
+    """CountAggregator from the optional `aggregation` config section, or None for real-time publishing.
+
+    Aggregation is on by default ({"bucketSeconds": 60}); {"realtime": true}
+    publishes every count as it happens, as before.
+    """
+    aggregation_config = (config or {}).get("aggregation", {})
+    if aggregation_config.get("realtime", False):
+        return None
+    return CountAggregator(
+        bucket_seconds=aggregation_config.get("bucketSeconds", DEFAULT_BUCKET_SECONDS),
+        fields=fields,
+        sink=sink,
+        name=name,
+    )
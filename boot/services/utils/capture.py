@@ -0,0 +1,164 @@
+import logging
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+from metrics import Metrics
+from framering import open_video_source, RingCapture, ring_name_for
+
+logger = logging.getLogger(__name__)
+
+# Bytes per pixel (or per pixel row multiplier for planar YUV) for supported pipe formats
+PIXEL_FORMATS = {
+    "bgr24": 3,
+    "rgb24": 3,
+    "gray": 1,
+    "yuv420p": 1.5,
+    "nv12": 1.5,
+}
+# Conversion of each non-BGR pipe format to the BGR HWC frames every consumer expects
+TO_BGR = {
+    "rgb24": cv2.COLOR_RGB2BGR,
+    "gray": cv2.COLOR_GRAY2BGR,
+    "yuv420p": cv2.COLOR_YUV2BGR_I420,
+    "nv12": cv2.COLOR_YUV2BGR_NV12,
+}
+
+
+def frame_shape(width, height, pix_fmt):
+    """Numpy shape of one raw frame as ffmpeg writes it to the pipe for `pix_fmt`."""
+    channels = PIXEL_FORMATS[pix_fmt]
+    if channels == 3:
+        return (height, width, 3)
+    if channels == 1:
+        return (height, width)
+    # Planar 4:2:0 formats: full-size luma plane followed by half-height chroma rows
+    return (height * 3 // 2, width)
+
+
+def probe_size(url, timeout=15):
+    """Ask ffprobe for the stream's native width and height."""
+    command = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "csv=p=0:s=x",
+    ]
+    if url.startswith("rtsp://"):
+        command += ["-rtsp_transport", "tcp"]
+    output = subprocess.run(command + [url], capture_output=True, text=True, timeout=timeout, check=True).stdout
+    width, height = output.strip().splitlines()[0].split("x")
+    return int(width), int(height)
+
+
+class FFmpegCapture:
+    """cv2.VideoCapture-compatible reader backed by an ffmpeg subprocess.
+
+    ffmpeg drops frames down to `fps`, scales to `size` and converts to
+    `pix_fmt` before anything crosses the pipe, so Python only ever copies the
+    frames it is going to use. read() always returns BGR (height, width, 3)
+    frames, as cv2.VideoCapture does: other `pix_fmt`s only change what
+    crosses the pipe (yuv420p and nv12 are half the bytes of bgr24) and are
+    converted by OpenCV on the way out. Each frame is a new array that the
+    caller owns, so it can be held through inference without being refilled
+    underneath it.
+    """
+
+    def __init__(self, url, fps=None, size=None, pix_fmt="bgr24", extra_input_args=None):
+        if pix_fmt not in PIXEL_FORMATS:
+            raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+        self.url = url
+        self.fps = fps
+        self.pix_fmt = pix_fmt
+        self.width, self.height = size if size else probe_size(url)
+        self.shape = (self.height, self.width, 3)
+        self.pipe_shape = frame_shape(self.width, self.height, pix_fmt)
+        self.frame_bytes = int(np.prod(self.pipe_shape))
+        # Pipe-format frames are converted out of one reused buffer
+        self._raw = np.empty(self.pipe_shape, dtype=np.uint8) if pix_fmt in TO_BGR else None
+
+        filters = []
+        if fps:
+            filters.append(f"fps={fps}")
+        if size:
+            filters.append(f"scale={self.width}:{self.height}")
+
+        command = ["ffmpeg", "-loglevel", "error", "-nostdin"]
+        if url.startswith("rtsp://"):
+            command += ["-rtsp_transport", "tcp", "-fflags", "nobuffer", "-flags", "low_delay"]
+        command += extra_input_args or []
+        command += ["-i", url, "-an"]
+        if filters:
+            command += ["-vf", ",".join(filters)]
+        command += ["-f", "rawvideo", "-pix_fmt", pix_fmt, "-"]
+
+        logger.info(f"Starting ffmpeg capture: {self.width}x{self.height} {pix_fmt} @ {fps or 'native'} fps")
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=self.frame_bytes)
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _read_exact(self, view):
+        """Fill `view` from ffmpeg's stdout; False on EOF."""
+        filled = 0
+        while filled < len(view):
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        return True
+
+    def read(self):
+        # Not isOpened(): frames ffmpeg wrote before exiting (e.g. at the end of a file) are still in the pipe
+        if self.process is None:
+            return False, None
+        frame = np.empty(self.shape, dtype=np.uint8)
+        started = time.time()
+        if not self._read_exact(memoryview(frame if self._raw is None else self._raw).cast("B")):
+            return False, None
+        if self._raw is not None:
+            cv2.cvtColor(self._raw, TO_BGR[self.pix_fmt], dst=frame)
+        Metrics.incr("capture.frames")
+        Metrics.timing("capture.read", time.time() - started)
+        return True, frame
+
+    def release(self):
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process = None
+
+
+def open_capture(url, capture_config=None):
+    """Open the best frame source for `url` given the optional `capture` config section.
+
+    A shared frame ring (see boot.py) always wins. Otherwise `backend` picks
+    "ffmpeg" (decimated and scaled by ffmpeg) or "opencv" (plain VideoCapture).
+    """
+    capture_config = capture_config or {}
+    try:
+        return RingCapture(ring_name_for(url))
+    except (FileNotFoundError, ValueError):
+        pass
+
+    if capture_config.get("backend", "opencv") != "ffmpeg":
+        return open_video_source(url)
+
+    width, height = capture_config.get("width"), capture_config.get("height")
+    try:
+        return FFmpegCapture(
+            url,
+            fps=capture_config.get("fps"),
+            size=(width, height) if width and height else None,
+            pix_fmt=capture_config.get("pixelFormat", "bgr24"),
+        )
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError) as e:
+        logger.error(f"Unable to start ffmpeg capture, falling back to OpenCV: {e}")
+        return open_video_source(url)
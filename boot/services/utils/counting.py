@@ -0,0 +1,51 @@
+import numpy as np
+
+
+class StableCounter:
+    """Median-smoothed per-class counts that report how many new objects appeared.
+
+    Each update() adds one frame's raw counts to a rolling window per class.
+    The stable count is the rounded median of that window, and any rise in a
+    stable count since the previous update is reported as new objects.
+
+    The windows of all classes live in one (classes x window_size) ring
+    array, so an update is one column write plus one vectorized median
+    (np.median partitions rather than sorts) regardless of how many classes
+    are tracked.
+    """
+
+    def __init__(self, classes, window_size=5):
+        self.classes = list(classes)
+        self.window_size = max(1, int(window_size))
+        self._window = np.zeros((len(self.classes), self.window_size), dtype=np.int32)
+        self._next = 0
+        self._filled = 0
+        self._prev = np.zeros(len(self.classes), dtype=np.int64)
+        self.stable = np.zeros(len(self.classes), dtype=np.int64)
+        self.stable_count = {}
+
+    @property
+    def prev_stable_count(self):
+        return dict(zip(self.classes, self._prev.tolist()))
+
+    def update(self, raw_count):
+        """Add one frame's counts; return {class: increase} for classes that rose.
+
+        `raw_count` is either {class: count} or an array aligned with
+        `classes` (e.g. ClassCounter.counts()).
+        """
+        if isinstance(raw_count, dict):
+            raw_count = [raw_count.get(class_name, 0) for class_name in self.classes]
+        self._window[:, self._next] = raw_count
+        self._next = (self._next + 1) % self.window_size
+        self._filled = min(self._filled + 1, self.window_size)
+
+        window = self._window if self._filled == self.window_size else self._window[:, :self._filled]
+        # np.rint rounds halves to even, like round() on statistics.median
+        self._prev = self.stable
+        self.stable = np.rint(np.median(window, axis=1)).astype(np.int64)
+        self.stable_count = dict(zip(self.classes, self.stable.tolist()))
+
+        increase = self.stable - self._prev
+        rose = np.flatnonzero(increase > 0)
+        return {self.classes[index]: int(increase[index]) for index in rose}
@@ -0,0 +1,474 @@
+import argparse
+import ast
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from metrics import Metrics
+from classes import COCO_NAMES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "yolov8n.pt"
+DEFAULT_IMGSZ = 640
+
+
+class Detections:
+    """Detector output for one frame as plain numpy arrays (xyxy in frame pixels)."""
+    __slots__ = ("xyxy", "confidence", "class_id")
+
+    def __init__(self, xyxy, confidence, class_id):
+        self.xyxy = xyxy
+        self.confidence = confidence
+        self.class_id = class_id
+
+    def __len__(self):
+        return len(self.class_id)
+
+    @staticmethod
+    def empty():
+        return Detections(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64))
+
+
+def to_supervision(detections):
+    """Convert Detections to supervision.Detections for ByteTrack and the annotators."""
+    import supervision as sv
+
+    return sv.Detections(
+        xyxy=detections.xyxy.astype(np.float32, copy=False),
+        confidence=detections.confidence,
+        class_id=detections.class_id.astype(int, copy=False),
+    )
+
+
+def encode_detections(batch):
+    """Pack a list of Detections into bytes: int32 frame count, int32 box counts, then float32 rows.
+
+    Each row is x1, y1, x2, y2, confidence, class_id, so a frame with n boxes
+    costs 24 * n bytes.
+    """
+    counts = np.array([len(batch)] + [len(detections) for detections in batch], dtype=np.int32)
+    rows = [
+        np.column_stack((d.xyxy, d.confidence, d.class_id)).astype(np.float32, copy=False)
+        for d in batch if len(d)
+    ]
+    return counts.tobytes() + b"".join(row.tobytes() for row in rows)
+
+
+def decode_detections(data):
+    """Inverse of encode_detections()."""
+    frames = int(np.frombuffer(data, dtype=np.int32, count=1)[0])
+    counts = np.frombuffer(data, dtype=np.int32, count=frames, offset=4)
+    rows = np.frombuffer(data, dtype=np.float32, offset=4 * (frames + 1)).reshape(-1, 6)
+    batch, start = [], 0
+    for count in counts.tolist():
+        chunk = rows[start:start + count]
+        batch.append(Detections(chunk[:, :4], chunk[:, 4], chunk[:, 5].astype(np.int64)))
+        start += count
+    return batch
+
+
+class Detector:
+    """Common interface of every detection backend.
+
+    `names` maps class id to class name. detect_batch() takes a list of BGR
+    frames and returns one Detections per frame. An `iou` of None means the
+    backend's own NMS IoU threshold (`default_iou`).
+    """
+    backend = None
+    default_iou = None
+
+    def __init__(self, conf=0.25, iou=None, imgsz=DEFAULT_IMGSZ):
+        self.conf = conf
+        self.iou = self.default_iou if iou is None else iou
+        self.imgsz = imgsz
+        self.names = dict(enumerate(COCO_NAMES))
+
+    def detect(self, frame):
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames):
+        started = time.time()
+        results = self._detect_batch(frames)
+        Metrics.timing(f"detector.{self.backend}", time.time() - started)
+        return results
+
+    def _detect_batch(self, frames):
+        raise NotImplementedError
+
+    def close(self):
+        """Release worker processes or sessions held by the backend."""
+
+
+class TorchDetector(Detector):
+    """Ultralytics/PyTorch backend (the original YOLO("yolov8n.pt") path)."""
+    backend = "torch"
+
+    def __init__(self, model_path=DEFAULT_MODEL, **kwargs):
+        super().__init__(**kwargs)
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)
+        self.names = self.model.names
+
+    def _detect_batch(self, frames):
+        # Ultralytics letterboxes raw frames itself; frames prepared by the
+        # capture thread are already model-sized and only need un-letterboxing
+        images = [frame.canvas if isinstance(frame, LetterboxedFrame) else frame for frame in frames]
+        # Without an explicit iou, ultralytics keeps its own NMS default (0.7)
+        options = {} if self.iou is None else {"iou": self.iou}
+        results = self.model(images, verbose=False, conf=self.conf, imgsz=self.imgsz, **options)
+        detections = []
+        for frame, result in zip(frames, results):
+            xyxy = result.boxes.xyxy.cpu().numpy()
+            if isinstance(frame, LetterboxedFrame):
+                unletterbox(xyxy, frame.letterbox, frame.shape)
+            detections.append(Detections(
+                xyxy,
+                result.boxes.conf.cpu().numpy(),
+                result.boxes.cls.cpu().numpy().astype(np.int64),
+            ))
+        return detections
+
+
+class LetterboxedFrame:
+    """A frame already letterboxed into a model-sized canvas (e.g. by the capture thread).
+
+    `frame` may be None when only the canvas crosses a process boundary;
+    `shape` is the source frame shape that boxes are mapped back to. Frames
+    from Letterbox.publish() belong to its canvas pool: the consumer calls
+    checkout() when it takes one and release() once the detector is done.
+    """
+    __slots__ = ("frame", "canvas", "letterbox", "shape", "pool", "index")
+
+    def __init__(self, frame, canvas, letterbox, shape=None, pool=None, index=None):
+        self.frame = frame
+        self.canvas = canvas
+        self.letterbox = letterbox
+        self.shape = frame.shape if shape is None else shape
+        self.pool = pool
+        self.index = index
+
+    def checkout(self):
+        if self.pool is not None:
+            self.pool._checkout(self.index)
+
+    def release(self):
+        if self.pool is not None:
+            self.pool._release(self.index)
+
+
+class Letterbox:
+    """Letterboxes frames into pre-allocated imgsz x imgsz uint8 canvases.
+
+    Resize geometry is cached per source shape and the grey padding is only
+    repainted when it changes, so a steady stream costs one cv2.resize
+    straight into the canvas and no allocations. `canvases` lets the caller
+    supply the buffers, e.g. views into shared memory.
+
+    Called directly, one thread reuses the canvases round-robin. publish()
+    hands canvases from a capture thread to the inference thread instead: it
+    only writes into a canvas that is neither the one it published last
+    (still in the frame slot) nor checked out by the consumer, so a canvas is
+    never refilled while the detector reads it. Three buffers are enough for
+    one consumer; with none free the frame is passed on un-letterboxed.
+    """
+
+    def __init__(self, imgsz=DEFAULT_IMGSZ, buffers=1, canvases=None):
+        self.imgsz = imgsz
+        if canvases is None:
+            canvases = [np.full((imgsz, imgsz, 3), 114, dtype=np.uint8) for _ in range(max(1, buffers))]
+        self._canvases = canvases
+        self._geometry = [None] * len(self._canvases)
+        self._next = 0
+        self._lock = threading.Lock()
+        self._published = None
+        self._checked_out = {}  # Canvas index -> consumers holding it
+
+    def _layout(self, shape):
+        height, width = shape[:2]
+        ratio = min(self.imgsz / height, self.imgsz / width)
+        new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+        pad_x, pad_y = (self.imgsz - new_width) // 2, (self.imgsz - new_height) // 2
+        return shape[:2], ratio, pad_x, pad_y, new_width, new_height
+
+    def __call__(self, frame):
+        index = self._next
+        self._next = (index + 1) % len(self._canvases)
+        return self.fill(frame, index)
+
+    def publish(self, frame):
+        """Letterbox `frame` into a free canvas for another thread (see the class docstring)."""
+        with self._lock:
+            index = next((index for index in range(len(self._canvases))
+                          if index != self._published and index not in self._checked_out), None)
+            if index is None:
+                Metrics.incr("letterbox.noFreeCanvas")
+                return frame  # The detector letterboxes it itself
+            self._published = index
+        prepared = self.fill(frame, index)
+        prepared.pool, prepared.index = self, index
+        return prepared
+
+    def _checkout(self, index):
+        with self._lock:
+            self._checked_out[index] = self._checked_out.get(index, 0) + 1
+
+    def _release(self, index):
+        with self._lock:
+            if self._checked_out.get(index, 0) > 1:
+                self._checked_out[index] -= 1
+            else:
+                self._checked_out.pop(index, None)
+
+    def fill(self, frame, index):
+        """Letterbox `frame` into canvas `index` (a LetterboxedFrame is copied over as is)."""
+        canvas = self._canvases[index]
+        if isinstance(frame, LetterboxedFrame):
+            np.copyto(canvas, frame.canvas)
+            self._geometry[index] = None
+            return LetterboxedFrame(frame.frame, canvas, frame.letterbox, frame.shape)
+
+        geometry = self._geometry[index]
+        if geometry is None or geometry[0] != frame.shape[:2]:
+            geometry = self._geometry[index] = self._layout(frame.shape)
+            canvas[:] = 114
+        _, ratio, pad_x, pad_y, new_width, new_height = geometry
+
+        cv2.resize(frame, (new_width, new_height), dst=canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width],
+                   interpolation=cv2.INTER_LINEAR)
+        return LetterboxedFrame(frame, canvas, (ratio, pad_x, pad_y))
+
+
+def canvas_to_tensor(canvas, out):
+    """Write a BGR HWC uint8 canvas into a (3, H, W) float32 RGB tensor scaled to 0-1, in place."""
+    np.copyto(out, canvas[:, :, ::-1].transpose(2, 0, 1), casting="unsafe")
+    out *= 1 / 255.0
+    return out
+
+
+def unletterbox(xyxy, letterbox, frame_shape):
+    """Map xyxy boxes from letterboxed canvas coordinates back to frame pixels, in place."""
+    ratio, pad_x, pad_y = letterbox
+    xyxy -= (pad_x, pad_y, pad_x, pad_y)
+    xyxy /= ratio
+    height, width = frame_shape[:2]
+    np.clip(xyxy, 0, (width, height, width, height), out=xyxy)
+    return xyxy
+
+
+class ExportedYoloDetector(Detector):
+    """Shared letterbox pre-processing and YOLOv8 decode/NMS for exported (non-torch) models.
+
+    Frames are letterboxed and normalized into one input tensor that is
+    allocated once and reused for every call. Items may also be
+    LetterboxedFrame objects prepared elsewhere (see CameraStream).
+    """
+    default_iou = 0.45  # For the NMS done here, as the exported models have none of their own
+    _letterbox = None
+    _input = None
+
+    def _prepare(self, frames):
+        if self._letterbox is None or self._letterbox.imgsz != self.imgsz:
+            self._letterbox = Letterbox(self.imgsz)
+        rows = max(self.batch_size or 0, len(frames))
+        if self._input is None or self._input.shape[0] < rows or self._input.shape[2] != self.imgsz:
+            self._input = np.empty((rows, 3, self.imgsz, self.imgsz), dtype=np.float32)
+
+        letterboxes = []
+        for index, frame in enumerate(frames):
+            prepared = frame if isinstance(frame, LetterboxedFrame) else self._letterbox(frame)
+            canvas_to_tensor(prepared.canvas, self._input[index])
+            letterboxes.append(prepared.letterbox)
+        return letterboxes
+
+    def _decode(self, output, letterbox, frame_shape):
+        """Turn one (4 + classes, anchors) YOLOv8 output into Detections in frame pixels."""
+        prediction = output.T
+        scores = prediction[:, 4:]
+        class_id = scores.argmax(axis=1)
+        confidence = scores[np.arange(len(scores)), class_id]
+        keep = confidence >= self.conf
+        if not np.any(keep):
+            return Detections.empty()
+
+        boxes, confidence, class_id = prediction[keep, :4], confidence[keep], class_id[keep]
+        xywh = np.column_stack((boxes[:, 0] - boxes[:, 2] / 2, boxes[:, 1] - boxes[:, 3] / 2, boxes[:, 2], boxes[:, 3]))
+        indices = cv2.dnn.NMSBoxesBatched(xywh.tolist(), confidence.tolist(), class_id.tolist(), self.conf, self.iou)
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+
+        xyxy = xywh[indices]
+        xyxy[:, 2:] += xyxy[:, :2]
+        unletterbox(xyxy, letterbox, frame_shape)
+        return Detections(xyxy.astype(np.float32), confidence[indices].astype(np.float32), class_id[indices].astype(np.int64))
+
+    def _detect_batch(self, frames):
+        if self.batch_size == 1:
+            # Fixed batch-1 export: one forward pass per frame through the same input row
+            outputs, letterboxes = [], []
+            for frame in frames:
+                letterboxes += self._prepare([frame])
+                outputs.append(self._forward(self._input[:1])[0])
+        else:
+            letterboxes = self._prepare(frames)
+            outputs = self._forward(self._input[:len(frames)])
+        return [
+            self._decode(output, letterbox, frame.shape)
+            for output, letterbox, frame in zip(outputs, letterboxes, frames)
+        ]
+
+    def _forward(self, batch):
+        raise NotImplementedError
+
+
+class OnnxDetector(ExportedYoloDetector):
+    """ONNX Runtime CPU backend for models exported with `python detector.py export --format onnx`."""
+    backend = "onnx"
+
+    def __init__(self, model_path, threads=None, **kwargs):
+        super().__init__(**kwargs)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        if isinstance(model_input.shape[2], int):
+            self.imgsz = model_input.shape[2]
+
+        names = self.session.get_modelmeta().custom_metadata_map.get("names")
+        if names:
+            self.names = ast.literal_eval(names)
+
+    def _forward(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVinoDetector(ExportedYoloDetector):
+    """OpenVINO CPU backend for models exported with `python detector.py export --format openvino`."""
+    backend = "openvino"
+
+    def __init__(self, model_path, threads=None, **kwargs):
+        super().__init__(**kwargs)
+        import openvino as ov
+
+        if os.path.isdir(model_path):
+            model_path = next(
+                os.path.join(model_path, name) for name in os.listdir(model_path) if name.endswith(".xml")
+            )
+        core = ov.Core()
+        properties = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            properties["INFERENCE_NUM_THREADS"] = threads
+        model = core.read_model(model_path)
+        self.compiled = core.compile_model(model, "CPU", properties)
+        input_shape = model.inputs[0].get_partial_shape()
+        self.batch_size = input_shape[0].get_length() if input_shape[0].is_static else None
+        if input_shape[2].is_static:
+            self.imgsz = input_shape[2].get_length()
+
+        metadata = os.path.join(os.path.dirname(model_path), "metadata.yaml")
+        if os.path.exists(metadata):
+            import yaml
+
+            with open(metadata) as f:
+                self.names = yaml.safe_load(f).get("names", self.names)
+
+    def _forward(self, batch):
+        return self.compiled(batch)[self.compiled.output(0)]
+
+
+BACKENDS = {
+    "torch": TorchDetector,
+    "onnx": OnnxDetector,
+    "openvino": OpenVinoDetector,
+}
+
+
+def create_detector(detector_config=None):
+    """Build the detector chosen by the optional `detector` config section.
+
+    Keys: backend ("torch", "onnx" or "openvino"), model (weights, .onnx file
+    or OpenVINO directory), imgsz, conf, iou and threads. With workers > 0
+    the model runs in that many worker processes instead (InferencePool).
+    Backend "remote" sends frames to the device's inference server
+    (RemoteDetector; keys socket, slots and fallbackBackend).
+    """
+    detector_config = detector_config or {}
+    if detector_config.get("backend") == "remote":
+        from inference_server import RemoteDetector
+
+        try:
+            return RemoteDetector(detector_config)
+        except (OSError, ConnectionError) as e:
+            # No inference server on this device: load the model in-process
+            logger.warning(f"Inference server unavailable ({e}), loading the model locally")
+            detector_config = {**detector_config, "backend": detector_config.get("fallbackBackend", "torch")}
+
+    if detector_config.get("workers"):
+        from inference_pool import InferencePool
+
+        return InferencePool(detector_config)
+
+    backend = detector_config.get("backend", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown detector backend: {backend}")
+
+    kwargs = {
+        "conf": detector_config.get("conf", 0.25),
+        "iou": detector_config.get("iou"),
+        "imgsz": detector_config.get("imgsz", DEFAULT_IMGSZ),
+    }
+    if backend != "torch":
+        kwargs["threads"] = detector_config.get("threads")
+
+    model_path = detector_config.get("model", DEFAULT_MODEL)
+    logger.info(f"Loading {backend} detector from {model_path}")
+    return BACKENDS[backend](model_path, **kwargs)
+
+
+def export_model(weights, export_format, int8=False, imgsz=DEFAULT_IMGSZ, calibration_data="coco128.yaml"):
+    """Export torch weights for the onnx/openvino backends, optionally quantized to int8.
+
+    OpenVINO int8 uses ultralytics' NNCF calibration on `calibration_data`;
+    ONNX int8 applies ONNX Runtime dynamic (weight) quantization to the fp32 export.
+    """
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    if export_format == "openvino":
+        return model.export(format="openvino", imgsz=imgsz, int8=int8, data=calibration_data if int8 else None)
+
+    path = model.export(format="onnx", imgsz=imgsz, simplify=True)
+    if not int8:
+        return path
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantized = path.replace(".onnx", "_int8.onnx")
+    quantize_dynamic(path, quantized, weight_type=QuantType.QUInt8)
+    return quantized
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Detector backend tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export YOLO weights for the onnx/openvino backends")
+    export_parser.add_argument("--weights", default=DEFAULT_MODEL, help="Ultralytics weights to export")
+    export_parser.add_argument("--format", choices=["onnx", "openvino"], required=True, help="Target backend")
+    export_parser.add_argument("--int8", action="store_true", help="Produce an int8-quantized model")
+    export_parser.add_argument("--imgsz", type=int, default=DEFAULT_IMGSZ, help="Model input size")
+    export_parser.add_argument("--data", default="coco128.yaml", help="Calibration dataset for OpenVINO int8")
+    cli_args = parser.parse_args()
+
+    exported = export_model(cli_args.weights, cli_args.format, cli_args.int8, cli_args.imgsz, cli_args.data)
+    print(f"Exported model: {exported}")
@@ -0,0 +1,136 @@
+import logging
+
+import cv2
+import numpy as np
+
+from detector import Detections
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+LK_PARAMS = dict(
+    winSize=(15, 15),
+    maxLevel=2,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
+)
+
+
+class FlowTracker:
+    """Runs the detector every k frames and carries boxes forward with optical flow in between.
+
+    After each detection a small grid of points is laid inside every box on
+    a downscaled grayscale frame. On the following frames those points are
+    followed with pyramidal Lucas-Kanade flow and each box is shifted by the
+    median displacement of its points, so ByteTrack keeps getting a box per
+    object at a fraction of the detector cost.
+
+    k adapts to motion: it grows by one (up to `max_interval`) while the
+    median point moves less than `slow` px a frame at full resolution and
+    shrinks by one (down to `min_interval`) when it moves more than `fast`
+    px. A detection is also forced when too few points could be followed.
+    """
+
+    def __init__(self, interval=3, min_interval=1, max_interval=8, width=320, grid=3,
+                 slow=2.0, fast=8.0, min_tracked=0.5, name="flow"):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.width = width
+        self.grid = grid
+        self.slow = slow
+        self.fast = fast
+        self.min_tracked = min_tracked
+        self.name = name
+        self._gray = None
+        self._scale = 1.0
+        self._detections = None
+        self._xyxy = None
+        self._points = None
+        self._since_detection = 0
+        self._lost = False
+
+    def _small_gray(self, frame):
+        height, width = frame.shape[:2]
+        self._scale = min(1.0, self.width / width)
+        if self._scale < 1.0:
+            frame = cv2.resize(frame, (self.width, max(1, int(height * self._scale))), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    def _grid_points(self, xyxy):
+        """grid x grid points per box, inset from the edges (mostly object, not background)."""
+        steps = (np.arange(self.grid, dtype=np.float32) + 1) / (self.grid + 1)
+        fx, fy = np.meshgrid(steps, steps)
+        small = xyxy.astype(np.float32) * self._scale
+        x = small[:, None, 0] + fx.ravel()[None, :] * (small[:, None, 2] - small[:, None, 0])
+        y = small[:, None, 1] + fy.ravel()[None, :] * (small[:, None, 3] - small[:, None, 1])
+        return np.stack((x, y), axis=-1).reshape(-1, 1, 2)
+
+    def needs_detection(self):
+        """True when the detector should run on the next frame."""
+        return (self._detections is None or self._lost
+                or self._since_detection + 1 >= self.interval)
+
+    def reset(self, frame, detections):
+        """Start propagating from a fresh detector result on `frame`."""
+        self._gray = self._small_gray(frame)
+        self._detections = detections
+        self._xyxy = np.asarray(detections.xyxy, dtype=np.float32).copy()
+        self._points = self._grid_points(self._xyxy) if len(self._xyxy) else None
+        self._since_detection = 0
+        self._lost = False
+        Metrics.incr(f"{self.name}.detected")
+
+    def propagate(self, frame):
+        """Detections for `frame` moved by optical flow, or None if the detector has to run instead."""
+        if self._detections is None:
+            return None
+        gray = self._small_gray(frame)
+        self._since_detection += 1
+        if self._points is None:
+            # Nothing to follow; the next detection picks up new objects
+            self._gray = gray
+            Metrics.incr(f"{self.name}.propagated")
+            return Detections(self._xyxy.copy(), self._detections.confidence, self._detections.class_id)
+
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, self._points, None, **LK_PARAMS)
+        status = status.reshape(len(self._xyxy), -1).astype(bool)
+        if status.mean() < self.min_tracked:
+            self._lost = True
+            Metrics.incr(f"{self.name}.lost")
+            return None
+
+        # Median shift per box over the points that were followed
+        moved = (points - self._points).reshape(len(self._xyxy), -1, 2) / self._scale
+        moved[~status] = np.nan
+        moved[~status.any(axis=1)] = 0  # Boxes with no followed point stay put
+        shift = np.nanmedian(moved, axis=1)
+        self._xyxy += np.tile(shift, 2)
+        self._gray = gray
+        self._points = points
+
+        motion = float(np.median(np.hypot(shift[:, 0], shift[:, 1])))
+        if motion > self.fast and self.interval > self.min_interval:
+            self.interval -= 1
+        elif motion < self.slow and self.interval < self.max_interval:
+            self.interval += 1
+        Metrics.gauge(f"{self.name}.interval", self.interval)
+        Metrics.incr(f"{self.name}.propagated")
+        return Detections(self._xyxy.copy(), self._detections.confidence, self._detections.class_id)
+
+
+def make_flow_tracker(config, name="flow"):
+    """FlowTracker from the optional `detectEvery` config section, or None when disabled (the default)."""
+    flow_config = (config or {}).get("detectEvery", {})
+    if not flow_config.get("enabled", False):
+        return None
+    return FlowTracker(
+        interval=flow_config.get("interval", 3),
+        min_interval=flow_config.get("minInterval", 1),
+        max_interval=flow_config.get("maxInterval", 8),
+        width=flow_config.get("width", 320),
+        grid=flow_config.get("grid", 3),
+        slow=flow_config.get("slowPx", 2.0),
+        fast=flow_config.get("fastPx", 8.0),
+        min_tracked=flow_config.get("minTracked", 0.5),
+        name=name,
+    )
@@ -0,0 +1,296 @@
+import hashlib
+import logging
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Ring layout:
+#   header: magic, version, slots, height, width, channels, latest_seq
+#   slot table: [seq (u64), timestamp (f64)] * slots
+#   frame data: slots * height * width * channels bytes
+#
+# Readers block instead of polling: each one binds a Unix datagram socket in
+# <tmp>/<ring>.notify/ and the writer sends every socket a byte per frame.
+MAGIC = b"ADBFRING"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIIxxxxQ")
+SLOT = struct.Struct("<Qd")
+DEFAULT_SLOTS = 4
+NOTIFY_REFRESH = 1.0  # Seconds between the writer's rescans of reader sockets
+MAX_WAIT = 1.0  # Longest a reader sleeps before re-checking the ring (e.g. a restarted writer)
+DEFAULT_POOL = 4  # Output buffers a RingCapture keeps for frames its caller has let go of
+
+
+def ring_name_for(rtsp_url):
+    """Derive a stable shared-memory name from a stream URL so every service finds the same ring."""
+    return "adboard_" + hashlib.sha1(rtsp_url.encode()).hexdigest()[:12]
+
+
+def notify_dir_for(name):
+    return os.path.join(tempfile.gettempdir(), f"{name}.notify")
+
+
+def _attach(name):
+    """Attach to an existing segment without letting the resource tracker unlink it on exit."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class FrameRingWriter:
+    """Single producer that publishes decoded frames into a shared-memory ring."""
+
+    def __init__(self, name, shape, slots=DEFAULT_SLOTS):
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+        self.name = name
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_bytes = height * width * channels
+        self._data_offset = HEADER.size + SLOT.size * slots
+        size = self._data_offset + frame_bytes * slots
+
+        try:
+            # Remove a ring left behind by a crashed capture process
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._frames = np.ndarray((slots,) + self.shape, dtype=np.uint8,
+                                  buffer=self.shm.buf, offset=self._data_offset)
+        self._seq = 0
+        for slot in range(slots):
+            SLOT.pack_into(self.shm.buf, HEADER.size + SLOT.size * slot, 0, 0.0)
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, slots, height, width, channels, 0)
+
+        self._notify_dir = notify_dir_for(name)
+        os.makedirs(self._notify_dir, exist_ok=True)
+        self._notify_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._notify_socket.setblocking(False)
+        self._readers = []
+        self._readers_scanned = 0.0
+        logger.info(f"Created frame ring {name}: {slots} x {self.shape}, {size / 1e6:.1f} MB")
+
+    def write(self, frame, timestamp=None):
+        """Copy a frame into the next slot and publish its sequence number."""
+        seq = self._seq + 1
+        slot = seq % self.slots
+        slot_offset = HEADER.size + SLOT.size * slot
+        # Mark the slot as being written so readers never trust a torn frame
+        SLOT.pack_into(self.shm.buf, slot_offset, 0, 0.0)
+        np.copyto(self._frames[slot], frame.reshape(self.shape))
+        SLOT.pack_into(self.shm.buf, slot_offset, seq, time.time() if timestamp is None else timestamp)
+        struct.pack_into("<Q", self.shm.buf, HEADER.size - 8, seq)
+        self._seq = seq
+        self._notify()
+        Metrics.incr("framering.written")
+        return seq
+
+    def _notify(self):
+        """Wake every reader blocked in read()."""
+        now = time.monotonic()
+        if now - self._readers_scanned >= NOTIFY_REFRESH:
+            self._readers = [os.path.join(self._notify_dir, entry) for entry in os.listdir(self._notify_dir)
+                             if entry.endswith(".sock")]
+            self._readers_scanned = now
+        for path in list(self._readers):
+            try:
+                self._notify_socket.sendto(b"\0", path)
+            except BlockingIOError:
+                pass  # The reader has not consumed its last wakeup yet; one is enough
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The reader exited without cleaning up
+                self._readers.remove(path)
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._frames = None
+        self._notify_socket.close()
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class FrameRingReader:
+    """Consumer of a FrameRingWriter ring from another process, zero-copy or into its own buffer."""
+
+    def __init__(self, name):
+        self.name = name
+        self.shm = _attach(name)
+        magic, version, slots, height, width, channels, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"Shared memory {name} is not a version {VERSION} frame ring")
+        self.slots = slots
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self._frames = np.ndarray((slots,) + self.shape, dtype=np.uint8,
+                                  buffer=self.shm.buf, offset=HEADER.size + SLOT.size * slots)
+
+        notify_dir = notify_dir_for(name)
+        os.makedirs(notify_dir, exist_ok=True)
+        self._socket_path = os.path.join(notify_dir, f"{os.getpid()}-{id(self)}.sock")
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self._socket_path)
+
+    def latest_seq(self):
+        return struct.unpack_from("<Q", self.shm.buf, HEADER.size - 8)[0]
+
+    def slot_seq(self, seq):
+        """Sequence number currently stored in the slot that `seq` maps to."""
+        return SLOT.unpack_from(self.shm.buf, HEADER.size + SLOT.size * (seq % self.slots))[0]
+
+    def still_valid(self, seq):
+        """True while the frame returned for `seq` has not been overwritten."""
+        return self.slot_seq(seq) == seq
+
+    def read(self, last_seq=0, timeout=None, out=None):
+        """Wait for a frame newer than `last_seq`.
+
+        Returns (seq, timestamp, frame), or None if the timeout expired.
+        Without `out` the frame is a read-only view into shared memory that
+        the writer overwrites `slots` frames later: call still_valid(seq)
+        after using it. With `out` the frame is copied into that array, and a
+        copy the writer raced with is thrown away and retried.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq = self.latest_seq()
+            if seq > last_seq:
+                slot_seq, timestamp = SLOT.unpack_from(self.shm.buf, HEADER.size + SLOT.size * (seq % self.slots))
+                if slot_seq == seq:
+                    frame = self._frames[seq % self.slots]
+                    if out is None:
+                        frame.flags.writeable = False
+                        return seq, timestamp, frame
+                    np.copyto(out, frame)
+                    if self.still_valid(seq):
+                        return seq, timestamp, out
+                    Metrics.incr("framering.torn")
+                    continue
+            wait = MAX_WAIT
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return None
+            self._wait(wait)
+
+    def _wait(self, timeout):
+        """Block until the writer signals a new frame (or `timeout`), then drop queued signals."""
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.recv(16)
+        except socket.timeout:
+            return
+        self._socket.setblocking(False)
+        try:
+            while True:
+                self._socket.recv(16)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self._frames = None
+        self._socket.close()
+        try:
+            os.unlink(self._socket_path)
+        except OSError:
+            pass
+        self.shm.close()
+
+
+class FramePool:
+    """Frame buffers handed out to a caller and reused once the caller has let go of them.
+
+    A buffer is only handed out again when the pool holds the last reference
+    to it (no LatestFrame slot, batch or numpy view still has it), so the
+    caller owns each frame for as long as it keeps it, and a consumer that
+    keeps at most `size` frames at a time allocates nothing.
+    """
+
+    def __init__(self, shape, size=DEFAULT_POOL):
+        self.shape = shape
+        self.size = size
+        self._buffers = []
+
+    def get(self):
+        for buffer in self._buffers:
+            if sys.getrefcount(buffer) <= 3:  # The list, this loop and getrefcount's argument
+                return buffer
+        buffer = np.empty(self.shape, dtype=np.uint8)
+        if len(self._buffers) < self.size:
+            self._buffers.append(buffer)
+        else:
+            Metrics.incr("framering.poolExhausted")
+        return buffer
+
+
+class RingCapture:
+    """cv2.VideoCapture-compatible wrapper around a FrameRingReader.
+
+    Like VideoCapture, read() returns an array the caller owns, so it can be
+    held through inference while the ring moves on; the arrays come from a
+    FramePool, so steady reading allocates nothing. Callers that can check
+    FrameRingReader.still_valid() read zero-copy views from `reader` instead.
+    read() returns (False, None) when the ring stops advancing for
+    `stale_timeout` seconds so callers reconnect just as they would after a
+    dropped RTSP connection.
+    """
+
+    def __init__(self, name, stale_timeout=5, pool_size=DEFAULT_POOL):
+        self.reader = FrameRingReader(name)
+        self.stale_timeout = stale_timeout
+        self.pool = FramePool(self.reader.shape, pool_size)
+        self._last_seq = 0
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        out = self.pool.get()
+        item = self.reader.read(self._last_seq, timeout=self.stale_timeout, out=out)
+        if item is None:
+            Metrics.incr("framering.stale")
+            return False, None
+        self._last_seq, self.last_timestamp, frame = item
+        return True, frame
+
+    def release(self):
+        if self._opened:
+            self._opened = False
+            self.reader.close()
+
+
+def open_video_source(rtsp_url):
+    """Attach to the shared frame ring for `rtsp_url` if the capture process runs, else open the stream directly."""
+    import cv2
+
+    try:
+        capture = RingCapture(ring_name_for(rtsp_url))
+        logger.info(f"Using shared frame ring {capture.reader.name} for {rtsp_url}")
+        return capture
+    except (FileNotFoundError, ValueError):
+        return cv2.VideoCapture(rtsp_url)
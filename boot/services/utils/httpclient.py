@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# One pooled, keep-alive HTTP client for the whole process (config, uploads, OpenRouter), so
+# repeated calls over the cellular link reuse a TCP/TLS connection instead of paying DNS and a
+# handshake every time. httpx with HTTP/2 is used when httpx and h2 are installed, requests
+# otherwise. Every request gets a (connect, read) timeout from TIMEOUTS by purpose.
+#
+# HTTP_STAND_IN="https://railway.adboardbooking.com=http://127.0.0.1:8080,..." sends the
+# requests for a base URL to a local stand-in server instead, e.g. to try the uploader offline.
+
+TIMEOUTS = {
+    "default": (5, 15),
+    "config": (5, 10),
+    "upload": (5, 30),
+    "ai": (5, 60),  # Vision models can take a while to answer
+}
+POOL_HOSTS = 4  # Hosts with pooled connections
+POOL_SIZE = 2  # Kept-alive connections per host
+
+try:
+    import httpx
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+except ImportError:
+    httpx = None
+
+
+class HttpError(Exception):
+    """A request could not be completed (connection, timeout, or an error status with raise_for_status)."""
+
+
+def _stand_ins(value):
+    """{"https://host": "http://127.0.0.1:8080"} from "https://host=http://127.0.0.1:8080,..."."""
+    pairs = (item.split("=", 1) for item in (value or "").split(",") if "=" in item)
+    return {prefix.rstrip("/"): target.rstrip("/") for prefix, target in pairs}
+
+
+class HttpClient:
+    """Thread-safe pooled client; see the module comment."""
+
+    def __init__(self, timeouts=None, stand_ins=None, http2=True):
+        self.timeouts = {**TIMEOUTS, **(timeouts or {})}
+        self.stand_ins = stand_ins or {}
+        self._lock = threading.Lock()
+        self._connections = {}  # Connections opened so far per pool, for the requests backend
+        if httpx is not None and http2:
+            self.backend = "httpx"
+            self._client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=POOL_HOSTS * POOL_SIZE),
+            )
+            self._errors = (httpx.HTTPError, httpx.InvalidURL)
+        else:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self.backend = "requests"
+            self._client = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE)
+            self._client.mount("https://", adapter)
+            self._client.mount("http://", adapter)
+            self._adapter = adapter
+            self._errors = (requests.exceptions.RequestException,)
+
+    def _url(self, url):
+        for prefix, target in self.stand_ins.items():
+            if url.startswith(prefix):
+                return target + url[len(prefix):]
+        return url
+
+    def _timeout(self, timeout):
+        if isinstance(timeout, str):
+            timeout = self.timeouts.get(timeout, self.timeouts["default"])
+        if isinstance(timeout, list):
+            timeout = tuple(timeout)  # From JSON config
+        if self.backend == "httpx" and isinstance(timeout, tuple):
+            return httpx.Timeout(timeout[1], connect=timeout[0])
+        return timeout
+
+    def _new_connections(self):
+        """Connections the requests backend opened since the last call (each one a TCP/TLS handshake)."""
+        opened = 0
+        with self._lock:
+            pools = self._adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                count = pool.num_connections
+                opened += count - self._connections.get(key, 0)
+                self._connections[key] = count
+        return max(0, opened)
+
+    def request(self, method, url, timeout="default", raise_for_status=False, **kwargs):
+        """Send a request and return the backend's response (status_code, text, json(), headers).
+
+        `timeout` is a TIMEOUTS key or a (connect, read) tuple; there is no
+        way to send a request without one. Raises HttpError on failure.
+        """
+        url = self._url(url)
+        host = (urlsplit(url).hostname or "unknown").replace(".", "_")  # Metric names use dots as separators
+        extensions = {}
+        handshakes = []
+        if self.backend == "httpx":
+            if isinstance(kwargs.get("data"), (bytes, bytearray)):
+                kwargs["content"] = kwargs.pop("data")
+
+            def trace(event, info):
+                if event in ("connection.connect_tcp.started", "connection.start_tls.complete"):
+                    handshakes.append((event, time.perf_counter()))
+
+            extensions["trace"] = trace
+
+        started = time.perf_counter()
+        try:
+            if self.backend == "httpx":
+                response = self._client.request(method, url, timeout=self._timeout(timeout),
+                                                extensions=extensions, **kwargs)
+            else:
+                response = self._client.request(method, url, timeout=self._timeout(timeout), **kwargs)
+        except self._errors as e:
+            Metrics.incr("http.errors")
+            raise HttpError(f"{method} {url} failed: {e}") from e
+        elapsed = time.perf_counter() - started
+
+        if self.backend == "httpx":
+            opened = sum(1 for event, _ in handshakes if event == "connection.connect_tcp.started")
+            if len(handshakes) == 2:
+                Metrics.timing(f"http.{host}.handshake", handshakes[1][1] - handshakes[0][1])
+        else:
+            opened = self._new_connections()
+        Metrics.incr("http.requests")
+        Metrics.incr(f"http.{host}.requests")
+        if opened:
+            Metrics.incr("http.handshakes", opened)
+            Metrics.incr(f"http.{host}.handshakes", opened)
+        # Latency with and without a new connection; the difference is what keep-alive saves
+        Metrics.timing(f"http.{host}.latency{'.cold' if opened else ''}", elapsed)
+
+        if raise_for_status and response.status_code >= 400:
+            Metrics.incr("http.errors")
+            raise HttpError(f"{method} {url} returned {response.status_code}")
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client():
+    """The process-wide HttpClient, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient(
+                    stand_ins=_stand_ins(os.environ.get("HTTP_STAND_IN")),
+                    http2=os.environ.get("HTTP2", "1") != "0",
+                )
+                logger.info(f"HTTP client using {_client.backend}")
+    return _client
+
+
+def get(url, **kwargs):
+    return client().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return client().post(url, **kwargs)
@@ -0,0 +1,183 @@
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from detector import (Detector, Detections, Letterbox, LetterboxedFrame, create_detector,
+                      encode_detections, decode_detections)
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+WORKER_START_TIMEOUT = 120  # Seconds a worker may take to import its backend and load the model
+
+
+def _worker_main(conn, detector_config, threads):
+    """Worker process: load the model, then detect letterboxed canvases from shared memory until told to stop."""
+    if threads and detector_config.get("backend", "torch") == "torch":
+        import torch
+
+        torch.set_num_threads(threads)
+    detector = create_detector(detector_config)
+    conn.send((detector.imgsz, detector.names))
+
+    shm_name, first_slot, slots = conn.recv()
+    # Spawned workers share the parent's resource tracker, which unlinks the segment
+    shm = shared_memory.SharedMemory(name=shm_name)
+    canvases = np.ndarray((slots, detector.imgsz, detector.imgsz, 3), dtype=np.uint8, buffer=shm.buf,
+                          offset=first_slot * detector.imgsz * detector.imgsz * 3)
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break  # Parent went away
+            if request is None:
+                break
+            frames = [
+                LetterboxedFrame(None, canvases[slot], letterbox, shape)
+                for slot, (letterbox, shape) in enumerate(request)
+            ]
+            conn.send_bytes(encode_detections(detector.detect_batch(frames)))
+    finally:
+        canvases = None
+        shm.close()
+
+
+class _Worker:
+    """One inference process, its pipe and its share of the canvas slots."""
+
+    def __init__(self, index, detector_config, threads, context):
+        self.index = index
+        self.detector_config = detector_config
+        self.threads = threads
+        self.context = context
+        self.process = None
+        self.conn = None
+        self.letterbox = None
+
+    def spawn(self):
+        """Start the process and wait until its model is loaded. Returns (imgsz, names)."""
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main, args=(child_conn, self.detector_config, self.threads),
+            daemon=True, name=f"inference-{self.index}",
+        )
+        self.process.start()
+        child_conn.close()
+        if not self.conn.poll(WORKER_START_TIMEOUT):
+            self.process.terminate()
+            raise RuntimeError(f"Inference worker {self.index} did not start within {WORKER_START_TIMEOUT}s")
+        return self.conn.recv()
+
+    def attach(self, shm, imgsz, slots):
+        first_slot = self.index * slots
+        canvases = np.ndarray((slots, imgsz, imgsz, 3), dtype=np.uint8, buffer=shm.buf,
+                              offset=first_slot * imgsz * imgsz * 3)
+        self.letterbox = Letterbox(imgsz, canvases=list(canvases))
+        self.conn.send((shm.name, first_slot, slots))
+
+    def submit(self, frames):
+        request = [self.letterbox.fill(frame, slot) for slot, frame in enumerate(frames)]
+        self.conn.send([(prepared.letterbox, prepared.shape) for prepared in request])
+
+    def result(self):
+        return decode_detections(self.conn.recv_bytes())
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class InferencePool(Detector):
+    """Runs the detector in worker processes so inference does not share the service's GIL.
+
+    Frames are letterboxed by the caller straight into shared-memory canvases
+    (each worker owns `batch` of them) and only the letterbox geometry crosses
+    the pipe; each worker answers with encode_detections() bytes. A batch is
+    split across idle workers, so cameras are detected on several cores at
+    once. Config keys (in the detector section): workers, workerBatch and
+    threads (per worker, default cores / workers), plus the usual backend keys.
+    """
+    backend = "pool"
+
+    def __init__(self, detector_config):
+        super().__init__()
+        workers = max(1, int(detector_config.get("workers", 1)))
+        self.batch = max(1, int(detector_config.get("workerBatch", 2)))
+        threads = detector_config.get("threads") or max(1, (os.cpu_count() or 1) // workers)
+        worker_config = {key: value for key, value in detector_config.items() if key not in ("workers", "workerBatch")}
+        worker_config["threads"] = threads
+
+        # Fresh interpreters: no inherited threads or locks, and the heavy
+        # backend imports only ever happen in the workers
+        context = multiprocessing.get_context("spawn")
+        self._workers = [_Worker(index, worker_config, threads, context) for index in range(workers)]
+        started = time.time()
+        for worker in self._workers:
+            self.imgsz, self.names = worker.spawn()
+        self.shm = shared_memory.SharedMemory(create=True, size=workers * self.batch * self.imgsz * self.imgsz * 3)
+        for worker in self._workers:
+            worker.attach(self.shm, self.imgsz, self.batch)
+        logger.info(f"Started {workers} inference workers ({threads} threads each) in {time.time() - started:.1f}s")
+
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def _restart(self, worker):
+        logger.error(f"Inference worker {worker.index} died, restarting it")
+        Metrics.incr("detector.pool.restarts")
+        worker.stop()
+        worker.spawn()
+        worker.attach(self.shm, self.imgsz, self.batch)
+
+    def _collect(self, in_flight, results):
+        worker, start, chunk = in_flight
+        try:
+            for offset, detections in enumerate(worker.result()):
+                results[start + offset] = detections
+        except (EOFError, OSError):
+            self._restart(worker)
+            for offset in range(len(chunk)):
+                results[start + offset] = Detections.empty()
+        self._idle.put(worker)
+
+    def _detect_batch(self, frames):
+        results = [None] * len(frames)
+        size = min(self.batch, -(-len(frames) // len(self._workers)))
+        in_flight = []
+        for start in range(0, len(frames), size):
+            # Only block on a free worker while holding none, so concurrent
+            # callers cannot each hold one worker and wait for another's
+            while True:
+                try:
+                    worker = self._idle.get(block=not in_flight)
+                    break
+                except queue.Empty:
+                    self._collect(in_flight.pop(0), results)
+            chunk = frames[start:start + size]
+            try:
+                worker.submit(chunk)
+            except (BrokenPipeError, OSError):
+                self._restart(worker)
+                worker.submit(chunk)
+            in_flight.append((worker, start, chunk))
+        for item in in_flight:
+            self._collect(item, results)
+        return results
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+        self.shm.close()
+        self.shm.unlink()
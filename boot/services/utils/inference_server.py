@@ -0,0 +1,293 @@
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from detector import (Detector, Detections, Letterbox, LetterboxedFrame, create_detector,
+                      encode_detections, decode_detections)
+from framering import _attach
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Wire protocol: every message is a u32 length followed by a one-byte type
+# and its payload. HELLO/ATTACH carry JSON; DETECT carries a u32 frame count
+# and one FRAME record per frame, answered with encode_detections() bytes.
+DEFAULT_SOCKET = "/tmp/adboard-inference.sock"
+LENGTH = struct.Struct("<I")
+FRAME = struct.Struct("<IfiiII")  # slot, ratio, pad_x, pad_y, height, width
+HELLO, ATTACH, DETECT = b"H", b"A", b"D"
+DEFAULT_BATCH_WINDOW = 0.01  # Seconds to wait for other clients' frames before running a batch
+DEFAULT_MAX_BATCH = 8
+DEFAULT_SLOTS = 4  # Frames a client can send per request
+
+
+def _recv_exact(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    filled = 0
+    while filled < size:
+        count = sock.recv_into(view[filled:])
+        if not count:
+            raise ConnectionError("Inference socket closed")
+        filled += count
+    return bytes(data)
+
+
+def send_message(sock, kind, payload=b""):
+    sock.sendall(LENGTH.pack(len(payload) + 1) + kind + payload)
+
+
+def recv_message(sock):
+    """Return (kind, payload) of the next message."""
+    data = _recv_exact(sock, LENGTH.unpack(_recv_exact(sock, LENGTH.size))[0])
+    return data[:1], data[1:]
+
+
+# Settings that change which model gets loaded; conf/iou come from the first client of a model
+LOAD_KEYS = ("backend", "model", "imgsz", "threads", "workers")
+
+
+def model_key(detector_config):
+    return json.dumps({key: detector_config.get(key) for key in LOAD_KEYS}, sort_keys=True)
+
+
+class _Request:
+    __slots__ = ("client", "frames", "received")
+
+    def __init__(self, client, frames):
+        self.client = client
+        self.frames = frames
+        self.received = time.time()
+
+
+class ModelRunner:
+    """One loaded model and the thread that batches requests for it across clients."""
+
+    def __init__(self, detector_config, batch_window, max_batch):
+        self.detector = create_detector(detector_config)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        threading.Thread(target=self.run, daemon=True, name="inference-batcher").start()
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            frames = len(batch[0].frames)
+            deadline = time.time() + self.batch_window
+            while frames < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                frames += len(request.frames)
+
+            started = time.time()
+            try:
+                results = self.detector.detect_batch([frame for request in batch for frame in request.frames])
+            except Exception as e:
+                logger.error(f"Inference failed: {e}", exc_info=True)
+                results = None
+            Metrics.gauge("inference.batchFrames", frames)
+            Metrics.gauge("inference.batchRequests", len(batch))
+
+            start = 0
+            for request in batch:
+                Metrics.timing("inference.latency", time.time() - request.received)
+                if results is None:
+                    request.client.reply(encode_detections([Detections.empty()] * len(request.frames)))
+                    continue
+                request.client.reply(encode_detections(results[start:start + len(request.frames)]))
+                start += len(request.frames)
+            Metrics.timing("inference.batch", time.time() - started)
+
+
+class _Client:
+    """Server side of one connected service: its socket and its shared-memory canvases."""
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.runner = None
+        self.shm = None
+        self.canvases = None
+        self._send_lock = threading.Lock()
+
+    def reply(self, payload):
+        try:
+            with self._send_lock:
+                send_message(self.sock, DETECT, payload)
+        except OSError as e:
+            logger.warning(f"Could not answer inference client: {e}")
+
+    def serve(self):
+        try:
+            while True:
+                kind, payload = recv_message(self.sock)
+                if kind == HELLO:
+                    self.runner = self.server.runner_for(json.loads(payload))
+                    detector = self.runner.detector
+                    names = {int(key): value for key, value in dict(detector.names).items()}
+                    send_message(self.sock, HELLO, json.dumps({"imgsz": detector.imgsz, "names": names}).encode())
+                elif kind == ATTACH:
+                    attach = json.loads(payload)
+                    imgsz = self.runner.detector.imgsz
+                    self.shm = _attach(attach["shm"])
+                    self.canvases = np.ndarray((attach["slots"], imgsz, imgsz, 3), dtype=np.uint8, buffer=self.shm.buf)
+                    send_message(self.sock, ATTACH)
+                elif kind == DETECT:
+                    count = LENGTH.unpack_from(payload)[0]
+                    frames = []
+                    for index in range(count):
+                        slot, ratio, pad_x, pad_y, height, width = FRAME.unpack_from(payload, LENGTH.size + FRAME.size * index)
+                        frames.append(LetterboxedFrame(None, self.canvases[slot], (ratio, pad_x, pad_y), (height, width, 3)))
+                    Metrics.incr("inference.requests")
+                    self.runner.requests.put(_Request(self, frames))
+        except (ConnectionError, OSError):
+            pass
+        except Exception as e:
+            logger.error(f"Inference client error: {e}", exc_info=True)
+        finally:
+            self.sock.close()
+            self.canvases = None
+            if self.shm is not None:
+                try:
+                    self.shm.close()
+                except BufferError:
+                    pass  # A queued request still holds a view; freed with it
+
+
+class InferenceServer:
+    """Device-local inference daemon: one copy of each model shared by every service.
+
+    Clients (RemoteDetector) say which model they want, hand over a
+    shared-memory segment of letterboxed canvases and then send only slot
+    numbers and letterbox geometry. Requests for the same model that arrive
+    within `batch_window` seconds are run as one batch of up to `max_batch`
+    frames.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, defaults=None, batch_window=DEFAULT_BATCH_WINDOW,
+                 max_batch=DEFAULT_MAX_BATCH):
+        self.socket_path = socket_path
+        self.defaults = defaults or {}
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._runners = {}
+        self._lock = threading.Lock()
+
+    def runner_for(self, requested):
+        """ModelRunner for a client's detector settings, loading the model on first use."""
+        detector_config = {**self.defaults, **requested}
+        key = model_key(detector_config)
+        with self._lock:
+            if key not in self._runners:
+                logger.info(f"Loading model for inference clients: {detector_config}")
+                self._runners[key] = ModelRunner(detector_config, self.batch_window, self.max_batch)
+            return self._runners[key]
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        logger.info(f"Inference server listening on {self.socket_path}")
+        try:
+            while True:
+                sock, _ = server.accept()
+                Metrics.incr("inference.clients")
+                threading.Thread(target=_Client(self, sock).serve, daemon=True, name="inference-client").start()
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+class RemoteDetector(Detector):
+    """Detector backend that forwards frames to the device's InferenceServer.
+
+    Frames are letterboxed into this process's own shared-memory canvases,
+    so only slot numbers and geometry cross the socket.
+    """
+    backend = "remote"
+
+    def __init__(self, detector_config):
+        super().__init__()
+        self.socket_path = detector_config.get("socket", DEFAULT_SOCKET)
+        self.slots = max(1, int(detector_config.get("slots", DEFAULT_SLOTS)))
+        self.model = {
+            key: value for key, value in detector_config.items()
+            if key not in ("backend", "socket", "slots", "fallbackBackend")
+        }
+        self._lock = threading.Lock()
+        self.sock = None
+        self.shm = None
+        self._connect()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        send_message(sock, HELLO, json.dumps(self.model).encode())
+        hello = json.loads(recv_message(sock)[1])
+        self.imgsz = hello["imgsz"]
+        self.names = {int(key): value for key, value in hello["names"].items()}
+
+        if self.shm is None or self.shm.size < self.slots * self.imgsz * self.imgsz * 3:
+            if self.shm is not None:
+                self._close_shm()
+            self.shm = shared_memory.SharedMemory(create=True, size=self.slots * self.imgsz * self.imgsz * 3)
+            canvases = np.ndarray((self.slots, self.imgsz, self.imgsz, 3), dtype=np.uint8, buffer=self.shm.buf)
+            self._letterbox = Letterbox(self.imgsz, canvases=list(canvases))
+        send_message(sock, ATTACH, json.dumps({"shm": self.shm.name, "slots": self.slots}).encode())
+        recv_message(sock)
+        self.sock = sock
+        logger.info(f"Connected to inference server {self.socket_path} (imgsz {self.imgsz})")
+
+    def _request(self, frames):
+        payload = bytearray(LENGTH.pack(len(frames)))
+        for slot, frame in enumerate(frames):
+            prepared = self._letterbox.fill(frame, slot)
+            ratio, pad_x, pad_y = prepared.letterbox
+            payload += FRAME.pack(slot, ratio, pad_x, pad_y, *prepared.shape[:2])
+        send_message(self.sock, DETECT, bytes(payload))
+        return decode_detections(recv_message(self.sock)[1])
+
+    def _detect_batch(self, frames):
+        results = []
+        with self._lock:
+            for start in range(0, len(frames), self.slots):
+                chunk = frames[start:start + self.slots]
+                try:
+                    results += self._request(chunk)
+                except (ConnectionError, OSError):
+                    # Server restarted: reconnect once and retry
+                    Metrics.incr("detector.remote.reconnects")
+                    self.sock.close()
+                    self._connect()
+                    results += self._request(chunk)
+        return results
+
+    def _close_shm(self):
+        self._letterbox = None
+        self.shm.close()
+        self.shm.unlink()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        if self.shm is not None:
+            self._close_shm()
+            self.shm = None
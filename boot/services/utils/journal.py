@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_BYTES = 1024 * 1024
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 60  # Seconds of records a power cut can lose
+DEFAULT_READ_RECORDS = 500
+
+SEGMENT_SUFFIX = ".log"
+CURSOR_FILE = "cursor"
+HEADER = struct.Struct("<II")  # Record length, CRC32 of the record
+
+
+class DetectionJournal:
+    """Append-only journal of detection records in numbered segment files, with an upload cursor.
+
+    append() writes one length-prefixed, checksummed JSON record with a
+    single write() call, so a write costs the same however many records
+    are waiting and a crashed process loses nothing the kernel has seen.
+    The segment is fsynced at most every `fsync_interval` seconds. A
+    segment is closed once it reaches `segment_bytes`; when all segments
+    together exceed `max_bytes` the oldest are deleted, uploaded or not.
+
+    read() returns the records after the cursor and the cursor just past
+    them; commit() stores that cursor once the records have been uploaded
+    and deletes the segments before it, except the newest one holding
+    records, which last() reads after a restart. Each run writes a new
+    segment, so a record torn by a crash only ends its own segment.
+    """
+
+    def __init__(self, directory, segment_bytes=DEFAULT_SEGMENT_BYTES, max_bytes=DEFAULT_MAX_BYTES,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL, name="journal"):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, segment_bytes)
+        self.fsync_interval = fsync_interval
+        self.name = name
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._sizes = {}  # Segment number -> bytes, oldest first
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(SEGMENT_SUFFIX) and filename[:-len(SEGMENT_SUFFIX)].isdigit():
+                self._sizes[int(filename[:-len(SEGMENT_SUFFIX)])] = os.path.getsize(os.path.join(directory, filename))
+        self._sizes = dict(sorted(self._sizes.items()))
+        self._cursor = self._load_cursor()
+        self._drop_uploaded()
+
+        self._segment = max(self._sizes, default=0) + 1
+        self._sizes[self._segment] = 0
+        self._file = open(self._path(self._segment), "ab", buffering=0)
+        self._last_sync = time.monotonic()
+        if self._cursor[0] not in self._sizes:
+            self._cursor = (min(segment for segment in self._sizes if segment >= self._cursor[0]), 0)
+        self._report()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}{SEGMENT_SUFFIX}")
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                segment, offset = (int(value) for value in f.read().split())
+            return segment, offset
+        except (OSError, ValueError):
+            return (min(self._sizes, default=0), 0)
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self._cursor[0]} {self._cursor[1]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _drop_uploaded(self):
+        """Delete closed segments the cursor has moved past, but keep the newest non-empty one for last()."""
+        newest = max((segment for segment, size in self._sizes.items() if size), default=None)
+        for segment in [segment for segment in self._sizes if segment < self._cursor[0] and segment != newest]:
+            self._remove(segment)
+
+    def _remove(self, segment):
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+        del self._sizes[segment]
+
+    def append(self, record):
+        data = json.dumps(record, separators=(",", ":")).encode()
+        with self._lock:
+            self._file.write(HEADER.pack(len(data), zlib.crc32(data)) + data)
+            self._sizes[self._segment] += HEADER.size + len(data)
+            if self._sizes[self._segment] >= self.segment_bytes:
+                self._roll()
+            elif time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+        Metrics.incr(f"{self.name}.appended")
+
+    def _sync(self):
+        started = time.perf_counter()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+        Metrics.timing(f"{self.name}.fsync", time.perf_counter() - started)
+
+    def _roll(self):
+        """Close the full segment, start the next one and enforce max_bytes."""
+        self._sync()
+        self._file.close()
+        self._segment += 1
+        self._sizes[self._segment] = 0
+        self._file = open(self._path(self._segment), "ab", buffering=0)
+
+        evicted = 0
+        while sum(self._sizes.values()) > self.max_bytes and len(self._sizes) > 1:
+            oldest = next(iter(self._sizes))
+            evicted += self._sizes[oldest]
+            self._remove(oldest)
+        if evicted:
+            if self._cursor[0] not in self._sizes:
+                self._cursor = (next(iter(self._sizes)), 0)
+            Metrics.incr(f"{self.name}.evictedBytes", evicted)
+            logger.warning(f"Detection journal over {self.max_bytes} bytes, dropped {evicted} bytes of records")
+        self._report()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _records(self, segment, offset):
+        """(record, offset after it) for each intact record of `segment` from `offset`."""
+        try:
+            f = open(self._path(segment), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, crc = HEADER.unpack(header)
+                data = f.read(length)
+                if len(data) < length or zlib.crc32(data) != crc:
+                    if segment != self._segment:
+                        Metrics.incr(f"{self.name}.tornRecords")
+                        logger.warning(f"Skipping torn record at {self._path(segment)}:{offset}")
+                    return
+                offset += HEADER.size + length
+                yield json.loads(data), offset
+
+    def read(self, max_records=DEFAULT_READ_RECORDS, max_bytes=None):
+        """Records not yet committed, and the cursor to commit after uploading them.
+
+        Stops after `max_records` records or before the JSON of the records
+        would exceed `max_bytes` (always returning at least one).
+        """
+        with self._lock:
+            records = []
+            size = 0
+            segment, offset = self._cursor
+            for candidate in [s for s in self._sizes if s >= segment]:
+                if candidate != segment:
+                    segment, offset = candidate, 0
+                for record, end in self._records(segment, offset):
+                    size += end - offset - HEADER.size
+                    if records and max_bytes is not None and size > max_bytes:
+                        return records, (segment, offset)
+                    records.append(record)
+                    offset = end
+                    if len(records) >= max_records:
+                        return records, (segment, offset)
+            if not records and (segment, offset) != self._cursor:
+                # Only empty segments or torn tails were left: nothing to upload, just move past them
+                self._cursor = (segment, offset)
+                self._save_cursor()
+                self._drop_uploaded()
+                self._report()
+            return records, (segment, offset)
+
+    def commit(self, cursor):
+        """Mark everything before `cursor` (from read()) as uploaded."""
+        with self._lock:
+            if cursor[0] < self._cursor[0]:
+                return  # Evicted while the upload was in flight
+            self._cursor = tuple(cursor)
+            self._save_cursor()
+            self._drop_uploaded()
+            self._report()
+
+    def pending(self):
+        """True if records were appended after the cursor."""
+        with self._lock:
+            return self._cursor != (self._segment, self._sizes[self._segment])
+
+    def last(self):
+        """The most recently appended record, uploaded or not, or None."""
+        with self._lock:
+            for segment in reversed(list(self._sizes)):
+                record = None
+                for record, _ in self._records(segment, 0):
+                    pass
+                if record is not None:
+                    return record
+        return None
+
+    def _report(self):
+        Metrics.gauge(f"{self.name}.bytes", sum(self._sizes.values()))
+        Metrics.gauge(f"{self.name}.segments", len(self._sizes))
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+
+def import_batch_file(journal, filename):
+    """Move the records of a legacy detection_batch.json into `journal` and delete the file."""
+    try:
+        with open(filename) as f:
+            batch = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except json.JSONDecodeError:
+        batch = []
+    for record in batch:
+        journal.append(record)
+    journal.sync()
+    os.remove(filename)
+    if batch:
+        logger.info(f"Moved {len(batch)} records from {filename} into the detection journal")
+    return len(batch)
+
+
+def make_journal(config, directory, fsync_interval=DEFAULT_FSYNC_INTERVAL, name="journal"):
+    """DetectionJournal sized by the optional `journal` config section ({"maxBytes": ..., "segmentBytes": ...})."""
+    journal_config = (config or {}).get("journal", {})
+    return DetectionJournal(
+        journal_config.get("directory", directory),
+        segment_bytes=journal_config.get("segmentBytes", DEFAULT_SEGMENT_BYTES),
+        max_bytes=journal_config.get("maxBytes", DEFAULT_MAX_BYTES),
+        fsync_interval=journal_config.get("fsyncSeconds", fsync_interval),
+        name=name,
+    )
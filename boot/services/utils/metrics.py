@@ -0,0 +1,126 @@
+import threading
+import logging
+import time
+import json
+import os
+import resource
+
+logger = logging.getLogger(__name__)
+
+_IMPORTED_AT = time.time()
+
+
+def process_uptime():
+    """Seconds since this process was started (since this module was imported off Linux)."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time() - _IMPORTED_AT
+
+
+def rss_mb():
+    """Current resident set size in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Metrics:
+    """Process-wide counters, gauges and timings shared by all service threads."""
+    _lock = threading.Lock()
+    _counters = {}
+    _gauges = {}
+    _timings = {}  # name -> [count, total_seconds, max_seconds]
+    _reporter = None
+
+    @staticmethod
+    def incr(name, value=1):
+        with Metrics._lock:
+            Metrics._counters[name] = Metrics._counters.get(name, 0) + value
+
+    @staticmethod
+    def gauge(name, value):
+        with Metrics._lock:
+            Metrics._gauges[name] = value
+
+    @staticmethod
+    def max_gauge(name, value):
+        """Keep the highest value seen for a gauge (e.g. peak queue depth)."""
+        with Metrics._lock:
+            if value > Metrics._gauges.get(name, value - 1):
+                Metrics._gauges[name] = value
+
+    @staticmethod
+    def timing(name, seconds):
+        with Metrics._lock:
+            entry = Metrics._timings.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+    @staticmethod
+    def get(name, default=0):
+        with Metrics._lock:
+            if name in Metrics._counters:
+                return Metrics._counters[name]
+            return Metrics._gauges.get(name, default)
+
+    @staticmethod
+    def snapshot():
+        """Return a JSON-compatible copy of every metric."""
+        with Metrics._lock:
+            timings = {
+                name: {
+                    "count": count,
+                    "avgMs": round(total / count * 1000, 2) if count else 0,
+                    "maxMs": round(peak * 1000, 2),
+                }
+                for name, (count, total, peak) in Metrics._timings.items()
+            }
+            return {
+                "counters": dict(Metrics._counters),
+                "gauges": dict(Metrics._gauges),
+                "timings": timings,
+            }
+
+    @staticmethod
+    def record_startup(service):
+        """Log and export how long `service` took to become ready and its RSS at that point."""
+        seconds, rss = round(process_uptime(), 2), round(rss_mb(), 1)
+        with Metrics._lock:
+            Metrics._gauges["startup.service"] = service
+            Metrics._gauges["startup.seconds"] = seconds
+            Metrics._gauges["startup.rssMB"] = rss
+        logger.info(f"Startup [{service}]: ready in {seconds}s, RSS {rss} MB")
+        return seconds, rss
+
+    @staticmethod
+    def start_reporter(interval=60, publish=None):
+        """Log (and optionally publish) a metrics snapshot every `interval` seconds."""
+        if Metrics._reporter is not None:
+            return Metrics._reporter
+
+        def report():
+            while True:
+                time.sleep(interval)
+                snapshot = Metrics.snapshot()
+                logger.info(f"Metrics: {json.dumps(snapshot)}")
+                if publish:
+                    try:
+                        publish(snapshot)
+                    except Exception as e:
+                        logger.error(f"Error publishing metrics: {e}")
+
+        Metrics._reporter = threading.Thread(target=report, daemon=True)
+        Metrics._reporter.start()
+        return Metrics._reporter
@@ -0,0 +1,104 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MotionGate:
+    """Cheap pre-inference check that lets the detector skip static scenes.
+
+    Each frame is reduced to a small blurred grayscale image and compared with
+    the previous one (frame differencing) or fed to a MOG2 background
+    subtractor. The detector should run only when the fraction of changed
+    pixels reaches `threshold`, or when `refresh_interval` seconds have passed
+    since it last ran.
+    """
+
+    def __init__(self, threshold=0.001, refresh_interval=30, width=160, method="diff",
+                 pixel_threshold=25, name="motion"):
+        if method not in ("diff", "mog2"):
+            raise ValueError(f"Unknown motion gate method: {method}")
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.width = width
+        self.method = method
+        self.pixel_threshold = pixel_threshold
+        self.name = name
+        self.last_changed_fraction = 0.0
+        self._previous = None
+        self._last_inference = None
+        self._subtractor = None
+        self._inferred = 0
+        self._skipped = 0
+        if method == "mog2":
+            self._subtractor = cv2.createBackgroundSubtractorMOG2(history=100, varThreshold=16, detectShadows=False)
+
+    def _small_gray(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.width, max(1, int(height * self.width / width)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def changed_fraction(self, frame):
+        """Fraction of pixels that changed since the previous frame (1.0 for the first frame)."""
+        small = self._small_gray(frame)
+        if self._subtractor is not None:
+            mask = self._subtractor.apply(small)
+            fraction = np.count_nonzero(mask) / mask.size
+        elif self._previous is None or self._previous.shape != small.shape:
+            fraction = 1.0
+        else:
+            diff = cv2.absdiff(small, self._previous)
+            fraction = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        self._previous = small
+        return fraction
+
+    def should_infer(self, frame, now=None):
+        """Record the gate decision for `frame` and return True if the detector should run."""
+        now = time.time() if now is None else now
+        fraction = self.changed_fraction(frame)
+        self.last_changed_fraction = fraction
+        Metrics.gauge(f"{self.name}.changedFraction", round(float(fraction), 5))
+
+        if fraction >= self.threshold:
+            decision = "motion"
+        elif self._last_inference is None or now - self._last_inference >= self.refresh_interval:
+            decision = "refresh"
+        else:
+            decision = None
+
+        if decision:
+            self._inferred += 1
+            self._last_inference = now
+            Metrics.incr(f"{self.name}.{decision}")
+        else:
+            self._skipped += 1
+            Metrics.incr(f"{self.name}.skipped")
+        Metrics.gauge(f"{self.name}.skipRatio", round(self._skipped / (self._inferred + self._skipped), 3))
+        return decision is not None
+
+
+def make_motion_gate(config, name="motion"):
+    """MotionGate from the optional `motionGate` config section, or None unless {"enabled": true}.
+
+    Off by default. Callers that track objects keep ticking their trackers
+    on the frames the gate skips, so tracks age at the frame rate.
+    """
+    gate_config = (config or {}).get("motionGate", {})
+    if not gate_config.get("enabled", False):
+        return None
+    return MotionGate(
+        threshold=gate_config.get("threshold", 0.001),
+        refresh_interval=gate_config.get("refreshInterval", 30),
+        width=gate_config.get("width", 160),
+        method=gate_config.get("method", "diff"),
+        pixel_threshold=gate_config.get("pixelThreshold", 25),
+        name=name,
+    )
@@ -5,6 +5,12 @@ import json
 from datetime import datetime
 import sys
 import os
+import threading
+import time
+from collections import deque
+
+from metrics import Metrics
+from codec import encode, encoding_for
 DEVICE_ID = get_cpu_serial()    
 
 # EMQX Broker Settings
@@ -50,7 +56,8 @@ def on_disconnect(client, userdata, rc, properties=None):
     logger.info(f"Disconnected with result code: {rc}")
 
 def on_publish(client, userdata, mid, properties=None):
-    logger.debug(f"Message {mid} published successfully")
+    logger.debug("Message %s published successfully", mid)
+    outbox.acknowledge(mid)  # QoS 1: the broker's PUBACK
 
 def on_log(client, userdata, level, buf):
     logger.debug(f"MQTT Log: {buf}")
@@ -60,13 +67,19 @@ def on_message(client, userdata, message):
 
 class MQTTClient:
     _instance = None
-    _is_connected = False
+    _connected = threading.Event()
+    _lock = threading.Lock()
     _subscribed_topics = set()
     _connection_attempts = 0
     MAX_RETRIES = 2
 
     @staticmethod
     def get_instance(force_new=False):
+        with MQTTClient._lock:
+            return MQTTClient._get_instance(force_new)
+
+    @staticmethod
+    def _get_instance(force_new):
         if MQTTClient._instance is None or force_new:
             if force_new:
                 logger.info("Creating new MQTT client instance...")
@@ -77,14 +90,15 @@ class MQTTClient:
                         MQTTClient._instance.disconnect()
                     except:
                         pass
+                    outbox.reset_inflight()  # Their PUBACKs will not arrive on the new client
             
             MQTTClient._instance = mqtt.Client(protocol=mqtt.MQTTv5)
             client = MQTTClient._instance
-            MQTTClient._is_connected = False
+            MQTTClient._connected.clear()
             
             # Set up callbacks
             client.on_connect = lambda client, userdata, flags, rc, properties=None: MQTTClient._on_connect(client, userdata, flags, rc, properties)
-            client.on_disconnect = on_disconnect
+            client.on_disconnect = MQTTClient._on_disconnect
             client.on_publish = on_publish
             client.on_log = on_log
             client.on_message = on_message
@@ -105,30 +119,31 @@ class MQTTClient:
 
     @staticmethod
     def _on_connect(client, userdata, flags, rc, properties=None):
-        MQTTClient._is_connected = (rc == 0)
         if rc == 0:
+            MQTTClient._connected.set()
             logger.info("Connected to MQTT Broker!")
         else:
+            MQTTClient._connected.clear()
             logger.error(f"Failed to connect, return code {rc}")
 
+    @staticmethod
+    def _on_disconnect(client, userdata, rc, properties=None):
+        if client is MQTTClient._instance:  # Not the instance being replaced
+            MQTTClient._connected.clear()
+        on_disconnect(client, userdata, rc, properties)
+
     @staticmethod
     def wait_for_connection(timeout=10):
         """Wait for the connection to be established with retry logic"""
-        import time
-        start_time = time.time()
-        
-        while not MQTTClient._is_connected:
-            if time.time() - start_time > timeout:
-                MQTTClient._connection_attempts += 1
-                if MQTTClient._connection_attempts <= MQTTClient.MAX_RETRIES:
-                    logger.warning(f"Connection attempt {MQTTClient._connection_attempts} failed. Creating new instance...")
-                    # Get a new instance and reset the timer
-                    MQTTClient.get_instance(force_new=True)
-                    start_time = time.time()
-                else:
-                    MQTTClient._connection_attempts = 0  # Reset for next time
-                    raise TimeoutError("Connection timeout after all retries")
-            time.sleep(0.1)
+        # Woken by the connect callback instead of polling
+        while not MQTTClient._connected.wait(timeout):
+            MQTTClient._connection_attempts += 1
+            if MQTTClient._connection_attempts <= MQTTClient.MAX_RETRIES:
+                logger.warning(f"Connection attempt {MQTTClient._connection_attempts} failed. Creating new instance...")
+                MQTTClient.get_instance(force_new=True)
+            else:
+                MQTTClient._connection_attempts = 0  # Reset for next time
+                raise TimeoutError("Connection timeout after all retries")
         
         MQTTClient._connection_attempts = 0  # Reset on successful connection
 
@@ -178,57 +193,203 @@ class MQTTClient:
             logger.error(f"Error in unsubscribe: {str(e)}", exc_info=True)
             return False
 
-def publish_message(message, topic=TOPIC):
-    try:
-        client = MQTTClient.get_instance()
-        
-        # Wait for connection before publishing
-        try:
-            MQTTClient.wait_for_connection()
-        except TimeoutError:
-            logger.error("Timed out waiting for MQTT connection")
-            return
-            
-        # Convert message to JSON-compatible dict if it's not already
-        if isinstance(message, str):
+# Outbound queue policies when the queue is full (publish_message never blocks the caller)
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+OUTBOX_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+DEFAULT_OUTBOX_SIZE = 1000
+
+
+# Per-topic payload encoding from the "mqtt" config section ({"traffic": "msgpack", "default": "json"})
+encodings = {}
+
+
+def serialize(message, topic=TOPIC):
+    """Encode a message once for the wire; dicts get a "timestamp" when they have none."""
+    encoding = encoding_for(topic, encodings)
+    if isinstance(message, dict):
+        if "timestamp" not in message:
+            # Binary topics get epoch milliseconds: 9 bytes instead of a 28-byte ISO string
+            now = datetime.now()
+            message = {**message, "timestamp": now.isoformat() if encoding == "json" else int(now.timestamp() * 1000)}
+        return encode(message, encoding)
+    if isinstance(message, (bytes, bytearray)):
+        return bytes(message)
+    message = str(message)
+    if message[:1] in ("{", "["):
+        return message.encode()  # Already JSON from the caller
+    return json.dumps({"message": message, "timestamp": datetime.now().isoformat()}).encode()
+
+
+class Outbox:
+    """Bounded queue of serialized messages drained by one background publisher thread.
+
+    publish() only serializes and queues, so inference and counting threads
+    never wait for the broker. When the queue is full the oldest (or the new)
+    message is dropped. A message published with a `merge_key` replaces one
+    with the same topic and key that is still queued, so state-like messages
+    (status, config, billboard health) collapse to the latest while offline.
+    """
+
+    def __init__(self, maxsize=DEFAULT_OUTBOX_SIZE, policy=DROP_OLDEST):
+        if policy not in OUTBOX_POLICIES:
+            raise ValueError(f"Unknown MQTT outbox policy: {policy}")
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self._items = deque()  # [topic, payload, merge_key, queued_at]
+        self._merge_index = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def put(self, topic, payload, merge_key=None):
+        """Queue serialized `payload` for `topic`; returns False if it was dropped."""
+        now = time.time()
+        with self._cond:
+            if merge_key is not None and (topic, merge_key) in self._merge_index:
+                item = self._merge_index[(topic, merge_key)]
+                item[1], item[3] = payload, now
+                Metrics.incr("mqtt.merged")
+                return True
+            if len(self._items) >= self.maxsize:
+                Metrics.incr("mqtt.dropped")
+                if self.policy == DROP_NEWEST:
+                    return False
+                self._forget(self._items.popleft())
+            item = [topic, payload, merge_key, now]
+            self._items.append(item)
+            if merge_key is not None:
+                self._merge_index[(topic, merge_key)] = item
+            depth = len(self._items)
+            self._cond.notify()
+        Metrics.gauge("mqtt.queueDepth", depth)
+        Metrics.max_gauge("mqtt.maxQueueDepth", depth)
+        self._ensure_started()
+        return True
+
+    def _forget(self, item):
+        if item[2] is not None:
+            self._merge_index.pop((item[0], item[2]), None)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, daemon=True, name="mqtt-publish")
+                    self._thread.start()
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._items) > 0)
+                item = self._items[0]
+
             try:
-                # Check if the string is already valid JSON
-                msg_dict = json.loads(message)
-            except json.JSONDecodeError:
-                # If not JSON, create a new JSON object
-                msg_dict = {
-                    "message": message,
-                    "timestamp": datetime.now().isoformat()
-                }
-        else:
-            # If message is dict or other type, convert to JSON-compatible dict
-            if isinstance(message, dict):
-                msg_dict = message.copy()  # Create a copy to avoid modifying original
-                msg_dict["timestamp"] = datetime.now().isoformat()
+                client = MQTTClient.get_instance()
+                MQTTClient.wait_for_connection()
+                topic, payload = item[0], item[1]
+                result = client.publish(topic, payload)
+            except Exception as e:
+                # Keep the message and retry; only this thread waits for the broker
+                logger.error(f"Error in publish_message: {e}")
+                time.sleep(1)
+                continue
+
+            with self._cond:
+                if self._items and self._items[0] is item:
+                    self._items.popleft()
+                    self._forget(item)
+                depth = len(self._items)
+                self._cond.notify_all()
+            Metrics.gauge("mqtt.queueDepth", depth)
+            if result[0] == 0:
+                Metrics.incr("mqtt.published")
+                Metrics.timing("mqtt.publishLatency", time.time() - item[3])
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Published %d bytes to %s (message ID %s)", len(payload), topic, result[1])
             else:
-                msg_dict = {
-                    "message": str(message),
-                    "timestamp": datetime.now().isoformat()
-                }
-        
-        # Pretty print for logging
-        logger.info(f"Attempting to publish message to {topic}:\n{json.dumps(msg_dict, indent=2)}")
-        
-        # Convert to compact JSON string for publishing
-        msg_str = json.dumps(msg_dict)
-        result = client.publish(topic, msg_str)
-        
-        # Check if the message was published
-        if result[0] == 0:
-            logger.debug(f"Message queued successfully. Message ID: {result[1]}")
-        else:
-            logger.error(f"Failed to publish message. Result code: {result[0]}")
-            
-    except Exception as e:
-        logger.error(f"Error in publish_message: {str(e)}", exc_info=True)
+                Metrics.incr("mqtt.errors")
+                logger.error(f"Failed to publish message. Result code: {result[0]}")
+
+    def acknowledge(self, mid):
+        pass  # Sent at QoS 0, nothing to confirm
+
+    def reset_inflight(self):
+        pass
+
+    def flush(self, timeout=None):
+        """Wait until every queued message has been handed to the client; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self._items) == 0, timeout)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+
+outbox = Outbox()
+
+
+def _connected_client():
+    MQTTClient.get_instance()
+    MQTTClient.wait_for_connection()
+    return MQTTClient.get_instance()
+
+
+def configure_outbox(mqtt_config):
+    """Apply the optional `mqtt` config section to the outbox.
+
+    "encoding" maps topics (or their first level) to a codec encoding.
+    {"queueSize", "dropPolicy"} size the in-memory outbox. With "persist"
+    ({"path", "maxBytes", "replayRate", "maxInflight", "ackTimeout"}) messages
+    go through a DiskOutbox instead and survive broker outages and restarts.
+    """
+    global outbox
+    mqtt_config = mqtt_config or {}
+    encodings.clear()
+    encodings.update(mqtt_config.get("encoding") or {})
+    persist_config = mqtt_config.get("persist")
+    if persist_config:
+        if persist_config is True:
+            persist_config = {}
+        import mqtt_store
+
+        # One database per service, next to its script like its log file
+        path = persist_config.get("path") or os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "mqtt-outbox.db")
+        disk_outbox = mqtt_store.DiskOutbox(
+            path,
+            _connected_client,
+            max_bytes=persist_config.get("maxBytes", mqtt_store.DEFAULT_MAX_BYTES),
+            replay_rate=persist_config.get("replayRate", mqtt_store.DEFAULT_REPLAY_RATE),
+            max_inflight=persist_config.get("maxInflight", mqtt_store.DEFAULT_MAX_INFLIGHT),
+            ack_timeout=persist_config.get("ackTimeout", mqtt_store.DEFAULT_ACK_TIMEOUT),
+        )
+        previous, outbox = outbox, disk_outbox
+        if isinstance(previous, Outbox):
+            # Messages queued before the config was loaded
+            with previous._cond:
+                pending = list(previous._items)
+                previous._items.clear()
+            for topic, payload, merge_key, _ in pending:
+                disk_outbox.put(topic, payload, merge_key)
+        logger.info(f"MQTT messages are stored in {path} until acknowledged")
+        return
+
+    policy = mqtt_config.get("dropPolicy", DROP_OLDEST)
+    if policy not in OUTBOX_POLICIES:
+        raise ValueError(f"Unknown MQTT outbox policy: {policy}")
+    if not isinstance(outbox, Outbox):
+        return
+    with outbox._cond:
+        outbox.maxsize = max(1, int(mqtt_config.get("queueSize", DEFAULT_OUTBOX_SIZE)))
+        outbox.policy = policy
+
+
+def publish_message(message, topic=TOPIC, merge_key=None):
+    """Queue a dict (or JSON string) for publishing and return immediately."""
+    return outbox.put(topic, serialize(message, topic), merge_key)
 
-def publish_log(message, topic):
-    publish_message(message, f"{topic}/{DEVICE_ID}")
+def publish_log(message, topic, merge_key=None):
+    return publish_message(message, f"{topic}/{DEVICE_ID}", merge_key)
 
 def subscribe_to_topic(topic, message_handler):
     MQTTClient.subscribe(f"{topic}/{DEVICE_ID}", 0, message_handler)
@@ -0,0 +1,228 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_REPLAY_RATE = 50  # Messages per second handed to the client
+DEFAULT_MAX_INFLIGHT = 20  # Unacknowledged QoS 1 messages at a time
+DEFAULT_ACK_TIMEOUT = 60  # Seconds before an unacknowledged message is sent again
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    merge_key TEXT,
+    queued_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS messages_merge ON messages (topic, merge_key) WHERE merge_key IS NOT NULL;
+"""
+
+
+class DiskOutbox:
+    """Store-and-forward MQTT outbox in a SQLite WAL database, so messages survive outages and restarts.
+
+    put() appends a serialized message; a message with a `merge_key`
+    overwrites the undelivered one with the same topic and key. When the
+    stored payloads exceed `max_bytes` the oldest messages are evicted.
+
+    One thread sends the oldest messages at QoS 1, at most `replay_rate` a
+    second and `max_inflight` unacknowledged at a time, and a row is only
+    deleted when the broker's PUBACK arrives (acknowledge()). Rows without
+    a PUBACK after `ack_timeout` seconds, or left over from a previous run,
+    are sent again, so delivery is at-least-once.
+
+    `connect` returns a connected paho client (blocking until it is); it
+    is only called from the sending thread.
+    """
+
+    def __init__(self, path, connect, max_bytes=DEFAULT_MAX_BYTES, replay_rate=DEFAULT_REPLAY_RATE,
+                 max_inflight=DEFAULT_MAX_INFLIGHT, ack_timeout=DEFAULT_ACK_TIMEOUT):
+        self.path = path
+        self.connect = connect
+        self.max_bytes = max_bytes
+        self.replay_rate = replay_rate
+        self.max_inflight = max(1, int(max_inflight))
+        self.ack_timeout = ack_timeout
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # No fsync per message; a checkpoint syncs
+        self._db.executescript(SCHEMA)
+        self._db.execute("UPDATE messages SET sent_at = NULL")  # In flight when the last run stopped
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM messages").fetchone()[0]
+        self._inflight = {}  # mid -> (row id, time sent)
+        self._early_acks = set()  # PUBACKs that beat publish() returning the mid
+        self._publishing = False  # Early acks are only expected while publish() runs
+        self._cond = threading.Condition()
+        self._thread = None
+        Metrics.gauge("mqtt.store.bytes", self._bytes)
+
+    def put(self, topic, payload, merge_key=None):
+        now = time.time()
+        with self._cond:
+            if merge_key is None:
+                self._db.execute(
+                    "INSERT INTO messages (topic, payload, queued_at) VALUES (?, ?, ?)", (topic, payload, now))
+            else:
+                previous = self._db.execute(
+                    "SELECT id, LENGTH(payload) FROM messages WHERE topic = ? AND merge_key = ?", (topic, merge_key)
+                ).fetchone()
+                if previous:
+                    self._bytes -= previous[1]
+                    Metrics.incr("mqtt.merged")
+                    # The row keeps its id but gets a new payload: a PUBACK for the old one must not delete it
+                    self._forget_inflight(previous[0])
+                self._db.execute(
+                    "INSERT INTO messages (topic, payload, merge_key, queued_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (topic, merge_key) WHERE merge_key IS NOT NULL "
+                    "DO UPDATE SET payload = excluded.payload, queued_at = excluded.queued_at, sent_at = NULL",
+                    (topic, payload, merge_key, now),
+                )
+            self._bytes += len(payload)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._cond.notify_all()
+        Metrics.gauge("mqtt.store.bytes", self._bytes)
+        self._ensure_started()
+        return True
+
+    def _evict(self):
+        """Drop the oldest messages until the stored payloads fit in max_bytes again."""
+        evicted = 0
+        for row_id, size in self._db.execute("SELECT id, LENGTH(payload) FROM messages ORDER BY id").fetchall():
+            if self._bytes <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM messages WHERE id = ?", (row_id,))
+            self._forget_inflight(row_id)
+            self._bytes -= size
+            evicted += 1
+        Metrics.incr("mqtt.dropped", evicted)
+
+    def acknowledge(self, mid):
+        """PUBACK for message `mid`: the broker has it, so forget the row."""
+        with self._cond:
+            inflight = self._inflight.pop(mid, None)
+            if inflight is None:
+                # Either publish() has not returned this mid yet, or the ack is for a payload
+                # that was merged away, evicted or timed out; only the first may delete a row
+                if self._publishing:
+                    self._early_acks.add(mid)
+                return
+            self._delete(inflight[0])
+
+    def _forget_inflight(self, row_id):
+        for mid in [mid for mid, (inflight_id, _) in self._inflight.items() if inflight_id == row_id]:
+            del self._inflight[mid]
+
+    def _expire_inflight(self, now):
+        """Give up on mids without a PUBACK for ack_timeout, so their rows are sent again."""
+        for mid in [mid for mid, (_, sent_at) in self._inflight.items() if sent_at <= now - self.ack_timeout]:
+            del self._inflight[mid]
+            Metrics.incr("mqtt.ackTimeouts")
+
+    def _wait_timeout(self, now):
+        """Seconds until the oldest unacknowledged mid times out (ack_timeout with none in flight)."""
+        oldest = min((sent_at for _, sent_at in self._inflight.values()), default=now)
+        return max(0.0, oldest + self.ack_timeout - now)
+
+    def _delete(self, row_id):
+        row = self._db.execute("SELECT LENGTH(payload), queued_at FROM messages WHERE id = ?", (row_id,)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM messages WHERE id = ?", (row_id,))
+            self._bytes -= row[0]
+            Metrics.incr("mqtt.published")
+            Metrics.timing("mqtt.publishLatency", time.time() - row[1])
+        self._cond.notify_all()
+
+    def _due(self, now):
+        """Oldest rows to send: never sent, or sent without a PUBACK for ack_timeout."""
+        self._expire_inflight(now)
+        return self._db.execute(
+            "SELECT id, topic, payload FROM messages WHERE sent_at IS NULL OR sent_at <= ? ORDER BY id LIMIT ?",
+            (now - self.ack_timeout, self.max_inflight - len(self._inflight)),
+        ).fetchall()
+
+    def run(self):
+        interval = 1.0 / self.replay_rate if self.replay_rate else 0.0
+        next_send = 0.0
+        while True:
+            with self._cond:
+                # Wake on new messages and acks; the timeout picks up rows whose ack timed out
+                self._cond.wait_for(lambda: self._due(time.time()), timeout=self._wait_timeout(time.time()))
+                rows = self._due(time.time())
+            if not rows:
+                continue
+
+            try:
+                client = self.connect()
+            except Exception as e:
+                logger.error(f"MQTT store cannot connect: {e}")
+                time.sleep(1)
+                continue
+
+            for row_id, topic, payload in rows:
+                time.sleep(max(0.0, next_send - time.time()))
+                next_send = max(next_send, time.time() - 1.0) + interval
+                with self._cond:
+                    if self._db.execute("SELECT 1 FROM messages WHERE id = ?", (row_id,)).fetchone() is None:
+                        continue  # Evicted since it was selected
+                    self._publishing = True
+                try:
+                    result = client.publish(topic, payload, qos=1)
+                except Exception as e:
+                    logger.error(f"MQTT store publish failed: {e}")
+                    with self._cond:
+                        self._publishing = False
+                        self._early_acks.clear()
+                    break
+                with self._cond:
+                    self._publishing = False
+                    acked_early = result[1] in self._early_acks
+                    self._early_acks.clear()
+                    if result[0] != 0:
+                        Metrics.incr("mqtt.errors")
+                        logger.error(f"Failed to publish message. Result code: {result[0]}")
+                        break
+                    # The payload may have been merged while publish() ran: then this send is stale
+                    current = self._db.execute("SELECT payload FROM messages WHERE id = ?", (row_id,)).fetchone()
+                    if current is None or current[0] != payload:
+                        continue
+                    self._db.execute("UPDATE messages SET sent_at = ? WHERE id = ?", (time.time(), row_id))
+                    # Drop a stale mid from a previous send of this row
+                    self._forget_inflight(row_id)
+                    if acked_early:
+                        self._delete(row_id)
+                    else:
+                        self._inflight[result[1]] = (row_id, time.time())
+            Metrics.gauge("mqtt.queueDepth", self.qsize())
+            Metrics.gauge("mqtt.store.bytes", self._bytes)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, daemon=True, name="mqtt-store")
+                    self._thread.start()
+
+    def reset_inflight(self):
+        """Forget unacknowledged mids (e.g. a new client instance) so their rows are sent again."""
+        with self._cond:
+            self._inflight.clear()
+            self._early_acks.clear()
+            self._db.execute("UPDATE messages SET sent_at = NULL")
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until every stored message has been acknowledged; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.qsize() == 0, timeout)
+
+    def qsize(self):
+        with self._cond:
+            return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
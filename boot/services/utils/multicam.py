@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+from pipeline import LatestFrame
+from capture import open_capture
+
+logger = logging.getLogger(__name__)
+
+
+def parse_streams(config, default_url=None):
+    """Camera list from config["streams"] ([{"id", "rtspStreamUrl", "counting"}, ...]), else the single rtspStreamUrl."""
+    streams = config.get("streams") or []
+    if not streams and config.get("rtspStreamUrl", default_url):
+        streams = [{"id": "default", "rtspStreamUrl": config.get("rtspStreamUrl", default_url)}]
+
+    parsed = []
+    for index, stream in enumerate(streams):
+        if isinstance(stream, str):
+            stream = {"rtspStreamUrl": stream}
+        if not stream.get("rtspStreamUrl"):
+            logger.warning(f"Skipping stream {index} without rtspStreamUrl")
+            continue
+        parsed.append({
+            "id": str(stream.get("id", f"camera{index}")),
+            "rtspStreamUrl": stream["rtspStreamUrl"],
+            # Counting lines and zones are in this camera's pixels; a single-camera config may keep them top level
+            "counting": stream.get("counting", config.get("counting") if len(streams) == 1 else None),
+        })
+    return parsed
+
+
+class CameraStream:
+    """One camera of a multi-camera service: its capture thread, latest frame and per-camera state."""
+
+    def __init__(self, camera_id, url, capture_config=None, cond=None, counting_config=None):
+        self.id = camera_id
+        self.url = url
+        self.capture_config = capture_config
+        self.counting_config = counting_config  # Optional {"lines": [...], "zones": [...]} for this camera
+        self.cap = None
+        self.slot = LatestFrame(f"capture.{camera_id}", cond)
+        self.last_seq = 0
+        self.preprocess = None  # Optional callable run on each frame in the capture thread (e.g. Letterbox.publish)
+        self.state = {}  # Per-camera tracker, counters etc. owned by the service
+
+    def capture_frames(self):
+        while True:
+            ret, frame = self.cap.read()
+            if ret:
+                self.slot.put(self.preprocess(frame) if self.preprocess else frame)
+            else:
+                logger.error(f"Failed to capture frame from camera {self.id}")
+                time.sleep(1)  # Wait before retrying
+
+    def start(self):
+        self.cap = open_capture(self.url, self.capture_config)
+        thread = threading.Thread(target=self.capture_frames, daemon=True, name=f"capture-{self.id}")
+        thread.start()
+        return thread
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+class FrameBatcher:
+    """Collects the newest unseen frame of every camera into one batch for a single forward pass."""
+
+    def __init__(self, streams, cond, max_batch=None):
+        self.cond = cond
+        self.streams = list(streams)
+        self.max_batch = max_batch or len(streams)
+
+    def _ready(self):
+        return [stream for stream in self.streams if stream.slot.seq > stream.last_seq]
+
+    def next_batch(self, timeout=None):
+        """Block until at least one camera has a new frame.
+
+        Returns a list of (stream, frame_time, frame), oldest-waiting camera
+        first, capped at max_batch; empty if the timeout expired. Pooled
+        LetterboxedFrames are checked out and must be released by the caller.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self._ready()) > 0, timeout):
+                return []
+            batch = []
+            for stream in self._ready()[:self.max_batch]:
+                seq, frame_time, frame = stream.slot.peek()
+                stream.last_seq = seq
+                if hasattr(frame, "checkout"):
+                    # Under the slot's condition, so the capture thread cannot reuse the canvas first;
+                    # the consumer releases it after detection
+                    frame.checkout()
+                batch.append((stream, frame_time, frame))
+        # Rotate so cameras beyond max_batch go first next time
+        if len(batch) < len(self.streams):
+            served = {id(stream) for stream, _, _ in batch}
+            self.streams = [s for s in self.streams if id(s) not in served] + [s for s in self.streams if id(s) in served]
+        return batch
+
+
+def create_streams(config, default_url=None):
+    """CameraStream objects plus a FrameBatcher that waits on all of them through one shared condition."""
+    cond = threading.Condition()
+    streams = [
+        CameraStream(stream["id"], stream["rtspStreamUrl"], config.get("capture"), cond, stream["counting"])
+        for stream in parse_streams(config, default_url)
+    ]
+    return streams, FrameBatcher(streams, cond, config.get("pipeline", {}).get("maxBatch"))
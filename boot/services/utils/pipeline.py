@@ -0,0 +1,173 @@
+import threading
+import logging
+import queue
+import time
+from collections import deque
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Drop policies for StageQueue
+DROP_OLDEST = "drop-oldest"   # Evict the oldest item when the queue is full
+LATEST_ONLY = "latest-only"   # Keep only the newest item, discard anything pending
+BLOCK = "block"               # Block the producer until there is room
+
+DROP_POLICIES = (DROP_OLDEST, LATEST_ONLY, BLOCK)
+
+
+class LatestFrame:
+    """Single-slot frame hand-off guarded by a condition and a sequence number.
+
+    The capture thread calls put() for every decoded frame; consumers block in
+    get() until a frame newer than the one they last saw arrives, so nothing
+    spins while waiting for the camera. Several slots may share one condition
+    so a consumer can wait for whichever camera delivers first.
+    """
+
+    def __init__(self, name="capture", cond=None):
+        self.name = name
+        self._cond = cond or threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._timestamp = 0.0
+        self._last_put = None
+
+    def put(self, frame, timestamp=None):
+        now = time.time()
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._timestamp = now if timestamp is None else timestamp
+            self._cond.notify_all()
+        Metrics.incr(f"pipeline.{self.name}.frames")
+        if self._last_put is not None:
+            # Spread between avg and max shows capture jitter, e.g. GIL contention from inference
+            Metrics.timing(f"pipeline.{self.name}.interval", now - self._last_put)
+        self._last_put = now
+
+    def get(self, last_seq=0, timeout=None):
+        """Wait for a frame newer than `last_seq`.
+
+        Returns (seq, timestamp, frame), or None if the timeout expired.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq, timeout):
+                return None
+            return self._seq, self._timestamp, self._frame
+
+    def peek(self):
+        """Return the current (seq, timestamp, frame) without waiting."""
+        with self._cond:
+            return self._seq, self._timestamp, self._frame
+
+    @property
+    def seq(self):
+        with self._cond:
+            return self._seq
+
+
+class StageQueue:
+    """Bounded hand-off between two pipeline stages with a configurable drop policy."""
+
+    def __init__(self, name, maxsize=2, policy=DROP_OLDEST):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def put(self, item, timeout=None):
+        """Queue an item, applying the drop policy. Returns False if it was dropped."""
+        dropped = 0
+        with self._cond:
+            if self.policy == LATEST_ONLY:
+                dropped = len(self._items)
+                self._items.clear()
+            elif len(self._items) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    dropped = 1
+                elif not self._cond.wait_for(lambda: len(self._items) < self.maxsize, timeout):
+                    Metrics.incr(f"pipeline.{self.name}.dropped")
+                    return False
+            self._items.append(item)
+            depth = len(self._items)
+            self._cond.notify_all()
+
+        Metrics.incr(f"pipeline.{self.name}.put")
+        if dropped:
+            Metrics.incr(f"pipeline.{self.name}.dropped", dropped)
+        Metrics.gauge(f"pipeline.{self.name}.depth", depth)
+        Metrics.max_gauge(f"pipeline.{self.name}.maxDepth", depth)
+        return True
+
+    def get(self, timeout=None):
+        """Block until an item is available. Raises queue.Empty on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._items) > 0, timeout):
+                raise queue.Empty
+            item = self._items.popleft()
+            depth = len(self._items)
+            self._cond.notify_all()
+        Metrics.gauge(f"pipeline.{self.name}.depth", depth)
+        return item
+
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+
+def make_queue(name, pipeline_config=None, default_size=2, default_policy=DROP_OLDEST, per_frame=True):
+    """Build a StageQueue from the optional `pipeline` section of the device config.
+
+    {"queues": {name: {"size": ..., "policy": ...}}} sets one queue. The
+    section-wide "queueSize" and "dropPolicy" only apply to per_frame queues,
+    which carry one item per processed frame; others such as the publish
+    queue keep their own defaults.
+    """
+    pipeline_config = pipeline_config or {}
+    queue_config = pipeline_config.get("queues", {}).get(name, {})
+    if per_frame:
+        default_size = pipeline_config.get("queueSize", default_size)
+        default_policy = pipeline_config.get("dropPolicy", default_policy)
+    return StageQueue(
+        name,
+        maxsize=queue_config.get("size", default_size),
+        policy=queue_config.get("policy", default_policy),
+    )
+
+
+def run_stage(name, source, handler, sink=None):
+    """Run a pipeline stage forever: take from `source`, call `handler`, push to `sink`.
+
+    `handler` may return None to emit nothing for a given input.
+    """
+    while True:
+        item = source.get()
+        started = time.time()
+        try:
+            result = handler(item)
+        except Exception as e:
+            Metrics.incr(f"pipeline.{name}.errors")
+            logger.error(f"Error in pipeline stage {name}: {e}", exc_info=True)
+            continue
+        Metrics.timing(f"pipeline.{name}", time.time() - started)
+        if sink is not None and result is not None:
+            sink.put(result)
+
+
+def start_stage(name, source, handler, sink=None):
+    """Start run_stage() in a daemon thread and return the thread."""
+    thread = threading.Thread(target=run_stage, args=(name, source, handler, sink), daemon=True, name=name)
+    thread.start()
+    return thread
+
+
+def wait_until(deadline):
+    """Sleep until the given time.time() deadline (no-op if it already passed)."""
+    remaining = deadline - time.time()
+    if remaining > 0:
+        time.sleep(remaining)
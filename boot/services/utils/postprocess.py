@@ -0,0 +1,47 @@
+import numpy as np
+
+from detector import Detections
+
+
+class ClassCounter:
+    """Per-class counts of confident detections for a fixed list of class names.
+
+    A lookup table maps every model class id to its position in `classes`
+    (or -1), so one confidence mask plus one np.bincount replaces the
+    per-box Python loop.
+    """
+
+    def __init__(self, names, classes, min_confidence=0.3):
+        self.classes = list(classes)
+        self.min_confidence = min_confidence
+        if isinstance(names, (list, tuple)):
+            names = dict(enumerate(names))
+        self.lookup = np.full(max(names) + 1 if names else 1, -1, dtype=np.int64)
+        for class_id, name in names.items():
+            if name in self.classes:
+                self.lookup[class_id] = self.classes.index(name)
+
+    def indices(self, detections):
+        """Position in `classes` of every detection, -1 for unconfident or untracked ones."""
+        class_id = np.asarray(detections.class_id, dtype=np.int64)
+        known = (class_id >= 0) & (class_id < len(self.lookup))
+        index = np.full(len(class_id), -1, dtype=np.int64)
+        index[known] = self.lookup[class_id[known]]
+        index[np.asarray(detections.confidence) < self.min_confidence] = -1
+        return index
+
+    def mask(self, detections):
+        return self.indices(detections) >= 0
+
+    def counts(self, detections):
+        """Counts per class as an int array aligned with `classes`."""
+        index = self.indices(detections)
+        return np.bincount(index[index >= 0], minlength=len(self.classes))
+
+    def count_dict(self, detections):
+        return dict(zip(self.classes, self.counts(detections).tolist()))
+
+    def filter(self, detections):
+        """Only the confident detections of tracked classes, e.g. before the tracker."""
+        keep = self.mask(detections)
+        return Detections(detections.xyxy[keep], detections.confidence[keep], detections.class_id[keep])
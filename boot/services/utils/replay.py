@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import time
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".ts", ".h264", ".265", ".hevc")
+
+
+def list_clips(path):
+    """A single video file, or every video in a directory in name order."""
+    if os.path.isdir(path):
+        return [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if name.lower().endswith(VIDEO_EXTENSIONS)
+        ]
+    return [path]
+
+
+class ReplayCapture:
+    """cv2.VideoCapture-compatible source that plays recorded clips back-to-back as fast as they decode.
+
+    After every successful read(), `last_timestamp` holds the frame's
+    presentation time in seconds (clip PTS plus the duration of the clips
+    before it, offset by `start_time`), so pipelines can run on the recorded
+    timeline instead of the wall clock.
+    """
+
+    def __init__(self, path, start_time=0.0):
+        self.clips = list_clips(path)
+        if not self.clips:
+            raise FileNotFoundError(f"No video clips found at {path}")
+        self.start_time = start_time
+        self.last_timestamp = start_time
+        self.frames = 0
+        self._clip_index = -1
+        self._clip_offset = 0.0
+        self._clip_end = 0.0
+        self._cap = None
+        self._next_clip()
+
+    def _next_clip(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._clip_offset = self._clip_end
+        self._clip_index += 1
+        if self._clip_index >= len(self.clips):
+            self._cap = None
+            return False
+        clip = self.clips[self._clip_index]
+        logger.info(f"Replaying {clip}")
+        self._cap = cv2.VideoCapture(clip)
+        self._frame_duration = 1.0 / (self._cap.get(cv2.CAP_PROP_FPS) or 25)
+        return True
+
+    def isOpened(self):
+        return self._cap is not None
+
+    def read(self):
+        while self._cap is not None:
+            ret, frame = self._cap.read()
+            if ret:
+                pts = self._clip_offset + self._cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                self._clip_end = pts + self._frame_duration
+                self.last_timestamp = self.start_time + pts
+                self.frames += 1
+                return True, frame
+            self._next_clip()
+        return False, None
+
+    def release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class EventWriter:
+    """Collects the messages a pipeline would publish and writes them as JSON lines."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, "w") if path != "-" else None
+
+    def write(self, topic, message):
+        line = json.dumps({"topic": topic, "message": message}, sort_keys=True)
+        if self._file is None:
+            print(line)
+        else:
+            self._file.write(line + "\n")
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplayStats:
+    """Wall-clock throughput of a replay run."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.frames = 0
+        self.inferences = 0
+
+    def summary(self, events):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            "frames": self.frames,
+            "inferences": self.inferences,
+            "events": events,
+            "seconds": round(elapsed, 2),
+            "framesPerSecond": round(self.frames / elapsed, 1),
+            "inferencesPerSecond": round(self.inferences / elapsed, 1),
+        }
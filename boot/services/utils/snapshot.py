@@ -0,0 +1,50 @@
+import base64
+import logging
+import subprocess
+import time
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_TIMEOUT = 20  # Seconds to wait for the next keyframe (cameras send one every 1-4 s)
+
+
+def grab_keyframe(url, timeout=SNAPSHOT_TIMEOUT, width=None, quality=3):
+    """Connect to `url`, decode only the next IDR keyframe and return it as JPEG bytes.
+
+    ffmpeg's decoder is told to skip every non-key frame, so nothing but the
+    keyframe is decoded, and the process exits (closing the RTSP session) as
+    soon as that one frame is written. Returns None on failure.
+    """
+    command = ["ffmpeg", "-loglevel", "error", "-nostdin"]
+    if url.startswith("rtsp://"):
+        command += ["-rtsp_transport", "tcp"]
+    command += ["-skip_frame", "nokey", "-i", url, "-an", "-frames:v", "1"]
+    if width:
+        command += ["-vf", f"scale={width}:-2"]
+    command += ["-f", "image2pipe", "-vcodec", "mjpeg", "-q:v", str(quality), "-"]
+
+    started = time.time()
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        Metrics.incr("snapshot.errors")
+        logger.error(f"Keyframe snapshot failed: {e}")
+        return None
+
+    if result.returncode != 0 or not result.stdout:
+        Metrics.incr("snapshot.errors")
+        logger.error(f"Keyframe snapshot failed: {result.stderr.decode(errors='ignore').strip()}")
+        return None
+
+    Metrics.timing("snapshot.latency", time.time() - started)
+    return result.stdout
+
+
+def grab_keyframe_blob(url, timeout=SNAPSHOT_TIMEOUT, width=None):
+    """Keyframe snapshot as a base64 JPEG string, the form the AI analysis expects."""
+    jpeg = grab_keyframe(url, timeout=timeout, width=width)
+    if jpeg is None:
+        return None
+    return base64.b64encode(jpeg).decode("utf-8")
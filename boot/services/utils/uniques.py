@@ -0,0 +1,155 @@
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_LOST_TRACK_BUFFER = 30  # supervision.ByteTrack default
+DEFAULT_BUCKET_SECONDS = 3600
+DEFAULT_MAX_BUCKETS = 24 * 7
+DEFAULT_PRECISION = 10  # 1024 registers: 1 KB per sketch, ~3% standard error
+
+
+class ExpiringIdStore:
+    """Keys seen within the last `ttl` ticks, oldest first.
+
+    A tick is whatever monotonic clock the caller uses; for tracker IDs it
+    is the number of tracker updates, which is also what ByteTrack's lost
+    track buffer counts. Once a key has not been seen for `ttl` ticks the
+    tracker has dropped it too, so it can never come back and is forgotten.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._last_seen = OrderedDict()
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def __contains__(self, key):
+        return key in self._last_seen
+
+    def touch(self, key, now):
+        """Mark `key` as seen at `now`; return True if it was not already stored."""
+        is_new = key not in self._last_seen
+        self._last_seen[key] = now
+        self._last_seen.move_to_end(key)
+        return is_new
+
+    def expire(self, now):
+        """Forget keys not seen since `now - ttl`; return how many were dropped."""
+        dropped = 0
+        while self._last_seen:
+            key, seen = next(iter(self._last_seen.items()))
+            if now - seen <= self.ttl:
+                break
+            del self._last_seen[key]
+            dropped += 1
+        return dropped
+
+
+class HyperLogLog:
+    """Fixed-size cardinality sketch: 2**precision one-byte registers whatever the number of items."""
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+    def add(self, value):
+        hashed = self.hash(value)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # Linear counting for small sets
+        return int(round(estimate))
+
+
+class UniqueObjectCounter:
+    """Replaces the ever-growing unique_objects sets with bounded memory.
+
+    New tracker IDs are detected with an ExpiringIdStore that forgets an ID
+    once the tracker's lost buffer has passed (2x margin), so callers need
+    no cleanup of their own. Every new object is also added to a HyperLogLog
+    per class and time bucket for long-horizon unique counts, which
+    closed_buckets() hands out once each bucket has ended. Only the newest
+    `max_buckets` unreported buckets are kept, so memory is bounded by the
+    number of live tracks plus classes x max_buckets sketches. With
+    bucket_seconds=None no sketches are kept at all.
+    """
+
+    def __init__(self, lost_track_buffer=DEFAULT_LOST_TRACK_BUFFER, bucket_seconds=DEFAULT_BUCKET_SECONDS,
+                 max_buckets=DEFAULT_MAX_BUCKETS, precision=DEFAULT_PRECISION):
+        self.ids = ExpiringIdStore(2 * lost_track_buffer)
+        self.bucket_seconds = bucket_seconds
+        self.max_buckets = max_buckets
+        self.precision = precision
+        self.buckets = OrderedDict()  # bucket start -> {class_name: HyperLogLog}
+        self._closed_until = None  # Buckets starting before this were already reported
+        self._tick = 0
+        # Tracker IDs restart at 1 with the process; keep sketches from counting them twice
+        self._session = f"{time.time():.6f}"
+
+    def update(self, class_names, track_ids, now=None):
+        """Record one tracker update; return {class_name: number of new objects}."""
+        now = time.time() if now is None else now
+        self._tick += 1
+        new_count = {}
+        sketches = None
+        for class_name, track_id in zip(class_names, track_ids):
+            if not self.ids.touch((class_name, int(track_id)), self._tick):
+                continue
+            new_count[class_name] = new_count.get(class_name, 0) + 1
+            if self.bucket_seconds is None:
+                continue
+            if sketches is None:
+                sketches = self._bucket(now)
+                if sketches is None:
+                    continue  # Late frame for a bucket that was already reported
+            if class_name not in sketches:
+                sketches[class_name] = HyperLogLog(self.precision)
+            sketches[class_name].add(f"{self._session}:{class_name}:{track_id}")
+        self.ids.expire(self._tick)
+        return new_count
+
+    def _bucket(self, now):
+        start = int(now // self.bucket_seconds * self.bucket_seconds)
+        if self._closed_until is not None and start < self._closed_until:
+            return None
+        if start not in self.buckets:
+            self.buckets[start] = {}
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return self.buckets[start]
+
+    def closed_buckets(self, now=None):
+        """Estimated distinct objects per class in each bucket that has ended since the last call.
+
+        Returned as {bucket start in ms, as a string: {class_name: count}}, the
+        "uniqueCount" message field; each bucket is reported once and dropped.
+        """
+        if self.bucket_seconds is None:
+            return {}
+        now = time.time() if now is None else now
+        closed = [start for start in self.buckets if start + self.bucket_seconds <= now]
+        if not closed:
+            return {}
+        self._closed_until = max(closed) + self.bucket_seconds
+        return {
+            str(start * 1000): {class_name: sketch.count() for class_name, sketch in self.buckets.pop(start).items()}
+            for start in closed
+        }
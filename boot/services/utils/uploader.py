@@ -0,0 +1,170 @@
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+
+import httpclient
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 300
+DEFAULT_MAX_BYTES = 256 * 1024  # JSON of the records merged into one request
+DEFAULT_MAX_RECORDS = 5000
+DEFAULT_BACKOFF = 5
+DEFAULT_MAX_BACKOFF = 600
+
+
+class Uploader:
+    """Uploads a DetectionJournal's pending records to the traffic endpoint from its own thread.
+
+    Every `interval` seconds (or on trigger()) the pending records are sent
+    as {"data": [...]} requests of at most `max_bytes` of JSON each, so a
+    backlog from an outage goes out in a few large requests instead of one
+    per API call. With `compress` (opt-in per device, as not every endpoint
+    accepts Content-Encoding: gzip) bodies are gzip-compressed until the
+    server answers 415; either way they go through the shared keep-alive
+    client (httpclient).
+    The journal cursor is only committed after a 200.
+
+    After a failure the next attempt waits an exponential backoff from
+    `backoff` to `max_backoff` seconds with jitter, so a device fleet does
+    not retry in lockstep. Counting threads only append to the journal and
+    never wait for an upload.
+
+    `on_error(message, extra)` is called for every failed request, e.g. to
+    publish it over MQTT.
+    """
+
+    def __init__(self, journal, endpoint, interval=DEFAULT_INTERVAL, max_bytes=DEFAULT_MAX_BYTES,
+                 max_records=DEFAULT_MAX_RECORDS, compress=False, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, timeout="upload", client=None, on_error=None,
+                 name="upload"):
+        self.journal = journal
+        self.endpoint = endpoint
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.compress = compress
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.client = client or httpclient.client()
+        self.on_error = on_error
+        self.name = name
+        self.failures = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _post(self, batch):
+        """Send one request; True once the server has accepted it."""
+        body = json.dumps({"data": batch}, separators=(",", ":")).encode()
+        headers = {"Content-Type": "application/json"}
+        size = len(body)
+        if self.compress:
+            body = gzip.compress(body, 6)
+            headers["Content-Encoding"] = "gzip"
+
+        started = time.perf_counter()
+        try:
+            response = self.client.post(self.endpoint, data=body, headers=headers, timeout=self.timeout)
+        except httpclient.HttpError as e:
+            self._failed(f"API request error: {e}", batch)
+            return False
+        Metrics.timing(f"{self.name}.latency", time.perf_counter() - started)
+
+        if response.status_code == 415 and self.compress:
+            logger.warning("Upload endpoint does not accept gzip bodies, sending plain JSON")
+            self.compress = False
+            return self._post(batch)
+        if response.status_code != 200:
+            self._failed(f"API returned: {response.status_code}, {response.text}", batch)
+            return False
+
+        logger.info(f"Batch sent successfully: {len(batch)}")
+        Metrics.incr(f"{self.name}.requests")
+        Metrics.incr(f"{self.name}.records", len(batch))
+        Metrics.incr(f"{self.name}.bytes", len(body))
+        Metrics.incr(f"{self.name}.jsonBytes", size)
+        return True
+
+    def _failed(self, message, batch):
+        Metrics.incr(f"{self.name}.errors")
+        logger.error(f"Upload of {len(batch)} records failed: {message}")
+        if self.on_error:
+            try:
+                self.on_error(message, {"records": len(batch), "failures": self.failures + 1})
+            except Exception as e:
+                logger.error(f"Could not report upload error: {e}")
+
+    def drain(self):
+        """Upload until the journal has nothing pending; False if a request failed."""
+        while not self._stop.is_set():
+            batch, cursor = self.journal.read(self.max_records, self.max_bytes)
+            if not batch:
+                return True
+            if not self._post(batch):
+                return False
+            self.journal.commit(cursor)
+        return True
+
+    def _backoff_delay(self):
+        """Exponential backoff with equal jitter: between half and all of backoff * 2^(failures - 1)."""
+        delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def run(self):
+        next_attempt = time.monotonic() + self.interval
+        while not self._stop.is_set():
+            self._wake.wait(max(0.0, next_attempt - time.monotonic()))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if self.failures and time.monotonic() < next_attempt:
+                continue  # Backing off: trigger() does not cut the wait short
+            if self.drain():
+                self.failures = 0
+                next_attempt = time.monotonic() + self.interval
+            else:
+                self.failures += 1
+                Metrics.incr(f"{self.name}.retries")
+                delay = self._backoff_delay()
+                Metrics.gauge(f"{self.name}.backoffSeconds", round(delay, 1))
+                next_attempt = time.monotonic() + delay
+
+    def trigger(self):
+        """Upload now instead of at the end of the interval (unless backing off)."""
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True, name=self.name)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        """Stop the thread; records not uploaded yet stay in the journal for the next run."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def make_uploader(config, journal, endpoint, interval=DEFAULT_INTERVAL, on_error=None, name="upload"):
+    """Uploader tuned by the optional `upload` config section ({"maxBytes": ..., "gzip": true, ...})."""
+    upload_config = (config or {}).get("upload", {})
+    return Uploader(
+        journal,
+        endpoint,
+        interval=interval,
+        max_bytes=upload_config.get("maxBytes", DEFAULT_MAX_BYTES),
+        max_records=upload_config.get("maxRecords", DEFAULT_MAX_RECORDS),
+        compress=upload_config.get("gzip", False),
+        backoff=upload_config.get("backoffSeconds", DEFAULT_BACKOFF),
+        max_backoff=upload_config.get("maxBackoffSeconds", DEFAULT_MAX_BACKOFF),
+        timeout=upload_config.get("timeout", "upload"),
+        on_error=on_error,
+        name=name,
+    )
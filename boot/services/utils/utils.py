@@ -1,7 +1,8 @@
-import requests
 import logging
 import sys
 
+import httpclient
+
 DEBUG = False
 logger = logging.getLogger(__name__)
 if DEBUG:
@@ -33,10 +34,9 @@ def load_config(device_id):
     # config_url = f"http://localhost:3000/api/camera/v1/config/{device_id}"
     config_url = f"https://railway.adboardbooking.com/api/camera/v1/config/{device_id}"
     try:
-        response = requests.get(config_url, timeout=5)
-        response.raise_for_status()
+        response = httpclient.get(config_url, timeout="config", raise_for_status=True)
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except httpclient.HttpError as e:
         print(f"[ERROR] Unable to load config: {e}")
         return None
     
@@ -0,0 +1,209 @@
+import logging
+
+import numpy as np
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOST_TRACK_BUFFER = 30  # supervision.ByteTrack default
+
+
+def _cross(u, v):
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def points_in_polygon(points, polygon):
+    """Boolean mask of `points` (N x 2) inside `polygon` (E x 2), by ray casting over all edges at once."""
+    start, end = polygon, np.roll(polygon, -1, axis=0)
+    px, py = points[:, None, 0], points[:, None, 1]
+    straddles = (start[None, :, 1] > py) != (end[None, :, 1] > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_at_y = start[None, :, 0] + (py - start[None, :, 1]) * (end[None, :, 0] - start[None, :, 0]) / (
+            end[None, :, 1] - start[None, :, 1])
+    return np.logical_xor.reduce(straddles & (px < x_at_y), axis=1)
+
+
+def _tally(class_names, mask):
+    """{class_name: count} over the rows where `mask` is set."""
+    tally = {}
+    for class_name in class_names[mask].tolist():
+        tally[class_name] = tally.get(class_name, 0) + 1
+    return tally
+
+
+class TrajectoryCounter:
+    """Counts line crossings and zone visits from tracker trajectories.
+
+    Each tracked object is reduced to one anchor point (the bottom centre of
+    its box by default, where it touches the ground) and its previous anchor
+    is kept per tracker ID. A crossing is counted when the segment between
+    the two anchors intersects a counting line, so an object is counted once
+    however few frames it is seen in; this is what makes 1-2 fps inference
+    enough. "in" means crossing to the right-hand side of the line walking
+    from its first point to its second (in image coordinates, a line drawn
+    left to right counts objects moving down the frame as "in").
+
+    Zones are polygons; entering and leaving are counted per class and the
+    time between the two is reported as dwell time. All lines and zones are
+    evaluated for all tracks at once with numpy. A track not seen for
+    `lost_track_buffer` updates is dropped, leaving any zone it was in.
+    """
+
+    def __init__(self, lines=None, zones=None, anchor="bottom", lost_track_buffer=DEFAULT_LOST_TRACK_BUFFER,
+                 name="counting"):
+        if anchor not in ("bottom", "center"):
+            raise ValueError(f"Unknown counting anchor: {anchor}")
+        lines, zones = lines or [], zones or []
+        self.line_names = [line.get("name", f"line{index}") for index, line in enumerate(lines)]
+        self.line_classes = [set(line["classes"]) if line.get("classes") else None for line in lines]
+        endpoints = np.array([line["points"] for line in lines], dtype=np.float64).reshape(-1, 2, 2)
+        self._line_start, self._line_end = endpoints[:, 0], endpoints[:, 1]
+
+        self.zone_names = [zone.get("name", f"zone{index}") for index, zone in enumerate(zones)]
+        self.zone_classes = [set(zone["classes"]) if zone.get("classes") else None for zone in zones]
+        self._polygons = [np.array(zone["points"], dtype=np.float64).reshape(-1, 2) for zone in zones]
+
+        self.anchor = anchor
+        self.lost_track_buffer = lost_track_buffer
+        self.name = name
+        self._tick = 0
+        # Per-track state, one row per tracker ID (struct of arrays)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._points = np.empty((0, 2), dtype=np.float64)
+        self._classes = np.empty(0, dtype=object)
+        self._seen_tick = np.empty(0, dtype=np.int64)
+        self._seen_time = np.empty(0, dtype=np.float64)
+        self._inside = np.zeros((0, len(zones)), dtype=bool)
+        self._entered_at = np.zeros((0, len(zones)), dtype=np.float64)
+
+    def anchors(self, xyxy):
+        xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+        x = (xyxy[:, 0] + xyxy[:, 2]) / 2
+        y = xyxy[:, 3] if self.anchor == "bottom" else (xyxy[:, 1] + xyxy[:, 3]) / 2
+        return np.column_stack((x, y))
+
+    def _class_mask(self, class_names, allowed):
+        if allowed is None:
+            return np.ones(len(class_names), dtype=bool)
+        return np.fromiter((class_name in allowed for class_name in class_names), dtype=bool, count=len(class_names))
+
+    def _crossings(self, previous, current, class_names):
+        """{line: {"in": {...}, "out": {...}}} for the moves previous -> current (K x 2 each)."""
+        events = {}
+        if not len(previous) or not len(self.line_names):
+            return events
+        direction = self._line_end - self._line_start  # L x 2
+        side_before = _cross(direction[None], previous[:, None] - self._line_start[None])  # K x L
+        side_after = _cross(direction[None], current[:, None] - self._line_start[None])
+        # The move has to pass between the line's endpoints, not just cross its extension
+        move = (current - previous)[:, None]
+        at_start = _cross(move, self._line_start[None] - previous[:, None])
+        at_end = _cross(move, self._line_end[None] - previous[:, None])
+        within = at_start * at_end <= 0
+        moved_in = within & (side_before < 0) & (side_after >= 0)
+        moved_out = within & (side_before >= 0) & (side_after < 0)
+
+        for index in np.flatnonzero(moved_in.any(axis=0) | moved_out.any(axis=0)).tolist():
+            allowed = self._class_mask(class_names, self.line_classes[index])
+            counts = {
+                "in": _tally(class_names, moved_in[:, index] & allowed),
+                "out": _tally(class_names, moved_out[:, index] & allowed),
+            }
+            if counts["in"] or counts["out"]:
+                events[self.line_names[index]] = counts
+        return events
+
+    def _zone_event(self, events, index, key, class_names, mask, dwell=None):
+        mask = mask & self._class_mask(class_names, self.zone_classes[index])
+        if not mask.any():
+            return
+        zone = events.setdefault(self.zone_names[index], {})
+        counts = zone.setdefault(key, {})
+        for class_name, count in _tally(class_names, mask).items():
+            counts[class_name] = counts.get(class_name, 0) + count
+        if dwell is not None:
+            dwell_seconds = zone.setdefault("dwellSeconds", {})
+            for class_name, seconds in zip(class_names[mask].tolist(), dwell[mask].tolist()):
+                dwell_seconds.setdefault(class_name, []).append(round(seconds, 1))
+
+    def update(self, xyxy, tracker_ids, class_names, now):
+        """Add one tracker update; return {"lines": {...}, "zones": {...}} with the events it caused (or {})."""
+        self._tick += 1
+        current = self.anchors(xyxy)
+        ids = np.asarray(tracker_ids, dtype=np.int64).reshape(-1)
+        class_names = np.asarray(class_names, dtype=object).reshape(-1)
+
+        # Rows of the tracks already known (vectorized lookup by ID)
+        rows = np.full(len(ids), -1, dtype=np.intp)
+        if len(self._ids) and len(ids):
+            order = np.argsort(self._ids)
+            positions = np.clip(np.searchsorted(self._ids, ids, sorter=order), 0, len(order) - 1)
+            found = self._ids[order[positions]] == ids
+            rows[found] = order[positions[found]]
+        known = rows >= 0
+
+        line_events = self._crossings(self._points[rows[known]], current[known], class_names[known])
+
+        zone_events = {}
+        inside = np.zeros((len(ids), len(self._polygons)), dtype=bool)
+        entered_at = np.zeros_like(inside, dtype=np.float64)
+        for index, polygon in enumerate(self._polygons):
+            inside[:, index] = points_in_polygon(current, polygon)
+            was_inside = np.zeros(len(ids), dtype=bool)
+            was_inside[known] = self._inside[rows[known], index]
+            entered_at[known, index] = self._entered_at[rows[known], index]
+            entered = inside[:, index] & ~was_inside
+            entered_at[entered, index] = now
+            self._zone_event(zone_events, index, "entered", class_names, entered)
+            self._zone_event(zone_events, index, "exited", class_names, was_inside & ~inside[:, index],
+                             now - entered_at[:, index])
+
+        # Tracks the tracker has given up on leave their zones at their last sighting
+        seen = np.zeros(len(self._ids), dtype=bool)
+        seen[rows[known]] = True
+        expired = ~seen & (self._tick - self._seen_tick > self.lost_track_buffer)
+        if expired.any():
+            for index in range(len(self._polygons)):
+                self._zone_event(zone_events, index, "exited", self._classes[expired], self._inside[expired, index],
+                                 self._seen_time[expired] - self._entered_at[expired, index])
+
+        keep = ~seen & ~expired
+        self._ids = np.concatenate([self._ids[keep], ids])
+        self._points = np.concatenate([self._points[keep], current])
+        self._classes = np.concatenate([self._classes[keep], class_names])
+        self._seen_tick = np.concatenate([self._seen_tick[keep], np.full(len(ids), self._tick)])
+        self._seen_time = np.concatenate([self._seen_time[keep], np.full(len(ids), float(now))])
+        self._inside = np.concatenate([self._inside[keep], inside])
+        self._entered_at = np.concatenate([self._entered_at[keep], entered_at])
+        Metrics.gauge(f"{self.name}.tracks", len(self._ids))
+
+        events = {}
+        if line_events:
+            events["lines"] = line_events
+        if zone_events:
+            events["zones"] = zone_events
+        return events
+
+    def occupancy(self):
+        """{zone: {class_name: objects inside now}} for the zones that are not empty."""
+        occupancy = {}
+        for index, name in enumerate(self.zone_names):
+            mask = self._inside[:, index] & self._class_mask(self._classes, self.zone_classes[index])
+            if mask.any():
+                occupancy[name] = _tally(self._classes, mask)
+        return occupancy
+
+
+def make_trajectory_counter(counting_config, name="counting"):
+    """TrajectoryCounter from a `counting` config section ({"lines": [...], "zones": [...]}), or None."""
+    counting_config = counting_config or {}
+    if not counting_config.get("lines") and not counting_config.get("zones"):
+        return None
+    return TrajectoryCounter(
+        lines=counting_config.get("lines"),
+        zones=counting_config.get("zones"),
+        anchor=counting_config.get("anchor", "bottom"),
+        lost_track_buffer=counting_config.get("lostTrackBuffer", DEFAULT_LOST_TRACK_BUFFER),
+        name=name,
+    )
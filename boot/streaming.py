@@ -1,11 +1,17 @@
 import time
-import statistics
 import cv2
 import numpy as np
-import requests
 import threading
-import queue
 import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services', 'utils'))
+from counting import StableCounter
+import httpclient
+from codec import strip_credentials
+from journal import make_journal, import_batch_file
+from uploader import make_uploader
 
 ENABLE_IMG_SHOW = False
 ENABLE_API_CALL = True
@@ -27,58 +33,17 @@ def get_cpu_serial():
         print(f"[ERROR] Unable to read CPU serial: {e}")
     return "UNKNOWN"
 
-def load_detection_batch(filename):
-    """Load detection batch from a file."""
-    try:
-        with open(filename, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
-
-def save_detection_batch(filename, detection_batch):
-    """Save detection batch to a file."""
-    try:
-        with open(filename, "w") as f:
-            json.dump(detection_batch, f)
-    except Exception as e:
-        print(f"[ERROR] Unable to save detection batch: {e}")
-
 def load_config(device_id):
     """Load configuration from the API."""
     # config_url = f"http://localhost:3000/api/camera/v1/config/{device_id}"
     config_url = f"https://railway.adboardbooking.com/api/camera/v1/config/{device_id}"
     try:
-        response = requests.get(config_url, timeout=5)
-        response.raise_for_status()
+        response = httpclient.get(config_url, timeout="config", raise_for_status=True)
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except httpclient.HttpError as e:
         print(f"[ERROR] Unable to load config: {e}")
         return None
 
-def api_worker(queue, endpoint, detection_batch_file):
-    """Worker thread to send API requests."""
-    while True:
-        batch = queue.get()  # Get a batch from the queue
-        if batch is None:
-            break  # Stop the thread if None is received
-
-        try:
-            print(f"[DEBUG] Sending batch: {len(batch)}")
-            response = requests.post(endpoint, json={"data": batch}, timeout=5)
-            if response.status_code == 200:
-                print(f"[INFO] Batch sent successfully: {len(batch)}")
-                save_detection_batch(detection_batch_file, [])  # Clear the file after successful API call
-            else:
-                print(f"[WARN] API returned: {response.status_code}, {response.text}")
-                # Re-add batch to the queue for retry
-                queue.put(batch)
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] API request error: {e}")
-            # Re-add batch to the queue for retry
-            queue.put(batch)
-
-        queue.task_done()
-
 def main():
     ##########################
     # Configuration
@@ -95,10 +60,11 @@ def main():
     INFERENCE_INTERVAL = config.get("inferenceInterval", 1.0)
     LONG_STAY_THRESHOLD = config.get("longStayThreshold", 20)
     API_ENDPOINT = config.get("apiEndpoint", "https://railway.adboardbooking.com/api/camera/v1/traffic")
-    SAVE_INTERVAL = config.get("saveInterval", 60)  # Save to file every 10 minutes (600 seconds)
+    SAVE_INTERVAL = config.get("saveInterval", 60)  # fsync the journal at most every minute
     API_CALL_INTERVAL = config.get("apiCallInterval", 300)
     count_window_size = config.get("countWindowSize", 5)
-    DETECTION_BATCH_FILE = "detection_batch.json"
+    DETECTION_BATCH_FILE = "detection_batch.json"  # Pre-journal batch file, imported once
+    DETECTION_JOURNAL_DIR = "detection_journal"
 
     print(f"[INFO] Loaded configuration: {config}")
 
@@ -110,28 +76,27 @@ def main():
         return
 
     last_inference_time = 0
-    last_save_time = time.time()
-    last_api_call_time = time.time()
+
+    # Records are appended to an on-disk journal and uploaded from there
+    journal = make_journal(config, DETECTION_JOURNAL_DIR, fsync_interval=SAVE_INTERVAL)
+    import_batch_file(journal, DETECTION_BATCH_FILE)
 
     # Variables for our naive logic
-    detection_batch = load_detection_batch(DETECTION_BATCH_FILE)
-    if detection_batch:
-        passed_count = detection_batch[-1]["passedCount"]
+    last_record = journal.last()
+    if last_record:
+        passed_count = last_record["passedCount"]
     else:
         passed_count = {"car": 0, "person": 0}
     print(f"[INFO] Loaded passed count: {passed_count}")
     last_increase_time = time.time()
 
-    # We'll keep a short history (window) of detection counts to smooth out flickers
-    count_window = {"car": [], "person": []}
+    # Median of a short window of detection counts, to smooth out flickers
+    counter = StableCounter(["car", "person"], count_window_size)
 
-    # We also store a "stable_count" from the previous loop to compare changes
-    prev_stable_count = {"car": 0, "person": 0}
-
-    # Queue for API requests
-    api_queue = queue.Queue()
-    api_thread = threading.Thread(target=api_worker, args=(api_queue, API_ENDPOINT, DETECTION_BATCH_FILE), daemon=True)
-    api_thread.start()
+    # Uploads the journal every API_CALL_INTERVAL, backing off while the API is down
+    uploader = make_uploader(config, journal, API_ENDPOINT, interval=API_CALL_INTERVAL) if ENABLE_API_CALL else None
+    if uploader:
+        uploader.start()
 
     while True:
         ret, frame = cap.read()
@@ -162,27 +127,17 @@ def main():
                     if class_name in raw_count:
                         raw_count[class_name] += 1
 
-            # Add this raw count to our rolling window
-            for obj in raw_count:
-                count_window[obj].append(raw_count[obj])
-                if len(count_window[obj]) > count_window_size:
-                    count_window[obj].pop(0)
-
             ################################
-            # 2) Compute stable_count
+            # 2) Add this raw count to the rolling window and compute stable_count
             ################################
-            stable_count = {
-                obj: int(round(statistics.median(count_window[obj]))) if count_window[obj] else 0
-                for obj in raw_count
-            }
+            increases = counter.update(raw_count)
+            stable_count = counter.stable_count
 
             # 3) Naive Heuristics
-            for obj in raw_count:
-                if stable_count[obj] > prev_stable_count[obj]:
-                    diff = stable_count[obj] - prev_stable_count[obj]
-                    passed_count[obj] += diff
-                    last_increase_time = current_time
-                    print(f"[INFO] Detected an increase of {diff} {obj}s. Passed count: {passed_count[obj]}")
+            for obj, diff in increases.items():
+                passed_count[obj] += diff
+                last_increase_time = current_time
+                print(f"[INFO] Detected an increase of {diff} {obj}s. Passed count: {passed_count[obj]}")
 
             time_since_increase = current_time - last_increase_time
             for obj in raw_count:
@@ -191,14 +146,12 @@ def main():
                     print(f"[INFO] Long stay triggered, added {stable_count[obj]} {obj}s, total: {passed_count[obj]}")
                     last_increase_time = current_time
 
-            prev_stable_count = stable_count
-
             ################################
             # Add to batch only if stableCount > 0
             ################################
             if any(stable_count[obj] > 0 for obj in stable_count):
-                detection_batch.append({
-                    "cameraUrl": RTSP_STREAM_URL,
+                journal.append({
+                    "cameraUrl": strip_credentials(RTSP_STREAM_URL),
                     "deviceId": DEVICE_ID,
                     "timestamp": int(current_time)*1000,
                     "rawCount": raw_count,
@@ -206,22 +159,7 @@ def main():
                     "passedCount": passed_count
                 })
 
-            ################################
-            # Save detection batch every SAVE_INTERVAL
-            ################################
-            if (current_time - last_save_time) >= SAVE_INTERVAL:
-                save_detection_batch(DETECTION_BATCH_FILE, detection_batch)
-                last_save_time = current_time
-
-            ################################
-            # Make API call every API_CALL_INTERVAL
-            ################################
-            if ENABLE_API_CALL and (current_time - last_api_call_time) >= API_CALL_INTERVAL:
-                api_queue.put(detection_batch.copy())
-                detection_batch.clear()
-                last_api_call_time = current_time
-
-            print(f"[{int(current_time)*1000}] raw_count={raw_count}, stable_count={stable_count}, passed={passed_count}, detection_batch={len(detection_batch)}")
+            print(f"[{int(current_time)*1000}] raw_count={raw_count}, stable_count={stable_count}, passed={passed_count}, pending={journal.pending()}")
 
         if detections is not None and ENABLE_BOUNDING_BOX and ENABLE_IMG_SHOW:
             for box in detections:
@@ -263,8 +201,9 @@ def main():
 
     cap.release()
     cv2.destroyAllWindows()
-    api_queue.put(None)  # Signal the API thread to exit
-    api_thread.join()
+    if uploader:
+        uploader.stop()
+    journal.close()
 
 if __name__ == "__main__":
     main()
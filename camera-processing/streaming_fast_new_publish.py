@@ -1,18 +1,13 @@
 import cv2
-import torch
 import threading
-import supervision as sv
-from collections import defaultdict
-from ultralytics import YOLO
 import os
 import re
 import base64
 import sys
 import time
-import statistics
 import datetime
+import argparse
 import json
-import requests
 import pytz
 import logging
 
@@ -22,13 +17,49 @@ utils_folder = os.path.join(current_dir, '..','boot','services','utils')
 sys.path.append(utils_folder)
 
 from utils import load_config_for_device
-from mqtt import publish_log, subscribe_to_topic
+import httpclient
+from mqtt import publish_log, subscribe_to_topic, configure_outbox
+from pipeline import LatestFrame, make_queue, start_stage, wait_until
+from metrics import Metrics
+from capture import open_capture
+from snapshot import grab_keyframe_blob
+from counting import StableCounter
+from motion import make_motion_gate
+from detector import create_detector, to_supervision
+from postprocess import ClassCounter
+from uniques import UniqueObjectCounter
+from zones import make_trajectory_counter
+from aggregate import make_aggregator
+from codec import strip_credentials
+from replay import ReplayCapture, EventWriter, ReplayStats
 
 
 ist_tz = pytz.timezone('Asia/Kolkata')
 logging.Formatter.converter = lambda *args: datetime.datetime.now(ist_tz).timetuple()
 
 CONFIG_REFRESH_INTERVAL = 300
+FRAME_MAX_AGE = 5  # Seconds a captured frame stays fresh enough for billboard analysis
+TRAFFIC_CLASSES = ['person', 'car','bicycle','motorcycle','bus','train']
+
+# Argument parser for command-line parameters
+parser = argparse.ArgumentParser(description="Camera processing: traffic counting and billboard monitoring")
+parser.add_argument("--replay", default=None,
+                    help="Replay a video file or directory of clips through the counting pipeline instead of the live stream")
+parser.add_argument("--replay-out", default="replay_events.jsonl",
+                    help="Where to write the count events produced by --replay ('-' for stdout)")
+parser.add_argument("--replay-config", default=None,
+                    help="Device config JSON whose counting, aggregation and motionGate sections --replay uses")
+parser.add_argument("--replay-interval", type=float, default=None,
+                    help="Seconds of recorded video between inferences during --replay (0 = every frame, default inferenceInterval or 1)")
+parser.add_argument("--count-window", type=int, default=None,
+                    help="Count window size used during --replay (default countWindowSize or 5)")
+parser.add_argument("--backend", choices=["torch", "onnx", "openvino"], default="torch",
+                    help="Detector backend used during --replay")
+parser.add_argument("--model", default="yolov8n.pt",
+                    help="Model weights / export used during --replay")
+parser.add_argument("--no-motion-gate", action="store_true",
+                    help="Run YOLO on every replayed inference tick, even on static scenes")
+args = parser.parse_args()
 
 # Configure logging to write to stdout
 logging.basicConfig(
@@ -66,19 +97,29 @@ def message_handler(client, userdata, message):
     except Exception as e:
         logger.error(f"Error handling message: {str(e)}")
 
-# Subscribe to topic with message handler after logger is initialized
-subscribe_to_topic(test_topic, message_handler)
 
+# Detector backend and its TRAFFIC_CLASSES counter, created in main() by load_detector()
+detector = None
+traffic_counter = None
 
-# Load YOLO model
-model = YOLO("yolov8n.pt")
 
-# Initialize Supervision tracker (ByteTrack)
-tracker = sv.ByteTrack()
+def traffic_enabled(config):
+    """Traffic counting, and so the detector and its heavy imports, only runs when configured."""
+    return "trafficMonitoring" in config or "trafficMonitoring" in config.get("services", {})
+
+
+def load_detector(detector_config):
+    global detector, traffic_counter
+    detector = create_detector(detector_config)
+    traffic_counter = ClassCounter(detector.names, TRAFFIC_CLASSES, min_confidence=0.3)
+
+# Supervision tracker (ByteTrack), created by process_frames() on first use
+tracker = None
 
 # Update global variables
 config_lock = threading.Lock()
 global_config = None
+config_ready = threading.Event()
 
 def update_config():
     """Continuously update config in background"""
@@ -89,6 +130,7 @@ def update_config():
             if new_config:  # Only update if we got a valid config
                 with config_lock:
                     global_config = new_config
+                config_ready.set()
                 logger.info(f"Configuration refreshed successfully: \n{json.dumps(new_config, indent=2)}")
         except Exception as e:
             logger.error(f"Error refreshing config: {str(e)}")
@@ -100,16 +142,19 @@ def get_current_config():
     with config_lock:
         return global_config
 
-# Latest frame storage with thread lock
-latest_frame = None
-frame_lock = threading.Lock()
+# Latest decoded frame, handed from the capture thread to the consumers
+frame_slot = LatestFrame("capture")
+
+# Stage queues (capture -> inference -> counting -> publish), built in main() from config
+counting_queue = make_queue("counting")
+publish_queue = make_queue("publish", default_size=100, per_frame=False)
 
 # Dictionary to track unique objects per class
-unique_objects = defaultdict(set)  # To count unique objects over time
+unique_objects = UniqueObjectCounter(bucket_seconds=None)
 
 def capture_frames():
     """ Continuously capture frames and update the latest frame """
-    global latest_frame, cap
+    global cap
     connection_attempts = 0
     max_attempts = 3
     retry_delay = 10
@@ -128,7 +173,7 @@ def capture_frames():
             continue
         
         try:
-            cap = cv2.VideoCapture(current_url)
+            cap = open_capture(current_url, current_config.get('capture'))
             if not cap.isOpened():
                 connection_attempts += 1
                 logger.warning(f"Failed to open video stream (attempt {connection_attempts}/{max_attempts})")
@@ -150,8 +195,7 @@ def capture_frames():
                 if not ret:
                     break
 
-                with frame_lock:
-                    latest_frame = frame
+                frame_slot.put(frame)
 
             # If we exit the while loop, the connection was lost
             logger.warning("Lost connection to video stream")
@@ -203,7 +247,7 @@ def analyze_image(image_blob):
             "Content-Type": "application/json"
         }
 
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
+        response = httpclient.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload, timeout="ai")
         
         if response.status_code == 200:
             response = response.json()
@@ -224,7 +268,6 @@ def analyze_image(image_blob):
         return None
 
 def monitor_billboard():
-    global latest_frame
     while True:
         try:
             config = get_current_config()  # Use get_current_config instead of direct load
@@ -234,22 +277,28 @@ def monitor_billboard():
                 time.sleep(60)
                 continue
 
-            with frame_lock:
-                if latest_frame is None:
-                    time.sleep(10)
-                    continue
-                frame = latest_frame.copy()
-            
-            _, buffer = cv2.imencode(".jpg", frame)
-            image_blob = base64.b64encode(buffer).decode("utf-8")
-            analysis_result = analyze_image(image_blob)
-            analysis_result['config'] = config
+            _, frame_time, frame = frame_slot.peek()
+            if frame is not None and time.time() - frame_time < FRAME_MAX_AGE:
+                # The traffic pipeline is decoding anyway, reuse its latest frame
+                _, buffer = cv2.imencode(".jpg", frame)
+                image_blob = base64.b64encode(buffer).decode("utf-8")
+            else:
+                # Otherwise connect just long enough to decode the next keyframe
+                image_blob = grab_keyframe_blob(config['rtspStreamUrl'])
+
+            analysis_result = analyze_image(image_blob) if image_blob else None
 
             if not analysis_result:
                 time.sleep(60)
                 continue
 
-            publish_log(analysis_result, "billboardMonitoring")
+            # The config holds the AI API key and the camera password; publish it without them
+            analysis_result['config'] = {
+                **{key: value for key, value in config.items() if key != 'aiApiKey'},
+                'rtspStreamUrl': strip_credentials(config.get('rtspStreamUrl')),
+            }
+
+            publish_log(analysis_result, "billboardMonitoring", merge_key="billboard")
             
             monitoring_interval = config['billboardMonitoring'].get('monitoringInterval', 30)
             time.sleep(monitoring_interval * 60)
@@ -257,170 +306,257 @@ def monitor_billboard():
         except Exception as e:
             time.sleep(60)
 
+def count_objects(frame):
+    """Run YOLO on a frame and return confident detection counts aligned with TRAFFIC_CLASSES."""
+    return traffic_counter.counts(detector.detect(frame))
+
+def track_objects(detections, frame_time, trajectory_tracker, trajectories):
+    """Line crossings and zone visits of the tracked confident `detections`."""
+    tracked = trajectory_tracker.update_with_detections(to_supervision(traffic_counter.filter(detections)))
+    events = {}
+    if tracked.tracker_id is not None and len(tracked):
+        class_names = [detector.names[class_id] for class_id in tracked.class_id]
+        events = trajectories.update(tracked.xyxy, tracked.tracker_id, class_names, frame_time)
+    return events
+
+def traffic_message(frame_time, new_count, events=None):
+    """Build the "traffic" topic message for newly counted objects and line/zone events."""
+    message = {
+        "timestamp": int(frame_time)*1000,
+        "count": new_count
+    }
+    if events and "lines" in events:
+        message["lineCounts"] = events["lines"]
+    if events and "zones" in events:
+        message["zoneCounts"] = events["zones"]
+    return message
+
+def make_inference_step(config):
+    """infer(frame, frame_time) -> (raw_count, events) for one inference tick, or None when skipped.
+
+    Shared by the live inference stage and --replay, which only differ in
+    where frames and their timestamps come from.
+    """
+    motion_gate = make_motion_gate(config)
+
+    # With counting lines or zones configured, counts also come from tracked trajectories
+    trajectories = make_trajectory_counter(config.get("counting"))
+    trajectory_tracker = None
+    if trajectories is not None:
+        import supervision as sv
+
+        trajectory_tracker = sv.ByteTrack()
+    held = None  # Detections of the last inference, while the motion gate may skip frames
+
+    def infer(frame, frame_time):
+        nonlocal held
+        # Skip YOLO while the scene is static
+        if motion_gate and not motion_gate.should_infer(frame, frame_time):
+            if held is None:
+                return None
+            # Nothing moved, so the objects are where YOLO last saw them: tick ByteTrack and
+            # the trajectory counter with those boxes so tracks age frame by frame as usual
+            events = track_objects(held, frame_time, trajectory_tracker, trajectories)
+            return (traffic_counter.counts(held), events) if events else None
+        if trajectories is None:
+            return count_objects(frame), {}
+        detections = detector.detect(frame)
+        if motion_gate:
+            held = detections
+        return traffic_counter.counts(detections), track_objects(detections, frame_time, trajectory_tracker, trajectories)
+
+    return infer
+
+def make_count_step(config, sink):
+    """count(frame_time, raw_count, events) for the counting stage, and its aggregator (None when real-time).
+
+    Raw counts are smoothed; whenever a class count rises or a line/zone
+    event happens a message goes to `sink`, or into the aggregator's bucket
+    whose flushes the caller drives. Shared by the live counting stage and --replay.
+    """
+    counter = StableCounter(TRAFFIC_CLASSES, config.get("countWindowSize", 5))
+    # One message per time bucket unless "aggregation": {"realtime": true}
+    aggregator = make_aggregator(config, sink=sink)
+
+    def count(frame_time, raw_count, events):
+        new_count = counter.update(raw_count)
+        if not new_count and not events:
+            return
+        message = traffic_message(frame_time, new_count, events)
+        if aggregator is None:
+            sink(message)
+        else:
+            aggregator.add(frame_time, {key: value for key, value in message.items() if key != "timestamp"})
+
+    return count, aggregator
+
 def process_frames2():
-    
-    count_window_size = 5
-    LONG_STAY_THRESHOLD = 20
-    count_window = defaultdict(list)
-    prev_stable_count = defaultdict(int)
-    global latest_frame
-    last_increase_time = time.time()
-    all_classes = ['person', 'car','bicycle','motorcycle','bus','train']
-    
-    last_process_time = time.time()
+    """Inference stage: run YOLO on the newest frame once per inference interval."""
+    last_seq = 0
+    next_due = time.time()
+    infer = make_inference_step(get_current_config() or {})
+
     while True:
-        try:  # Add try-except block for better error visibility
-            current_time = time.time()
-            if current_time - last_process_time < 1.0:
+        try:
+            # Sleep until the next inference slot instead of polling the clock
+            wait_until(next_due)
+            item = frame_slot.get(last_seq, timeout=5)
+            if item is None:
                 continue
-                
-            with frame_lock:
-                if latest_frame is None:
-                    continue
-                frame = latest_frame.copy()
+            last_seq, frame_time, frame = item
+
+            config = get_current_config() or {}
+            next_due = time.time() + config.get("inferenceInterval", 1.0)
 
-            # Force flush the output buffer
+            result = infer(frame, frame_time)
+            if result is not None:
+                counting_queue.put((frame_time, *result))
+
+        except Exception as e:
+            logger.error(f"Error in inference stage: {str(e)}")
             sys.stdout.flush()
-            
-            results = model(frame, verbose=False)[0]
-            detections = results.boxes
-            class_names = model.names
+            time.sleep(1)  # Add small delay to prevent tight error loops
 
-            raw_count = defaultdict(int)  # Changed to defaultdict for dynamic class handling
-            
-            if detections is not None:
-                for box in detections:
-                    cls_id = int(box.cls[0].item())
-                    conf = float(box.conf[0].item())
-                    if conf < 0.3:
-                        continue
-
-                    class_name = class_names[cls_id] if cls_id < len(class_names) else str(cls_id)
-                    # Only count if class_name is in our specified list
-                    if class_name in all_classes:
-                        raw_count[class_name] += 1
-                
-                        # # Get box coordinates and draw only for specified classes
-                        # x1, y1, x2, y2 = map(int, box.xyxy[0])
-                        # cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                        # cv2.putText(frame, f"{class_name} {conf:.2f} ", (x1, y1 - 10),
-                        #         cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+def count_frames():
+    """Counting stage: smooth raw counts and queue a message whenever a class count rises or a line/zone event happens."""
+    count, aggregator = make_count_step(get_current_config() or {}, publish_queue.put)
+    if aggregator is not None:
+        aggregator.start()
 
-            # Specify classes to track like person, car, etc.
-            
-            
-            # Update count window for specified classes only
-            for class_name in all_classes:
-                count_window[class_name].append(raw_count.get(class_name, 0))
-                if len(count_window[class_name]) > count_window_size:
-                    count_window[class_name].pop(0)
-
-            ################################
-            # 2) Compute stable_count
-            ################################
-            stable_count = defaultdict(int)  # Changed to defaultdict
-            new_count = defaultdict(int)
-            for obj in raw_count:
-                if count_window[obj]:  # If we have counts for this object
-                    stable_count[obj] = int(round(statistics.median(count_window[obj])))
-
-            # 3) Naive Heuristics
-            for obj in raw_count:
-                if stable_count[obj] > prev_stable_count[obj]:
-                    diff = stable_count[obj] - prev_stable_count[obj]
-                    last_increase_time = current_time
-                    new_count[obj] = diff
-                    # print(f"[++++++++++++++++++++++++++++++++] Detected an increase of {diff} {obj}s. previous: {prev_stable_count[obj]} current: {stable_count[obj]}")
-
-            # time_since_increase = current_time - last_increase_time
-            # for obj in raw_count:
-            #     if time_since_increase > LONG_STAY_THRESHOLD and stable_count[obj] > 0:
-            #         new_count[obj] = stable_count[obj]
-            #         print(f"[^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^] Long stay triggered, added {stable_count[obj]} {obj}s")
-            #         last_increase_time = current_time
-
-            #print stable count for all objects
-            # for obj in stable_count:
-            # print(f"Stable count for person: {stable_count['person']} new count: {new_count['person']}")
-
-            ################################
-            # Add to batch only if stableCount > 0
-            ################################
-
-            #create a json object with the new count and the count window
-            json_object = {
-                "timestamp": int(time.time())*1000,
-                "count": new_count
-            }
+    while True:
+        count(*counting_queue.get())
+
+def publish_counts(json_object):
+    """Publish stage: send a traffic count message over MQTT."""
+    publish_log(json_object, "traffic")
+    sys.stdout.flush()  # Force flush
+
+def run_replay(path, out_path, config):
+    """Drive the capture -> inference -> counting code from recorded video as fast as it decodes.
+
+    Frames go through the same inference and counting steps as the live
+    stages (motion gate, trajectory counting, aggregation), paced and
+    bucketed on the recording's PTS timeline rather than the wall clock. The
+    messages that would have been published on the "traffic" topic are
+    written to `out_path` as JSON lines.
+    """
+    source = ReplayCapture(path)
+    stats = ReplayStats()
+    interval = config.get("inferenceInterval", 1.0)
+    next_due = None
+
+    with EventWriter(out_path) as events:
+        def publish(message):
+            events.write("traffic", message)
+
+        infer = make_inference_step(config)
+        count, aggregator = make_count_step(config, publish)
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                break
+            stats.frames += 1
 
+            frame_time = source.last_timestamp
+            if next_due is not None and frame_time < next_due:
+                continue
+            next_due = frame_time + interval
 
-            #publish the json object to mqtt
-            if(len(new_count) > 0):
-                publish_log(json.dumps(json_object), "traffic")
-                sys.stdout.flush()  # Force flush
+            result = infer(frame, frame_time)
+            if result is None:
+                continue
+            stats.inferences += 1
+            count(frame_time, *result)
+            if aggregator is not None:
+                for message in aggregator.flush(now=frame_time):
+                    publish(message)
 
-            prev_stable_count = stable_count
+        source.release()
+        if aggregator is not None:
+            for message in aggregator.flush(force=True):
+                publish(message)
+        summary = stats.summary(events.count)
 
-            #print the count window for all objects
-            # for obj in count_window:
-                # print(f"Count window for {obj}: {count_window[obj]}")
-            
-        except Exception as e:
-            sys.stdout.flush()
-            time.sleep(1)  # Add small delay to prevent tight error loops
+    logger.info(f"Replay finished: {json.dumps(summary)}")
+    return summary
 
 def process_frames():
     """ Process only the latest frame and track unique objects """
-    global latest_frame
-    while True:
-        with frame_lock:
-            if latest_frame is None:
-                continue
-            frame = latest_frame.copy()
+    global tracker
+    if tracker is None:
+        import supervision as sv
+        tracker = sv.ByteTrack()
 
-        # Detect objects using YOLO
-        results = model(frame)
+    last_seq = 0
+    while True:
+        item = frame_slot.get(last_seq, timeout=5)
+        if item is None:
+            continue
+        last_seq, _, frame = item
 
-        # Convert YOLO results to Supervision Tracker format
-        detections = sv.Detections.from_ultralytics(results[0])
+        # Detect objects and convert to Supervision Tracker format
+        detections = to_supervision(detector.detect(frame))
 
         detections = tracker.update_with_detections(detections)
 
-         # Extract class labels and tracker IDs
-        class_ids = detections.class_id
-        class_labels = [model.names[class_id] for class_id in class_ids]
-        tracker_ids = detections.tracker_id  # Get tracker IDs
-        
-        class_ids = detections.class_id
-        # class_labels = [model.names[class_id] for class_id in class_ids]
-        tracker_ids = detections.tracker_id  # Get tracker IDs
-        
-        for class_id, track_id in zip(class_ids,tracker_ids):
-        
-            class_name = model.names[class_id]  # Get class name
-
-            # Check if the object is newly detected
-            if track_id not in unique_objects[class_name]:
-                unique_objects[class_name].add(track_id)  # Track unique object
+        class_names = [detector.names[class_id] for class_id in detections.class_id]
+        unique_objects.update(class_names, detections.tracker_id)  # Track unique objects
                 
       
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 # Start threads
 def main():
+    global counting_queue, publish_queue
     sys.stdout.flush()
+
+    if args.replay:
+        config = {}
+        if args.replay_config:
+            with open(args.replay_config) as f:
+                config = json.load(f)
+        if args.replay_interval is not None:
+            config["inferenceInterval"] = args.replay_interval
+        if args.count_window is not None:
+            config["countWindowSize"] = args.count_window
+        if args.no_motion_gate:
+            config["motionGate"] = {**config.get("motionGate", {}), "enabled": False}
+        load_detector({"backend": args.backend, "model": args.model})
+        run_replay(args.replay, args.replay_out, config)
+        return
+
+    # Subscribe to topic with message handler after logger is initialized
+    subscribe_to_topic(test_topic, message_handler)
     
     config_thread = threading.Thread(target=update_config, daemon=True)
     capture_thread = threading.Thread(target=capture_frames, daemon=True)
     process_thread = threading.Thread(target=process_frames2, daemon=True)
+    counting_thread = threading.Thread(target=count_frames, daemon=True)
     billboard_thread = threading.Thread(target=monitor_billboard, daemon=True)
 
     try:
         config_thread.start()  # Start config update thread first
-        time.sleep(2)  # Give it time to get initial config
-        capture_thread.start()
-        # process_thread.start()
+        config_ready.wait(timeout=10)  # Wait for the initial config
+        config = get_current_config() or {}
+
+        configure_outbox(config.get("mqtt"))
+        pipeline_config = config.get("pipeline", {})
+        counting_queue = make_queue("counting", pipeline_config)
+        publish_queue = make_queue("publish", pipeline_config, default_size=100, per_frame=False)
+        Metrics.start_reporter(pipeline_config.get("metricsInterval", 300))
+
+        # Billboard snapshots fetch their own keyframes, so only build the
+        # detector and decode continuously when the traffic pipeline is enabled
+        service_types = ["billboard"]
+        if traffic_enabled(config):
+            load_detector(config.get("detector"))
+            capture_thread.start()
+            process_thread.start()
+            counting_thread.start()
+            start_stage("publish", publish_queue, publish_counts)
+            service_types.insert(0, "traffic")
         billboard_thread.start()
+        Metrics.record_startup("camera-processing:" + "+".join(service_types))
 
         while True:
             sys.stdout.flush()
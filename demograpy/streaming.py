@@ -1,22 +1,27 @@
 import datetime
 import time
-import statistics
 import cv2
 import numpy as np
-import requests
 import threading
 import queue
 import json
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+utils_folder = os.path.join(current_dir, '..', 'boot', 'services', 'utils')
+sys.path.append(utils_folder)
+
+from detector import create_detector
+from postprocess import ClassCounter
+from counting import StableCounter
+import httpclient
+from codec import strip_credentials
 
 ENABLE_IMG_SHOW = True
 ENABLE_API_CALL = True
 ENABLE_BOUNDING_BOX = True
 
-try:
-    from ultralytics import YOLO
-except ImportError:
-    raise ImportError("Please install ultralytics or provide your own detection code.")
-
 def get_cpu_serial():
     """Fetch the CPU serial number as a unique device ID."""
     try:
@@ -48,10 +53,9 @@ def load_config(device_id):
     """Load configuration from the API."""
     config_url = f"https://railway.adboardbooking.com/api/camera/v1/config/{device_id}"
     try:
-        response = requests.get(config_url, timeout=5)
-        response.raise_for_status()
+        response = httpclient.get(config_url, timeout="config", raise_for_status=True)
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except httpclient.HttpError as e:
         print(f"[ERROR] Unable to load config: {e}")
         return None
 
@@ -64,14 +68,14 @@ def api_worker(queue, endpoint, detection_batch_file):
 
         try:
             print(f"[DEBUG] Sending batch: {len(batch)}")
-            response = requests.post(endpoint, json={"data": batch}, timeout=5)
+            response = httpclient.post(endpoint, json={"data": batch}, timeout="upload")
             if response.status_code == 200:
                 print(f"[INFO] Batch sent successfully: {len(batch)}")
                 save_detection_batch(detection_batch_file, [])
             else:
                 print(f"[WARN] API returned: {response.status_code}, {response.text}")
                 queue.put(batch)
-        except requests.exceptions.RequestException as e:
+        except httpclient.HttpError as e:
             print(f"[ERROR] API request error: {e}")
             queue.put(batch)
 
@@ -121,7 +125,8 @@ def main():
 
     print(f"[INFO] Loaded configuration: {config}")
 
-    model = YOLO("yolov8n-person.pt")
+    detector = create_detector({"model": "yolov8n-person.pt", **config.get("detector", {})})
+    person_counter = ClassCounter(detector.names, ["person"], min_confidence=0.3)
     face_net, age_net, gender_net = load_age_gender_models()
 
     cap = cv2.VideoCapture(RTSP_STREAM_URL)
@@ -137,8 +142,7 @@ def main():
     
     last_increase_time = time.time()
 
-    count_window = {"person": []}
-    prev_stable_count = {"person": 0}
+    counter = StableCounter(["person"], count_window_size)
 
     api_queue = queue.Queue()
     api_thread = threading.Thread(target=api_worker, args=(api_queue, API_ENDPOINT, DETECTION_BATCH_FILE), daemon=True)
@@ -155,48 +159,38 @@ def main():
         if (current_time - last_inference_time) >= INFERENCE_INTERVAL:
             last_inference_time = current_time
 
-            results = model(frame, verbose=False)[0]
-            detections = results.boxes
-            class_names = model.names
+            detections = detector.detect(frame)
 
-            raw_count = {"person": 0}
+            raw_count = person_counter.count_dict(detections)
             new_count = {"person": 0}
             new_people_info = []
-            if detections is not None:
-                for box in detections:
-                    cls_id = int(box.cls[0].item())
-                    conf = float(box.conf[0].item())
-                    if conf < 0.3:
-                        continue
-                    class_name = class_names[cls_id] if cls_id < len(class_names) else str(cls_id)
-                    # Get box coordinates
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                     # Draw bounding box
+
+            # Age/gender only for the confident person boxes
+            people = person_counter.filter(detections)
+            for x1, y1, x2, y2 in people.xyxy.astype(int).tolist():
+                face = frame[y1:y2, x1:x2]
+                if face.size > 0:
+                    age, gender = detect_age_gender(face, (face_net, age_net, gender_net))
+                    new_people_info.append({"age": age, "gender": gender})
+
+            if ENABLE_IMG_SHOW and ENABLE_BOUNDING_BOX:
+                confident = detections.confidence >= 0.3
+                for cls_id, conf, xyxy in zip(detections.class_id[confident], detections.confidence[confident],
+                                              detections.xyxy[confident].astype(int).tolist()):
+                    x1, y1, x2, y2 = xyxy
+                    # Draw bounding box
                     cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    
+
                     # Add confidence score
-                    conf = float(box.conf[0])
+                    class_name = detector.names.get(cls_id, str(cls_id))
                     cv2.putText(frame, f"{class_name} {conf:.2f} ", (x1, y1 - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
 
-                    if class_name == "person":
-                        raw_count["person"] += 1
-                        x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                        face = frame[y1:y2, x1:x2]
-                        if face.size > 0:
-                            age, gender = detect_age_gender(face, (face_net, age_net, gender_net))
-                            new_people_info.append({"age": age, "gender": gender})
-
-            count_window["person"].append(raw_count["person"])
-            if len(count_window["person"]) > count_window_size:
-                count_window["person"].pop(0)
+            increases = counter.update(raw_count)
+            stable_count = counter.stable_count
 
-            stable_count = {
-                "person": int(round(statistics.median(count_window["person"]))) if count_window["person"] else 0
-            }
-
-            if stable_count["person"] > prev_stable_count["person"]:
-                diff = stable_count["person"] - prev_stable_count["person"]
+            if "person" in increases:
+                diff = increases["person"]
                 new_count['person'] = diff
                 last_increase_time = current_time
                 print(f"[INFO] Detected {diff} new people.")
@@ -209,11 +203,9 @@ def main():
                     print(f"[INFO] Long stay triggered, added {stable_count[obj]} {obj}s")
                     last_increase_time = current_time
 
-            prev_stable_count = stable_count
-
             if any(new_count[obj] > 0 for obj in new_count):
                 detection_batch.append({
-                    "cameraUrl": RTSP_STREAM_URL,
+                    "cameraUrl": strip_credentials(RTSP_STREAM_URL),
                     "deviceId": DEVICE_ID,
                     "timestamp": int(current_time) * 1000,
                     "newCount": new_count,  # New detections since last inference
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boot", "services", "utils"))
+import capture  # noqa: E402
+
+WIDTH, HEIGHT = 64, 48
+
+
+def bgr_frame():
+    """A frame with two flat colour halves, so chroma subsampling keeps them close."""
+    frame = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    frame[:, :WIDTH // 2] = (200, 60, 20)  # Mostly blue
+    frame[:, WIDTH // 2:] = (30, 80, 220)  # Mostly red
+    return frame
+
+
+def pipe_bytes(frame, pix_fmt):
+    """`frame` as ffmpeg writes it to the pipe in `pix_fmt`."""
+    if pix_fmt == "bgr24":
+        raw = frame
+    elif pix_fmt == "rgb24":
+        raw = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    elif pix_fmt == "gray":
+        raw = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    else:
+        raw = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+        if pix_fmt == "nv12":
+            # Same luma plane, then the U and V planes interleaved
+            chroma = raw[HEIGHT:].reshape(2, -1)
+            raw = np.concatenate([raw[:HEIGHT].reshape(-1), chroma.T.reshape(-1)])
+    return np.ascontiguousarray(raw).tobytes()
+
+
+@pytest.fixture
+def ffmpeg_output(tmp_path, monkeypatch):
+    """Replace the ffmpeg subprocess with `cat` of a file holding the given pipe bytes."""
+    def use(data):
+        path = tmp_path / "frames.raw"
+        path.write_bytes(data)
+        popen = subprocess.Popen
+        monkeypatch.setattr(capture.subprocess, "Popen", lambda command, **kwargs: popen(["cat", str(path)], **kwargs))
+    return use
+
+
+@pytest.mark.parametrize("pix_fmt", sorted(capture.PIXEL_FORMATS))
+def test_read_returns_bgr_frames(pix_fmt, ffmpeg_output):
+    frame = bgr_frame()
+    ffmpeg_output(pipe_bytes(frame, pix_fmt) * 2)
+    cap = capture.FFmpegCapture("clip.mp4", size=(WIDTH, HEIGHT), pix_fmt=pix_fmt)
+
+    ret, first = cap.read()
+    ret2, second = cap.read()
+    assert ret and ret2
+    assert first.shape == second.shape == (HEIGHT, WIDTH, 3)
+    assert first.dtype == np.uint8
+    assert first is not second and not np.shares_memory(first, second)
+
+    expected = cv2.cvtColor(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR) if pix_fmt == "gray" else frame
+    assert np.abs(first.astype(int) - expected).max() <= 3  # YUV round trip rounding
+
+    assert cap.read() == (False, None)
+    cap.release()
+
+
+def test_unsupported_pixel_format():
+    with pytest.raises(ValueError):
+        capture.FFmpegCapture("clip.mp4", size=(WIDTH, HEIGHT), pix_fmt="yuyv422")
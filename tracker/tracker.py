@@ -1,50 +1,109 @@
-import math
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None  # Falls back to global nearest-first matching
+
+
+def greedy_assignment(distances, max_distance):
+    """Match rows to columns closest pair first; order-independent, no scipy needed."""
+    rows, cols = np.nonzero(distances < max_distance)
+    order = np.argsort(distances[rows, cols], kind="stable")
+    used_rows = np.zeros(distances.shape[0], dtype=bool)
+    used_cols = np.zeros(distances.shape[1], dtype=bool)
+    matched_rows, matched_cols = [], []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if used_rows[row] or used_cols[col]:
+            continue
+        used_rows[row] = used_cols[col] = True
+        matched_rows.append(row)
+        matched_cols.append(col)
+    return np.array(matched_rows, dtype=np.intp), np.array(matched_cols, dtype=np.intp)
+
+
+def optimal_assignment(distances, max_distance):
+    """Minimum total distance matching, keeping only pairs closer than `max_distance`."""
+    if linear_sum_assignment is None:
+        return greedy_assignment(distances, max_distance)
+    # Pairs that can never match are priced out so they do not distort the rest
+    cost = np.where(distances < max_distance, distances, max_distance * (1 + sum(distances.shape)))
+    rows, cols = linear_sum_assignment(cost)
+    keep = distances[rows, cols] < max_distance
+    return rows[keep], cols[keep]
 
 
 class Tracker:
-    def __init__(self):
-        # Store the center positions of the objects
-        self.center_points = {}
+    """Centroid tracker: keeps an ID per object while its center moves less than `max_distance` px a frame.
+
+    Each update builds the full track x detection distance matrix in numpy
+    and solves it as an assignment problem (scipy's linear_sum_assignment
+    when installed, closest-pair-first otherwise), so the result does not
+    depend on the order of the boxes. A track that is not matched is kept
+    for `lost_track_buffer` updates so an object missed for a few frames
+    keeps its ID. Track state is stored as parallel arrays (struct of
+    arrays) rather than one object per track.
+    """
+
+    def __init__(self, max_distance=35, lost_track_buffer=30):
+        self.max_distance = max_distance
+        self.lost_track_buffer = lost_track_buffer
+        self.ids = np.empty(0, dtype=np.int64)
+        self.centers = np.empty((0, 2), dtype=np.float64)
+        self.lost = np.empty(0, dtype=np.int32)  # Updates since each track was last matched
         # Keep the count of the IDs
         # each time a new object id detected, the count will increase by one
         self.id_count = 0
 
+    @property
+    def center_points(self):
+        """{id: (cx, cy)} of the tracks matched in the last update."""
+        live = self.lost == 0
+        return {int(i): (cx, cy) for i, (cx, cy) in zip(self.ids[live], self.centers[live].tolist())}
+
+    def assign(self, centers):
+        """Return a track ID for each row of `centers` (N x 2), creating tracks as needed."""
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        assigned = np.empty(len(centers), dtype=np.int64)
+        matched = np.zeros(len(self.ids), dtype=bool)
+        is_new = np.ones(len(centers), dtype=bool)
+
+        if len(self.ids) and len(centers):
+            # In place on two N x M buffers (np.hypot is several times slower here)
+            distances = np.subtract.outer(self.centers[:, 0], centers[:, 0])
+            dy = np.subtract.outer(self.centers[:, 1], centers[:, 1])
+            distances *= distances
+            dy *= dy
+            distances += dy
+            np.sqrt(distances, out=distances)
+            rows, cols = optimal_assignment(distances, self.max_distance)
+            assigned[cols] = self.ids[rows]
+            self.centers[rows] = centers[cols]
+            matched[rows] = True
+            is_new[cols] = False
+
+        # Age unmatched tracks and forget those past the lost buffer
+        self.lost[matched] = 0
+        self.lost[~matched] += 1
+        keep = self.lost <= self.lost_track_buffer
+        new_ids = np.arange(self.id_count, self.id_count + int(is_new.sum()), dtype=np.int64)
+        self.id_count += len(new_ids)
+        assigned[is_new] = new_ids
+
+        self.ids = np.concatenate([self.ids[keep], new_ids])
+        self.centers = np.concatenate([self.centers[keep], centers[is_new]])
+        self.lost = np.concatenate([self.lost[keep], np.zeros(len(new_ids), dtype=np.int32)])
+        return assigned
 
     def update(self, objects_rect):
-        # Objects boxes and ids
-        objects_bbs_ids = []
-
-        # Get center point of new object
-        for rect in objects_rect:
-            x, y, w, h = rect
-            cx = (x + x + w) // 2
-            cy = (y + y + h) // 2
-
-            # Find out if that object was detected already
-            same_object_detected = False
-            for id, pt in self.center_points.items():
-                dist = math.hypot(cx - pt[0], cy - pt[1])
-
-                if dist < 35:
-                    self.center_points[id] = (cx, cy)
-#                    print(self.center_points)
-                    objects_bbs_ids.append([x, y, w, h, id])
-                    same_object_detected = True
-                    break
-
-            # New object is detected we assign the ID to that object
-            if same_object_detected is False:
-                self.center_points[self.id_count] = (cx, cy)
-                objects_bbs_ids.append([x, y, w, h, self.id_count])
-                self.id_count += 1
-
-        # Clean the dictionary by center points to remove IDS not used anymore
-        new_center_points = {}
-        for obj_bb_id in objects_bbs_ids:
-            _, _, _, _, object_id = obj_bb_id
-            center = self.center_points[object_id]
-            new_center_points[object_id] = center
-
-        # Update dictionary with IDs not used removed
-        self.center_points = new_center_points.copy()
-        return objects_bbs_ids
\ No newline at end of file
+        """Track (x, y, w, h) boxes; return [x, y, w, h, id] for each."""
+        rects = np.asarray(objects_rect, dtype=np.int64).reshape(-1, 4)
+        centers = (2 * rects[:, :2] + rects[:, 2:]) // 2
+        ids = self.assign(centers)
+        return [[x, y, w, h, object_id] for (x, y, w, h), object_id in zip(rects.tolist(), ids.tolist())]
+
+    def update_with_detections(self, detections):
+        """Drop-in for sv.ByteTrack.update_with_detections: sets tracker_id from box centers."""
+        xyxy = np.asarray(detections.xyxy, dtype=np.float64).reshape(-1, 4)
+        detections.tracker_id = self.assign((xyxy[:, :2] + xyxy[:, 2:]) / 2)
+        return detections
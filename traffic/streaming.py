@@ -1,22 +1,37 @@
 import datetime
 import time
-import statistics
 import cv2
 import numpy as np
-import requests
 import threading
-import queue
 import json
+import argparse
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+utils_folder = os.path.join(current_dir, '..', 'boot', 'services', 'utils')
+sys.path.append(utils_folder)
+
+from counting import StableCounter
+import httpclient
+from replay import ReplayCapture, EventWriter, ReplayStats
+from detector import create_detector
+from postprocess import ClassCounter
+from journal import make_journal, import_batch_file
+from uploader import make_uploader
+from codec import strip_credentials
 
 ENABLE_IMG_SHOW = False
 ENABLE_API_CALL = True
 ENABLE_BOUNDING_BOX = False
 MODEL_NAME = "yolov8n.pt"
 
-try:
-    from ultralytics import YOLO
-except ImportError:
-    raise ImportError("Please install ultralytics or provide your own detection code.")
+parser = argparse.ArgumentParser(description="Traffic counting from an RTSP stream")
+parser.add_argument("--replay", default=None,
+                    help="Replay a video file or directory of clips at full speed instead of the live stream")
+parser.add_argument("--replay-out", default="replay_events.jsonl",
+                    help="Where to write detection records produced by --replay ('-' for stdout)")
+args = parser.parse_args()
 
 def get_cpu_serial():
     """Fetch the CPU serial number as a unique device ID."""
@@ -29,58 +44,17 @@ def get_cpu_serial():
         print(f"[ERROR] Unable to read CPU serial: {e}")
     return "UNKNOWN"
 
-def load_detection_batch(filename):
-    """Load detection batch from a file."""
-    try:
-        with open(filename, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
-
-def save_detection_batch(filename, detection_batch):
-    """Save detection batch to a file."""
-    try:
-        with open(filename, "w") as f:
-            json.dump(detection_batch, f)
-    except Exception as e:
-        print(f"[ERROR] Unable to save detection batch: {e}")
-
 def load_config(device_id):
     """Load configuration from the API."""
     # config_url = f"http://localhost:3000/api/camera/v1/config/{device_id}"
     config_url = f"https://railway.adboardbooking.com/api/camera/v1/config/{device_id}"
     try:
-        response = requests.get(config_url, timeout=5)
-        response.raise_for_status()
+        response = httpclient.get(config_url, timeout="config", raise_for_status=True)
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except httpclient.HttpError as e:
         print(f"[ERROR] Unable to load config: {e}")
         return None
 
-def api_worker(queue, endpoint, detection_batch_file):
-    """Worker thread to send API requests."""
-    while True:
-        batch = queue.get()  # Get a batch from the queue
-        if batch is None:
-            break  # Stop the thread if None is received
-
-        try:
-            print(f"[DEBUG] Sending batch: {len(batch)}")
-            response = requests.post(endpoint, json={"data": batch}, timeout=5)
-            if response.status_code == 200:
-                print(f"[INFO] Batch sent successfully: {len(batch)}")
-                save_detection_batch(detection_batch_file, [])  # Clear the file after successful API call
-            else:
-                print(f"[WARN] API returned: {response.status_code}, {response.text}")
-                # Re-add batch to the queue for retry
-                queue.put(batch)
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] API request error: {e}")
-            # Re-add batch to the queue for retry
-            queue.put(batch)
-
-        queue.task_done()
-
 def main():
     ##########################
     # Configuration
@@ -88,8 +62,9 @@ def main():
     DEVICE_ID = get_cpu_serial()
     print(f"[INFO] Device ID: {DEVICE_ID}")
 
-    config = load_config(DEVICE_ID)
-    if not config:
+    # Replays run offline on default settings
+    config = {} if args.replay else load_config(DEVICE_ID)
+    if config is None:
         print("[ERROR] Failed to load configuration. Exiting...")
         return
 
@@ -97,103 +72,104 @@ def main():
     INFERENCE_INTERVAL = config.get("inferenceInterval", 1.0)
     LONG_STAY_THRESHOLD = config.get("longStayThreshold", 20)
     API_ENDPOINT = config.get("apiEndpoint", "https://railway.adboardbooking.com/api/camera/v1/traffic")
-    SAVE_INTERVAL = config.get("saveInterval", 60)  # Save to file every 10 minutes (600 seconds)
+    SAVE_INTERVAL = config.get("saveInterval", 60)  # fsync the journal at most every minute
     API_CALL_INTERVAL = config.get("apiCallInterval", 300)
     count_window_size = config.get("countWindowSize", 5)
-    DETECTION_BATCH_FILE = "detection_batch.json"
+    DETECTION_BATCH_FILE = "detection_batch.json"  # Pre-journal batch file, imported once
+    DETECTION_JOURNAL_DIR = "detection_journal"
 
     print(f"[INFO] Loaded configuration: {config}")
 
-    model = YOLO(MODEL_NAME)  # YOLOv8 nano; pick a small model for Raspberry Pi
-
-    cap = cv2.VideoCapture(RTSP_STREAM_URL)
+    # YOLOv8 nano by default; the "detector" config section can select an ONNX/OpenVINO export
+    detector = create_detector({"model": MODEL_NAME, **config.get("detector", {})})
+
+    if args.replay:
+        # Recorded clips, decoded as fast as possible with their own PTS as the clock
+        cap = ReplayCapture(args.replay)
+        replay_events = EventWriter(args.replay_out)
+        replay_stats = ReplayStats()
+    else:
+        cap = cv2.VideoCapture(RTSP_STREAM_URL)
+        replay_events = None
     if not cap.isOpened():
         print("Error: Unable to open RTSP stream.")
         return
 
-    last_inference_time = 0
-    last_save_time = time.time()
-    last_api_call_time = time.time()
+    last_inference_time = float("-inf")
+
+    # Records are appended to an on-disk journal and uploaded from there; replays write events instead
+    journal = None
+    if not args.replay:
+        journal = make_journal(config, DETECTION_JOURNAL_DIR, fsync_interval=SAVE_INTERVAL)
+        import_batch_file(journal, DETECTION_BATCH_FILE)
 
     # Variables for our naive logic
-    detection_batch = load_detection_batch(DETECTION_BATCH_FILE)
    
-    last_increase_time = time.time()
+    last_increase_time = None
 
-    # We'll keep a short history (window) of detection counts to smooth out flickers
-    count_window = {"car": [], "person": []}
+    # Median-smoothed counts over a short window to smooth out flickers
+    counter = StableCounter(["car", "person"], count_window_size)
+    class_counter = ClassCounter(detector.names, ["car", "person"], min_confidence=0.3)
+    car_counter = ClassCounter(detector.names, ["car"], min_confidence=0.3)
+    detections = None
 
-    # We also store a "stable_count" from the previous loop to compare changes
-    prev_stable_count = {"car": 0, "person": 0}
-
-    # Queue for API requests
-    api_queue = queue.Queue()
-    api_thread = threading.Thread(target=api_worker, args=(api_queue, API_ENDPOINT, DETECTION_BATCH_FILE), daemon=True)
-    api_thread.start()
+    # Uploads the journal every API_CALL_INTERVAL, backing off while the API is down
+    uploader = None
+    if journal is not None and ENABLE_API_CALL:
+        uploader = make_uploader(config, journal, API_ENDPOINT, interval=API_CALL_INTERVAL)
+        uploader.start()
 
     while True:
         ret, frame = cap.read()
         if not ret:
+            if args.replay:
+                break
             print("[WARN] Could not read frame. Retrying...")
             time.sleep(1)
             continue
 
-        current_time = time.time()
+        current_time = cap.last_timestamp if args.replay else time.time()
+        if last_increase_time is None:
+            last_increase_time = current_time
+        if args.replay:
+            replay_stats.frames += 1
         if (current_time - last_inference_time) >= INFERENCE_INTERVAL:
             last_inference_time = current_time
 
             ################################
             # 1) Detect how many cars and persons
             ################################
-            results = model(frame, verbose=False)[0]
-            detections = results.boxes
-            class_names = model.names
+            if args.replay:
+                replay_stats.inferences += 1
+            detections = detector.detect(frame)
 
-            raw_count = {"car": 0, "person": 0}
+            # One confidence mask + bincount instead of a per-box loop
+            raw_count = class_counter.count_dict(detections)
             new_count = {"car": 0, "person": 0}
             new_people_info = []
-            if detections is not None:
-                for box in detections:
-                    cls_id = int(box.cls[0].item())
-                    conf = float(box.conf[0].item())
-                    if conf < 0.3:
-                        continue
-
-                    class_name = class_names[cls_id] if cls_id < len(class_names) else str(cls_id)
-
-                    if class_name in raw_count:
-                        raw_count[class_name] += 1
-                        # Get box coordinates
-                        x1, y1, x2, y2 = map(int, box.xyxy[0])
-                        # Draw bounding box
-                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                        
-                        # Add confidence score
-                        conf = float(box.conf[0])
-                        cv2.putText(frame, f"{class_name} {conf:.2f} ", (x1, y1 - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-            # Add this raw count to our rolling window
-            for obj in raw_count:
-                count_window[obj].append(raw_count[obj])
-                if len(count_window[obj]) > count_window_size:
-                    count_window[obj].pop(0)
+
+            if ENABLE_IMG_SHOW:
+                counted = class_counter.filter(detections)
+                for cls_id, conf, xyxy in zip(counted.class_id, counted.confidence, counted.xyxy.astype(int).tolist()):
+                    x1, y1, x2, y2 = xyxy
+                    # Draw bounding box
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+
+                    # Add confidence score
+                    cv2.putText(frame, f"{detector.names[cls_id]} {conf:.2f} ", (x1, y1 - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
 
             ################################
-            # 2) Compute stable_count
+            # 2) Add this raw count to the rolling window and compute stable_count
             ################################
-            stable_count = {
-                obj: int(round(statistics.median(count_window[obj]))) if count_window[obj] else 0
-                for obj in raw_count
-            }
+            increases = counter.update(raw_count)
+            stable_count = counter.stable_count
 
             # 3) Naive Heuristics
-            for obj in raw_count:
-                if stable_count[obj] > prev_stable_count[obj]:
-                    diff = stable_count[obj] - prev_stable_count[obj]
-                    last_increase_time = current_time
-                    new_count[obj] = diff
-                    print(f"[++++++++++++++++++++++++++++++++] Detected an increase of {diff} {obj}s.")
+            for obj, diff in increases.items():
+                last_increase_time = current_time
+                new_count[obj] = diff
+                print(f"[++++++++++++++++++++++++++++++++] Detected an increase of {diff} {obj}s.")
 
             time_since_increase = current_time - last_increase_time
             for obj in raw_count:
@@ -202,73 +178,51 @@ def main():
                     print(f"[^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^] Long stay triggered, added {stable_count[obj]} {obj}s")
                     last_increase_time = current_time
 
-            prev_stable_count = stable_count
-
             ################################
             # Add to batch only if stableCount > 0
             ################################
             if any(new_count[obj] > 0 for obj in new_count):
-                detection_batch.append({
-                    "cameraUrl": RTSP_STREAM_URL,
+                record = {
+                    "cameraUrl": strip_credentials(RTSP_STREAM_URL),
                     "deviceId": DEVICE_ID,
                     "timestamp": int(current_time)*1000,
                     "newCount": new_count,  # New detections since last inference
                     "stableCount": stable_count, # Smoothed detection count
                     "newPeopleInfo": new_people_info
-                })
-
-            ################################
-            # Save detection batch every SAVE_INTERVAL
-            ################################
-            if (current_time - last_save_time) >= SAVE_INTERVAL:
-                save_detection_batch(DETECTION_BATCH_FILE, detection_batch)
-                last_save_time = current_time
-
-            ################################
-            # Make API call every API_CALL_INTERVAL
-            ################################
-            if (current_time - last_api_call_time) >= API_CALL_INTERVAL & len(detection_batch) > 0:
-                # print(f"[INFO] Sending batch: {len(detection_batch)}")
-                if ENABLE_API_CALL:
-                    api_queue.put(detection_batch.copy())
-                detection_batch.clear()
-                last_api_call_time = current_time
+                }
+                if replay_events:
+                    replay_events.write("traffic", record)
+                else:
+                    journal.append(record)
 
             # All person stats
             for obj in raw_count:
                 print(f"[{datetime.datetime.fromtimestamp(current_time).strftime('%Y-%m-%d %H:%M:%S')}] {obj}: Raw: {raw_count[obj]} Stable: {stable_count[obj]} New: {new_count[obj]}")
 
         if detections is not None and ENABLE_BOUNDING_BOX and ENABLE_IMG_SHOW:
-            for box in detections:
-                cls_id = int(box.cls[0].item())
-                conf = float(box.conf[0].item())
-                if conf < 0.3:
-                    continue
-
-                class_name = class_names[cls_id] if cls_id in class_names else str(cls_id)
-
-                # We can draw bounding boxes for *any* class or specifically for "car".
-                if class_name == "car":
-                    x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-
-                    # Draw rectangle
-                    color = (0, 255, 0)  # BGR: green
-                    thickness = 2
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
-
-                    # Label text with class and confidence
-                    label_text = f"{class_name} {conf:.2f}"
-                    font_scale = 0.5
-                    font_thickness = 1
-                    cv2.putText(
-                        frame,
-                        label_text,
-                        (x1, max(0, y1 - 5)),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        font_scale,
-                        color,
-                        font_thickness
-                    )
+            # We can draw bounding boxes for *any* class or specifically for "car".
+            cars = car_counter.mask(detections)
+            for conf, xyxy in zip(detections.confidence[cars], detections.xyxy[cars].astype(int).tolist()):
+                x1, y1, x2, y2 = xyxy
+
+                # Draw rectangle
+                color = (0, 255, 0)  # BGR: green
+                thickness = 2
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+
+                # Label text with class and confidence
+                label_text = f"car {conf:.2f}"
+                font_scale = 0.5
+                font_thickness = 1
+                cv2.putText(
+                    frame,
+                    label_text,
+                    (x1, max(0, y1 - 5)),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale,
+                    color,
+                    font_thickness
+                )
 
         # (Optional) Show the frame
         if ENABLE_IMG_SHOW:
@@ -278,8 +232,13 @@ def main():
 
     cap.release()
     cv2.destroyAllWindows()
-    api_queue.put(None)  # Signal the API thread to exit
-    api_thread.join()
+    if replay_events:
+        replay_events.close()
+        print(f"[INFO] Replay finished: {json.dumps(replay_stats.summary(replay_events.count))}")
+    if uploader:
+        uploader.stop()
+    if journal is not None:
+        journal.close()
 
 if __name__ == "__main__":
     main()